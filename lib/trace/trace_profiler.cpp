@@ -40,25 +40,76 @@ Profiler::Profiler()
       cpuTimes(false),
       gpuTimes(true),
       pixelsDrawn(false),
-      memoryUsage(false)
+      memoryUsage(false),
+      binary(false),
+      frameNo(0),
+      fields(0),
+      recordSize(0),
+      numRecords(0)
 {
+    static_assert(sizeof(ProfileRecord) == 16, "unexpected profile record padding");
 }
 
 Profiler::~Profiler()
 {
 }
 
-void Profiler::setup(bool cpuTimes_, bool gpuTimes_, bool pixelsDrawn_, bool memoryUsage_, int64_t minCpuTime_)
+void Profiler::setup(bool cpuTimes_, bool gpuTimes_, bool pixelsDrawn_, bool memoryUsage_, int64_t minCpuTime_, bool binary_)
 {
     cpuTimes = cpuTimes_;
     gpuTimes = gpuTimes_;
     pixelsDrawn = pixelsDrawn_;
     memoryUsage = memoryUsage_;
     minCpuTime = minCpuTime_;
+    binary = binary_;
+
+    if (binary) {
+        // Only store the fields being profiled
+        unsigned numValues = 0;
+        fields = 0;
+        if (gpuTimes) {
+            fields |= PROFILE_FIELD_GPU;
+            numValues += 2;
+        }
+        if (cpuTimes) {
+            fields |= PROFILE_FIELD_CPU;
+            numValues += 2;
+        }
+        if (pixelsDrawn) {
+            fields |= PROFILE_FIELD_PIXELS;
+            numValues += 1;
+        }
+        if (memoryUsage) {
+            fields |= PROFILE_FIELD_MEMORY;
+            numValues += 4;
+        }
+        recordSize = sizeof(ProfileRecord) + numValues * sizeof(int64_t);
+
+        ProfileHeader header;
+        memcpy(header.magic, PROFILE_MAGIC, sizeof header.magic);
+        header.version = PROFILE_VERSION;
+        header.recordSize = recordSize;
+        header.fields = fields;
+        header.reserved = 0;
+        std::cout.write(reinterpret_cast<const char *>(&header), sizeof header);
+        return;
+    }
 
     std::cout << "# call no gpu_start gpu_dura cpu_start cpu_dura vsize_start vsize_dura rss_start rss_dura pixels program name" << std::endl;
 }
 
+uint32_t Profiler::getNameIndex(const char *name)
+{
+    auto res = nameIndices.find(name);
+    if (res != nameIndices.end()) {
+        return res->second;
+    }
+    uint32_t index = static_cast<uint32_t>(names.size());
+    names.push_back(name);
+    nameIndices[name] = index;
+    return index;
+}
+
 int64_t Profiler::getBaseCpuTime()
 {
     return baseCpuTime;
@@ -141,6 +192,39 @@ void Profiler::addCall(unsigned no,
         rssDuration = 0;
     }
 
+    if (binary) {
+        ProfileRecord record;
+        record.no = no;
+        record.program = program;
+        record.name = getNameIndex(name);
+        record.frame = frameNo;
+
+        int64_t values[9];
+        unsigned numValues = 0;
+        if (fields & PROFILE_FIELD_GPU) {
+            values[numValues++] = gpuStart;
+            values[numValues++] = gpuDuration;
+        }
+        if (fields & PROFILE_FIELD_CPU) {
+            values[numValues++] = cpuStart;
+            values[numValues++] = cpuDuration;
+        }
+        if (fields & PROFILE_FIELD_PIXELS) {
+            values[numValues++] = pixels;
+        }
+        if (fields & PROFILE_FIELD_MEMORY) {
+            values[numValues++] = vsizeStart;
+            values[numValues++] = vsizeDuration;
+            values[numValues++] = rssStart;
+            values[numValues++] = rssDuration;
+        }
+
+        std::cout.write(reinterpret_cast<const char *>(&record), sizeof record);
+        std::cout.write(reinterpret_cast<const char *>(values), numValues * sizeof values[0]);
+        ++numRecords;
+        return;
+    }
+
     std::cout << "call"
               << " " << no
               << " " << gpuStart
@@ -159,7 +243,47 @@ void Profiler::addCall(unsigned no,
 
 void Profiler::addFrameEnd()
 {
-    std::cout << "frame_end" << std::endl;
+    if (binary) {
+        frameEnds.push_back(numRecords);
+    } else {
+        std::cout << "frame_end" << std::endl;
+    }
+    ++frameNo;
+}
+
+void Profiler::addRenderingFinished(int64_t time)
+{
+    if (binary) {
+        renderingFinished.push_back(time);
+    } else {
+        std::cout << "rendering_finished " << time << std::endl;
+    }
+}
+
+void Profiler::finish()
+{
+    if (binary) {
+        ProfileFooter footer;
+        memcpy(footer.magic, PROFILE_FOOTER_MAGIC, sizeof footer.magic);
+
+        footer.frameEndsOffset = sizeof(ProfileHeader) + numRecords * recordSize;
+        for (auto frameEnd : frameEnds) {
+            std::cout.write(reinterpret_cast<const char *>(&frameEnd), sizeof frameEnd);
+        }
+
+        footer.renderingFinishedOffset = footer.frameEndsOffset + frameEnds.size() * sizeof(uint64_t);
+        for (auto time : renderingFinished) {
+            std::cout.write(reinterpret_cast<const char *>(&time), sizeof time);
+        }
+
+        footer.stringTableOffset = footer.renderingFinishedOffset + renderingFinished.size() * sizeof(int64_t);
+        for (auto &name : names) {
+            std::cout.write(name.c_str(), name.size() + 1);
+        }
+
+        std::cout.write(reinterpret_cast<const char *>(&footer), sizeof footer);
+    }
+    std::cout.flush();
 }
 
 void Profiler::parseLine(const char* in, Profile* profile)
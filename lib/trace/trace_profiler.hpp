@@ -27,6 +27,7 @@
 #pragma once
 
 #include <string>
+#include <unordered_map>
 #include <vector>
 #include <stdint.h>
 
@@ -94,13 +95,64 @@ struct Profile {
     std::vector<Program> programs;
 };
 
+/*
+ * Binary profile format.
+ *
+ * A ProfileHeader, followed by one record per call, followed by the trailer:
+ * the frame ends (the number of call records before every frame end, as
+ * uint64_t), the rendering finished times (int64_t), the string table (the
+ * NUL terminated names, in index order), and a ProfileFooter.
+ *
+ * Every record is a ProfileRecord followed by the int64_t values of the
+ * fields enabled in the header, in ProfileField order: gpuStart and
+ * gpuDuration; cpuStart and cpuDuration; pixels; vsizeStart, vsizeDuration,
+ * rssStart and rssDuration.
+ *
+ * Values are in host byte order, which readers can detect from the version
+ * field.  Truncated files (e.g., from a crashed retrace) lack the trailer,
+ * but their records are still valid.
+ */
+
+#define PROFILE_MAGIC "APITPROF"
+#define PROFILE_FOOTER_MAGIC "APITPEND"
+#define PROFILE_VERSION 2
+
+enum ProfileField {
+    PROFILE_FIELD_GPU = 1 << 0,
+    PROFILE_FIELD_CPU = 1 << 1,
+    PROFILE_FIELD_PIXELS = 1 << 2,
+    PROFILE_FIELD_MEMORY = 1 << 3,
+};
+
+struct ProfileHeader {
+    char magic[8];
+    uint32_t version;
+    uint32_t recordSize;
+    uint32_t fields; // ProfileField mask
+    uint32_t reserved;
+};
+
+struct ProfileRecord {
+    uint32_t no;
+    uint32_t program;
+    uint32_t name; // index into the string table
+    uint32_t frame;
+};
+
+struct ProfileFooter {
+    char magic[8];
+    uint64_t frameEndsOffset;
+    uint64_t renderingFinishedOffset;
+    uint64_t stringTableOffset;
+};
+
 class Profiler
 {
 public:
     Profiler();
     ~Profiler();
 
-    void setup(bool cpuTimes_, bool gpuTimes_, bool pixelsDrawn_, bool memoryUsage_, int64_t minCpuTime_);
+    void setup(bool cpuTimes_, bool gpuTimes_, bool pixelsDrawn_, bool memoryUsage_, int64_t minCpuTime_, bool binary_ = false);
 
     void addCall(unsigned no,
                  const char* name,
@@ -113,6 +165,11 @@ public:
 
     void addFrameEnd();
 
+    void addRenderingFinished(int64_t time);
+
+    /* Write the binary string table and footer. */
+    void finish();
+
     bool hasBaseTimes();
 
     void setBaseCpuTime(int64_t cpuStart);
@@ -138,6 +195,18 @@ private:
     bool gpuTimes;
     bool pixelsDrawn;
     bool memoryUsage;
+
+    bool binary;
+    unsigned frameNo;
+    uint32_t fields;
+    uint32_t recordSize;
+    uint64_t numRecords;
+    std::vector<uint64_t> frameEnds;
+    std::vector<int64_t> renderingFinished;
+    std::vector<std::string> names;
+    std::unordered_map<std::string, uint32_t> nameIndices;
+
+    uint32_t getNameIndex(const char *name);
 };
 }
 
@@ -0,0 +1,139 @@
+/**************************************************************************
+ *
+ * Copyright 2026 Jose Fonseca
+ * All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy
+ * of this software and associated documentation files (the "Software"), to deal
+ * in the Software without restriction, including without limitation the rights
+ * to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+ * copies of the Software, and to permit persons to whom the Software is
+ * furnished to do so, subject to the following conditions:
+ *
+ * The above copyright notice and this permission notice shall be included in
+ * all copies or substantial portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+ * IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+ * FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+ * AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+ * LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+ * OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+ * THE SOFTWARE.
+ *
+ **************************************************************************/
+
+
+#include <string.h>
+
+#include <iostream>
+#include <sstream>
+
+#include "trace_profiler.hpp"
+
+#include "gtest/gtest.h"
+
+using namespace trace;
+
+
+/**
+ * Capture everything written to std::cout, as retrace profiles go there.
+ */
+class CoutCapture
+{
+public:
+    std::ostringstream stream;
+    std::streambuf *saved;
+
+    CoutCapture() {
+        saved = std::cout.rdbuf(stream.rdbuf());
+    }
+
+    ~CoutCapture() {
+        std::cout.rdbuf(saved);
+    }
+};
+
+
+template <class T>
+static T
+read(const std::string &data, size_t offset)
+{
+    T value;
+    memcpy(&value, data.data() + offset, sizeof value);
+    return value;
+}
+
+
+TEST(trace_profiler, binary)
+{
+    std::string data;
+    {
+        CoutCapture capture;
+
+        Profiler profiler;
+        profiler.setup(true, false, false, false, 0, true);
+        profiler.addCall(1, "glDrawArrays", 3, 0, 0, 0, 100, 10, 0, 0, 0, 0);
+        profiler.addCall(2, "glDrawElements", 3, 0, 0, 0, 110, 20, 0, 0, 0, 0);
+        profiler.addFrameEnd();
+        profiler.addCall(4, "glDrawArrays", 0, 0, 0, 0, 130, 30, 0, 0, 0, 0);
+        profiler.addFrameEnd();
+        profiler.addRenderingFinished(200);
+        profiler.finish();
+
+        data = capture.stream.str();
+    }
+
+    ASSERT_GE(data.size(), sizeof(ProfileHeader) + sizeof(ProfileFooter));
+
+    ProfileHeader header = read<ProfileHeader>(data, 0);
+    EXPECT_EQ(memcmp(header.magic, PROFILE_MAGIC, sizeof header.magic), 0);
+    EXPECT_EQ(header.version, PROFILE_VERSION);
+    EXPECT_EQ(header.fields, (uint32_t)PROFILE_FIELD_CPU);
+    ASSERT_EQ(header.recordSize, sizeof(ProfileRecord) + 2 * sizeof(int64_t));
+
+    ProfileRecord record = read<ProfileRecord>(data, sizeof header + 2 * header.recordSize);
+    EXPECT_EQ(record.no, 4u);
+    EXPECT_EQ(record.program, 0u);
+    EXPECT_EQ(record.name, 0u);
+    EXPECT_EQ(record.frame, 1u);
+    EXPECT_EQ(read<int64_t>(data, sizeof header + 2 * header.recordSize + sizeof record), 130);
+
+    // The footer offsets must match the actual stream positions
+    ProfileFooter footer = read<ProfileFooter>(data, data.size() - sizeof(ProfileFooter));
+    EXPECT_EQ(memcmp(footer.magic, PROFILE_FOOTER_MAGIC, sizeof footer.magic), 0);
+    ASSERT_EQ(footer.frameEndsOffset, sizeof header + 3 * header.recordSize);
+    EXPECT_EQ(read<uint64_t>(data, footer.frameEndsOffset), 2u);
+    EXPECT_EQ(read<uint64_t>(data, footer.frameEndsOffset + sizeof(uint64_t)), 3u);
+    ASSERT_EQ(footer.renderingFinishedOffset, footer.frameEndsOffset + 2 * sizeof(uint64_t));
+    EXPECT_EQ(read<int64_t>(data, footer.renderingFinishedOffset), 200);
+    ASSERT_EQ(footer.stringTableOffset, footer.renderingFinishedOffset + sizeof(int64_t));
+
+    std::string strings = data.substr(footer.stringTableOffset, data.size() - sizeof footer - footer.stringTableOffset);
+    EXPECT_EQ(strings, std::string("glDrawArrays\0glDrawElements\0", 28));
+}
+
+
+TEST(trace_profiler, binaryMinCpuTime)
+{
+    std::string data;
+    {
+        CoutCapture capture;
+
+        Profiler profiler;
+        profiler.setup(true, false, false, false, 15, true);
+        profiler.addCall(1, "glDrawArrays", 0, 0, 0, 0, 100, 10, 0, 0, 0, 0);
+        profiler.addCall(2, "glDrawElements", 0, 0, 0, 0, 110, 20, 0, 0, 0, 0);
+        profiler.addFrameEnd();
+        profiler.finish();
+
+        data = capture.stream.str();
+    }
+
+    ProfileHeader header = read<ProfileHeader>(data, 0);
+    ProfileFooter footer = read<ProfileFooter>(data, data.size() - sizeof(ProfileFooter));
+    ASSERT_EQ(footer.frameEndsOffset, sizeof header + header.recordSize);
+    EXPECT_EQ(read<uint64_t>(data, footer.frameEndsOffset), 1u);
+    EXPECT_EQ(footer.stringTableOffset, footer.renderingFinishedOffset);
+    EXPECT_EQ(data.size() - sizeof footer - footer.stringTableOffset, sizeof "glDrawElements");
+}
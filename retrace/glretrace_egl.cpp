@@ -160,7 +160,7 @@ static void retrace_eglSwapBuffersWithDamage(trace::Call &call) {
     if (retrace::profilingFrameTimes) {
         // Wait for presentation to finish
         glFinish();
-        std::cout << "rendering_finished " << glretrace::getCurrentTime() << std::endl;
+        retrace::profiler.addRenderingFinished(glretrace::getCurrentTime());
     }
 }
 
@@ -337,7 +337,7 @@ static void retrace_eglSwapBuffers(trace::Call &call) {
     if (retrace::profilingFrameTimes) {
         // Wait for presentation to finish
         glFinish();
-        std::cout << "rendering_finished " << glretrace::getCurrentTime() << std::endl;
+        retrace::profiler.addRenderingFinished(glretrace::getCurrentTime());
     }
 }
 
@@ -162,7 +162,7 @@ static void retrace_glXSwapBuffers(trace::Call &call) {
     if (retrace::profilingFrameTimes) {
         // Wait for presentation to finish
         glFinish();
-        std::cout << "rendering_finished " << glretrace::getCurrentTime() << std::endl;
+        retrace::profiler.addRenderingFinished(glretrace::getCurrentTime());
     }
 }
 
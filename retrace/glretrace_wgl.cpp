@@ -161,7 +161,7 @@ static void retrace_wglSwapBuffers(trace::Call &call) {
     if (retrace::profilingFrameTimes) {
         // Wait for presentation to finish
         glFinish();
-        std::cout << "rendering_finished " << glretrace::getCurrentTime() << std::endl;
+        retrace::profiler.addRenderingFinished(glretrace::getCurrentTime());
     }
 }
 
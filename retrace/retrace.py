@@ -299,22 +299,28 @@ class SwizzledValueRegistrator(stdapi.Visitor, stdapi.ExpanderMixin):
         pass
 
     def visitArray(self, array, lvalue, rvalue):
-        print('    const trace::Array *_a%s = (%s).toArray();' % (array.tag, rvalue))
-        print('    if (_a%s) {' % (array.tag))
-        length = '_a%s->values.size()' % array.tag
+        tmp = '_a' + array.tag + '_' + str(self.seq)
+        self.seq += 1
+
+        print('    const trace::Array *%s = (%s).toArray();' % (tmp, rvalue))
+        print('    if (%s) {' % (tmp,))
+        length = '%s->values.size()' % (tmp,)
         index = '_j' + array.tag
         print('        for (size_t {i} = 0; {i} < {length}; ++{i}) {{'.format(i = index, length = length))
         try:
-            self.visit(array.type, '%s[%s]' % (lvalue, index), '*_a%s->values[%s]' % (array.tag, index))
+            self.visit(array.type, '%s[%s]' % (lvalue, index), '*%s->values[%s]' % (tmp, index))
         finally:
             print('        }')
             print('    }')
     
     def visitPointer(self, pointer, lvalue, rvalue):
-        print('    const trace::Array *_a%s = (%s).toArray();' % (pointer.tag, rvalue))
-        print('    if (_a%s) {' % (pointer.tag))
+        tmp = '_a' + pointer.tag + '_' + str(self.seq)
+        self.seq += 1
+
+        print('    const trace::Array *%s = (%s).toArray();' % (tmp, rvalue))
+        print('    if (%s) {' % (tmp,))
         try:
-            self.visit(pointer.type, '%s[0]' % (lvalue,), '*_a%s->values[0]' % (pointer.tag,))
+            self.visit(pointer.type, '%s[0]' % (lvalue,), '*%s->values[0]' % (tmp,))
         finally:
             print('    }')
     
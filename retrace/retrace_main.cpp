@@ -62,12 +62,14 @@
 
 
 static bool waitOnFinish = false;
+static bool profileBinary = false;
 
 static const char *snapshotPrefix = "";
 static enum {
     PNM_FMT,
     RAW_RGB,
-    RAW_MD5
+    RAW_MD5,
+    MD5_SUM
 } snapshotFormat = PNM_FMT;
 
 static trace::CallSet snapshotFrequency;
@@ -336,6 +338,10 @@ takeSnapshot(unsigned call_no, int mrt, unsigned snapshot_no, bool backBuffer) {
             case RAW_MD5:
                 src->writeMD5(std::cout);
                 break;
+            case MD5_SUM:
+                std::cout << comment << ' ' << src->width << ' ' << src->height << ' ';
+                src->writeMD5(std::cout);
+                break;
             default:
                 assert(0);
                 break;
@@ -751,7 +757,10 @@ mainLoop() {
     float timeInterval = (endTime - startTime) * (1.0 / os::timeFrequency);
 
     if ((retrace::verbosity >= -1) || (retrace::profiling)) {
-        std::cout <<
+        // Binary profiles are written to stdout, and must not be interleaved
+        // with text
+        std::ostream &summary = profileBinary ? std::cerr : std::cout;
+        summary <<
             "Rendered " << frameNo << " frames"
             " in " <<  timeInterval << " secs,"
             " average of " << (frameNo/timeInterval) << " fps\n";
@@ -785,6 +794,7 @@ usage(const char *argv0) {
         "      --pcalls            call profiling metrics selection\n"
         "      --pframes           frame profiling metrics selection\n"
         "      --pdrawcalls        draw call profiling metrics selection\n"
+        "      --profile-format=FORMAT profile output format (`text` or `binary`)\n"
         "      --list-metrics      list all available metrics for TRACE\n"
         "      --query-handling    How query readbacks should be handled: ('skip', 'run', 'check'), default is 'skip'\n"
         "      --query-tolerance   Set a tolerance when comparing recorded query results to evaluated ones, a value >0 enables query-handling 'check'\n"
@@ -801,7 +811,7 @@ usage(const char *argv0) {
         "      --msaa-no-resolve   dump raw sample images of multisampled texture instead of resolved texture\n"
         "  -s, --snapshot-prefix=PREFIX    take snapshots; `-` for PNM stdout output\n"
         "      --snapshot-alpha    Include alpha channel in snapshots.\n"
-        "      --snapshot-format=FMT       use (PNM, RGB, or MD5; default is PNM) when writing to stdout output\n"
+        "      --snapshot-format=FMT       use (PNM, RGB, MD5, or MD5SUM; default is PNM) when writing to stdout output\n"
         "  -S, --snapshot=CALLSET  calls to snapshot (default is every frame)\n"
         "      --snapshot-interval=N    specify a frame interval when generating snaphots (default is 0)\n"
         "  -t, --snapshot-threaded encode screenshots on multiple threads\n"
@@ -855,6 +865,7 @@ enum {
     SNAPSHOT_INTERVAL_OPT,
     SNAPSHOT_FORCE_BACKBUFFER_OPT,
     DUMP_FORMAT_OPT,
+    PROFILE_FORMAT_OPT,
     MARKERS_OPT,
     MIN_CPU_TIME_OPT,
     QUERY_HANDLING_OPT,
@@ -878,6 +889,7 @@ longOptions[] = {
     {"driver", required_argument, 0, DRIVER_OPT},
     {"dump-state", required_argument, 0, 'D'},
     {"dump-format", required_argument, 0, DUMP_FORMAT_OPT},
+    {"profile-format", required_argument, 0, PROFILE_FORMAT_OPT},
     {"fullscreen", no_argument, 0, FULLSCREEN_OPT},
     {"headless", no_argument, 0, HEADLESS_OPT},
     {"help", no_argument, 0, 'h'},
@@ -1178,6 +1190,16 @@ int main(int argc, char **argv)
                 return EXIT_FAILURE;
             }
             break;
+        case PROFILE_FORMAT_OPT:
+            if (strcasecmp(optarg, "text") == 0) {
+                profileBinary = false;
+            } else if (strcasecmp(optarg, "binary") == 0) {
+                profileBinary = true;
+            } else {
+                std::cerr << "error: unsupported profile format `" << optarg << "`\n";
+                return EXIT_FAILURE;
+            }
+            break;
         case CORE_OPT:
             retrace::setFeatureLevel("3_2_core");
             break;
@@ -1265,6 +1287,8 @@ int main(int argc, char **argv)
                 snapshotFormat = RAW_RGB;
             else if (strcmp(optarg, "MD5") == 0)
                 snapshotFormat = RAW_MD5;
+            else if (strcmp(optarg, "MD5SUM") == 0)
+                snapshotFormat = MD5_SUM;
             else
                 snapshotFormat = PNM_FMT;
             break;
@@ -1430,11 +1454,15 @@ int main(int argc, char **argv)
 
     retrace::setUp();
     if (retrace::profiling && !retrace::profilingWithBackends) {
+        if (profileBinary) {
+            os::setBinaryMode(stdout);
+        }
         retrace::profiler.setup(retrace::profilingCpuTimes,
                                 retrace::profilingGpuTimes,
                                 retrace::profilingPixelsDrawn,
                                 retrace::profilingMemoryUsage,
-                                retrace::minCpuTime);
+                                retrace::minCpuTime,
+                                profileBinary);
     }
 
     os::setExceptionCallback(exceptionCallback);
@@ -1471,6 +1499,10 @@ int main(int argc, char **argv)
         }
     }
 
+    if (retrace::profiling && !retrace::profilingWithBackends) {
+        retrace::profiler.finish();
+    }
+
     os::resetExceptionCallback();
 
     delete snapshotter;
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+##########################################################################
+#
+# Copyright 2026 Jose Fonseca
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the 'Software'), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+##########################################################################/
+
+'''Analyze frame pacing of a glretrace profile.
+
+Reports the frame time distribution, stutters (frames much longer than the
+median of the frames before them), and how much CPU and GPU work of every
+frame overlapped.  Frame times come from the `rendering_finished` times of
+`--pframe-times` when present, otherwise from the end of the last CPU or GPU
+work of every frame (`--pcpu` and/or `--pgpu`).
+
+Given the trace too, it also writes the GPU time of every debug marker scope
+(glPushDebugGroup, glPushGroupMarkerEXT, etc.) in the folded stacks format of
+flamegraph.pl and similar tools.
+'''
+
+
+import csv
+import optparse
+import sys
+import warnings
+
+import numpy
+
+import profiledata
+import unpickle
+
+
+def _frameReduce(ufunc, frames, values, numFrames, initial):
+    # Reduce values per frame, with calls sorted by frame
+    result = numpy.full(numFrames, initial, dtype=numpy.float64)
+    if len(frames):
+        starts = numpy.flatnonzero(numpy.diff(frames)) + 1
+        starts = numpy.concatenate(([0], starts))
+        result[frames[starts]] = ufunc.reduceat(values, starts)
+    return result
+
+
+def _span(profile, kind, numFrames):
+    # Start and end of the work of every frame, NaN for frames without any
+    starts = profile.columns[kind + '_start']
+    durations = profile.columns[kind + '_dura']
+    frames = profile.columns['frame']
+    mask = (durations > 0) & (frames < numFrames)
+    frames = frames[mask]
+    starts = starts[mask].astype(numpy.float64)
+    ends = starts + durations[mask]
+    first = _frameReduce(numpy.minimum, frames, starts, numFrames, numpy.nan)
+    last = _frameReduce(numpy.maximum, frames, ends, numFrames, numpy.nan)
+    busy = _frameReduce(numpy.add, frames, durations[mask].astype(numpy.float64), numFrames, 0.0)
+    return first, last, busy
+
+
+def rollingMedian(values, window):
+    '''Median of the previous window values (fewer at the start, and NaN for
+    the first value).'''
+
+    padded = numpy.concatenate((numpy.full(window, numpy.nan), values))
+    windows = numpy.lib.stride_tricks.sliding_window_view(padded[:-1], window)
+    with warnings.catch_warnings():
+        # All-NaN windows
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return numpy.nanmedian(windows, axis=1)
+
+
+def analyzeFrames(profile, options):
+    '''Per-frame columns.'''
+
+    numFrames = profile.numFrames
+    if numFrames == 0:
+        raise ValueError('profile has no complete frames')
+
+    cpuFirst, cpuLast, cpuBusy = _span(profile, 'cpu', numFrames)
+    gpuFirst, gpuLast, gpuBusy = _span(profile, 'gpu', numFrames)
+
+    if len(profile.renderingFinished) >= numFrames:
+        ends = profile.renderingFinished[:numFrames].astype(numpy.float64)
+    else:
+        ends = numpy.fmax(cpuLast, gpuLast)
+        if numpy.isnan(ends).all():
+            raise ValueError('profile has no frame times (profile with --pframe-times, --pcpu, or --pgpu)')
+        # Carry the end of frames without timed work forward
+        valid = ~numpy.isnan(ends)
+        ends = ends[numpy.maximum.accumulate(numpy.where(valid, numpy.arange(numFrames), 0))]
+
+    # The first frame time is unknown, as there's no previous frame end
+    frameTimes = numpy.full(numFrames, numpy.nan)
+    frameTimes[1:] = numpy.diff(ends)
+
+    median = rollingMedian(frameTimes, options.window)
+    with numpy.errstate(invalid='ignore'):
+        stutter = (frameTimes > median*options.stutter_factor) & (frameTimes - median > options.min_spike*1e6)
+
+    overlap = numpy.fmax(numpy.fmin(cpuLast, gpuLast) - numpy.fmax(cpuFirst, gpuFirst), 0)
+    overlap = numpy.where(numpy.isnan(overlap), 0, overlap)
+
+    return {
+        'frame': numpy.arange(numFrames),
+        'frame_time': frameTimes,
+        'median': median,
+        'stutter': stutter,
+        'cpu_busy': cpuBusy,
+        'gpu_busy': gpuBusy,
+        'overlap': overlap,
+    }
+
+
+def _ms(value):
+    return '%.2f ms' % (value*1e-6)
+
+
+def summarize(frames, stream):
+    frameTimes = frames['frame_time'][1:]
+    stream.write('frames: %u\n' % len(frames['frame']))
+    if len(frameTimes) == 0:
+        return
+    p50, p95, p99 = numpy.percentile(frameTimes, [50, 95, 99])
+    mean = frameTimes.mean()
+    stream.write('frame time: mean %s, p50 %s, p95 %s, p99 %s, max %s (%.1f fps)\n' % (
+        _ms(mean), _ms(p50), _ms(p95), _ms(p99), _ms(frameTimes.max()), 1e9/mean if mean > 0 else 0))
+
+    total = frameTimes.sum()
+    if total > 0:
+        stream.write('cpu busy: %.1f%%, gpu busy: %.1f%%, cpu/gpu overlap: %.1f%%\n' % (
+            100.0*frames['cpu_busy'][1:].sum()/total,
+            100.0*frames['gpu_busy'][1:].sum()/total,
+            100.0*frames['overlap'][1:].sum()/total))
+
+    stutters = numpy.flatnonzero(frames['stutter'])
+    stream.write('stutters: %u (%.1f%% of frames)\n' % (len(stutters), 100.0*len(stutters)/len(frameTimes)))
+    for frame in stutters:
+        stream.write('  frame %u: %s (median %s, %.1fx)\n' % (
+            frame, _ms(frames['frame_time'][frame]), _ms(frames['median'][frame]),
+            frames['frame_time'][frame]/frames['median'][frame]))
+
+
+def writeCsv(frames, stream):
+    fieldnames = ['frame', 'frame_time', 'median', 'stutter', 'cpu_busy', 'gpu_busy', 'overlap']
+    writer = csv.writer(stream, lineterminator='\n')
+    writer.writerow(fieldnames)
+    columns = [frames[name].tolist() for name in fieldnames]
+    for row in zip(*columns):
+        writer.writerow(['' if isinstance(value, float) and value != value else value for value in row])
+
+
+class MarkerTracker(unpickle.Unpickler):
+    '''Tracks the debug marker stack through the calls of a trace.
+
+    Records the calls where the stack changes, so that the stack of any call
+    can be looked up by bisection.  Markers are assumed to be pushed and popped
+    from a single thread.'''
+
+    # Arguments holding the marker label, by order of preference
+    labelArgs = ('message', 'marker', 'label', 'name', 'string')
+
+    def __init__(self, stream):
+        unpickle.Unpickler.__init__(self, stream)
+        self.stack = ()
+        self.stacks = [()]
+        self.stackIds = {(): 0}
+        self.transitionCalls = [0]
+        self.transitionStacks = [0]
+
+    def markerLabel(self, call):
+        for name in self.labelArgs:
+            try:
+                value = call.arg(name)
+            except NameError:
+                continue
+            if isinstance(value, bytes):
+                value = value.decode('latin-1')
+            if isinstance(value, str):
+                # Separators of the folded stacks format
+                return value.replace(';', ':').replace('\n', ' ')
+        return call.functionName
+
+    def handleCall(self, call):
+        # The marker calls themselves belong to the outer scope
+        if call.flags & unpickle.CALL_FLAG_MARKER_PUSH:
+            stack = self.stack + (self.markerLabel(call),)
+            transitionCall = call.no + 1
+        elif call.flags & unpickle.CALL_FLAG_MARKER_POP:
+            if not self.stack:
+                return
+            stack = self.stack[:-1]
+            transitionCall = call.no
+        else:
+            return
+
+        self.stack = stack
+        try:
+            stackId = self.stackIds[stack]
+        except KeyError:
+            stackId = len(self.stacks)
+            self.stacks.append(stack)
+            self.stackIds[stack] = stackId
+        self.transitionCalls.append(transitionCall)
+        self.transitionStacks.append(stackId)
+
+    def lookup(self, callNos):
+        '''Stack ids of an array of call numbers.'''
+
+        transitionCalls = numpy.array(self.transitionCalls, dtype=numpy.int64)
+        transitionStacks = numpy.array(self.transitionStacks, dtype=numpy.int64)
+        return transitionStacks[numpy.searchsorted(transitionCalls, callNos, side='right') - 1]
+
+
+def writeFlameGraph(profile, tracker, value, stream):
+    '''Write the value of every call, summed per marker stack and function,
+    as folded stacks.'''
+
+    values = profile.columns[value]
+    mask = values > 0
+    stackIds = tracker.lookup(profile.columns['no'][mask])
+    nameCodes = profile.columns['name'][mask].astype(numpy.int64)
+
+    keys = stackIds*len(profile.names) + nameCodes
+    uniqueKeys, inverse = numpy.unique(keys, return_inverse=True)
+    totals = numpy.bincount(inverse.reshape(-1), weights=values[mask], minlength=len(uniqueKeys))
+
+    lines = []
+    for key, total in zip(uniqueKeys.tolist(), totals.tolist()):
+        stackId, nameCode = divmod(key, len(profile.names))
+        frames = list(tracker.stacks[stackId]) + [profile.names[nameCode]]
+        lines.append('%s %u\n' % (';'.join(frames), total))
+    lines.sort()
+    stream.writelines(lines)
+
+
+def main():
+    '''Main program.
+    '''
+
+    # Parse command line options
+    optparser = optparse.OptionParser(
+        usage='\n\t%prog [options] PROFILE',
+        version='%%prog')
+    optparser.add_option(
+        '--window', metavar='FRAMES',
+        type='int', dest='window', default=30,
+        help='number of previous frames whose median frame time is the reference for stutters [default: %default]')
+    optparser.add_option(
+        '--stutter-factor', metavar='FACTOR',
+        type='float', dest='stutter_factor', default=2.0,
+        help='frames longer than FACTOR times the median are stutters [default: %default]')
+    optparser.add_option(
+        '--min-spike', metavar='MS',
+        type='float', dest='min_spike', default=1.0,
+        help='ignore stutters less than MS milliseconds above the median [default: %default]')
+    optparser.add_option(
+        '--csv', metavar='FILE',
+        type='string', dest='csv',
+        help='write the per-frame times to FILE')
+    optparser.add_option(
+        '-t', '--trace', metavar='TRACE',
+        type='string', dest='trace',
+        help='trace the profile was recorded from, for marker flame graphs')
+    optparser.add_option(
+        '-a', '--apitrace', metavar='PROGRAM',
+        type='string', dest='apitrace', default='apitrace',
+        help='apitrace command [default: %default]')
+    optparser.add_option(
+        '--flame', metavar='FILE',
+        type='string', dest='flame',
+        help='write the folded stacks of every marker scope to FILE (requires --trace)')
+    optparser.add_option(
+        '--flame-value', metavar='FIELD',
+        type='string', dest='flame_value', default='gpu_dura',
+        help='field to sum in flame graphs [default: %default]')
+
+    (options, args) = optparser.parse_args(sys.argv[1:])
+    if len(args) != 1:
+        optparser.error('incorrect number of arguments')
+    if options.flame and not options.trace:
+        optparser.error('--flame requires --trace')
+    if options.window < 1:
+        optparser.error('invalid window %r' % options.window)
+
+    try:
+        profile = profiledata.loadFile(args[0])
+        frames = analyzeFrames(profile, options)
+    except ValueError as ex:
+        sys.stderr.write('error: %s\n' % ex)
+        sys.exit(1)
+
+    summarize(frames, sys.stdout)
+
+    if options.csv:
+        stream = open(options.csv, 'wt')
+        writeCsv(frames, stream)
+        stream.close()
+
+    if options.flame:
+        if options.flame_value not in profile.columns:
+            sys.stderr.write('error: unknown profile field %r\n' % options.flame_value)
+            sys.exit(1)
+        tracker = MarkerTracker(unpickle.pickleTrace(options.trace, apitrace=options.apitrace, symbolic=True))
+        tracker.parse()
+        stream = open(options.flame, 'wt')
+        writeFlameGraph(profile, tracker, options.flame_value, stream)
+        stream.close()
+
+
+if __name__ == '__main__':
+    main()
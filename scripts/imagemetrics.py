@@ -0,0 +1,256 @@
+##########################################################################
+#
+# Copyright 2026 Jose Fonseca
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+##########################################################################/
+
+
+'''Vectorized image quality metrics.
+
+Computes, for every image pair:
+
+- ae: number of pixels where any channel differs by more than fuzz
+- ae_channels: the same, per channel
+- psnr: peak signal-to-noise ratio, in dB
+- ssim: structural similarity of the (downsampled) luma
+- max_error: maximum absolute error, across all channels
+- max_error_location: (x, y) of the maximum absolute error
+
+Values are normalized so that the full channel range is [0, 1].
+
+Pixels are kept as 8-bit integers, and every pair is reduced a band of rows
+at a time, so that memory use is bounded regardless of the image size.
+'''
+
+
+import sys
+
+import numpy
+
+
+# Whether higher values are better, for every metric a threshold can be set
+_higherIsBetter = {
+    'ae': False,
+    'max_error': False,
+    'psnr': True,
+    'ssim': True,
+}
+
+metricNames = sorted(_higherIsBetter.keys())
+
+
+# Metrics for images which can't be compared (e.g., different sizes)
+_mismatchMetrics = {
+    'ae': sys.maxsize,
+    'ae_channels': None,
+    'psnr': 0.0,
+    'ssim': 0.0,
+    'max_error': 1.0,
+    'max_error_location': None,
+}
+
+# SSIM window size and stabilization constants
+_ssimWindow = 7
+_ssimC1 = 0.01 ** 2
+_ssimC2 = 0.03 ** 2
+
+# Largest luma dimension SSIM is computed at
+_ssimSize = 256
+
+# Approximate number of pixels reduced at a time
+_bandPixels = 1 << 20
+
+_lumaWeights = numpy.array([0.299, 0.587, 0.114], dtype=numpy.float32) * numpy.float32(1.0/255.0)
+
+
+def to_array(image, alpha = False):
+    '''Convert a PIL image, filename, or numpy array into an uint8 HxWxC
+    array.
+
+    Floating point arrays are assumed to be in [0, 1].'''
+
+    if isinstance(image, numpy.ndarray):
+        pixels = image
+        if pixels.dtype != numpy.uint8:
+            pixels = numpy.clip(pixels, 0.0, 1.0) * 255.0 + 0.5
+            pixels = pixels.astype(numpy.uint8)
+        if pixels.ndim == 2:
+            pixels = pixels[:, :, numpy.newaxis]
+        if not alpha and pixels.shape[2] == 4:
+            pixels = pixels[:, :, :3]
+        return pixels
+
+    if isinstance(image, str):
+        from PIL import Image
+        image = Image.open(image)
+    if alpha:
+        image = image.convert('RGBA')
+    else:
+        image = image.convert('RGB')
+    return numpy.asarray(image, dtype=numpy.uint8)
+
+
+def _luma(pixels):
+    # pixels is HxWxC uint8; returns float32 luma in [0, 1]
+    if pixels.shape[2] >= 3:
+        return numpy.dot(pixels[..., :3], _lumaWeights)
+    return pixels[..., 0] * numpy.float32(1.0/255.0)
+
+
+def _downsample(luma, factor):
+    # Box filter by an integer factor, so that SSIM cost doesn't grow with the
+    # image size
+    if factor == 1:
+        return luma
+    height, width = luma.shape
+    luma = luma[:height - height % factor, :width - width % factor]
+    luma = luma.reshape(height // factor, factor, width // factor, factor)
+    return luma.mean(axis=(1, 3))
+
+
+def _box_mean(x, size):
+    # Mean over every size x size window (valid mode), using summed area tables
+    height, width = x.shape
+    table = numpy.zeros((height + 1, width + 1), dtype=numpy.float64)
+    numpy.cumsum(numpy.cumsum(x, axis=0), axis=1, out=table[1:, 1:])
+    sums = table[size:, size:] - table[:-size, size:] - table[size:, :-size] + table[:-size, :-size]
+    return sums * (1.0/(size*size))
+
+
+def _ssim(x, y):
+    # x and y are the downsampled luma of both images
+    size = min(_ssimWindow, x.shape[0], x.shape[1])
+    mu_x = _box_mean(x, size)
+    mu_y = _box_mean(y, size)
+    sigma_xx = _box_mean(x*x, size) - mu_x*mu_x
+    sigma_yy = _box_mean(y*y, size) - mu_y*mu_y
+    sigma_xy = _box_mean(x*y, size) - mu_x*mu_y
+    ssim = ((2*mu_x*mu_y + _ssimC1)*(2*sigma_xy + _ssimC2)) / \
+           ((mu_x*mu_x + mu_y*mu_y + _ssimC1)*(sigma_xx + sigma_yy + _ssimC2))
+    return ssim.mean()
+
+
+def _compare_pair(ref, src, fuzz):
+    # ref and src are HxWxC uint8 arrays of the same shape
+    height, width, channels = ref.shape
+
+    # Channel differences are integers, so compare them against the integer
+    # part of the scaled fuzz
+    threshold = int(numpy.floor(fuzz*255.0 + 1e-6))
+
+    factor = max(1, min(height, width) // _ssimSize)
+    rows = max(1, _bandPixels // width)
+    rows += -rows % factor
+
+    ae_channels = numpy.zeros(channels, dtype=numpy.int64)
+    ae = 0
+    square_error = 0
+    max_error = -1
+    max_index = 0
+    lumas_x = []
+    lumas_y = []
+    for top in range(0, height, rows):
+        a = ref[top : top + rows]
+        b = src[top : top + rows]
+        absdiff = numpy.abs(b.astype(numpy.int16) - a.astype(numpy.int16))
+
+        exceeds = absdiff > threshold
+        ae_channels += exceeds.sum(axis=(0, 1))
+        ae += int(numpy.count_nonzero(exceeds.any(axis=2)))
+
+        square_error += int(numpy.square(absdiff, dtype=numpy.int32).sum(dtype=numpy.int64))
+
+        maxdiff = absdiff.max(axis=2).ravel()
+        index = int(maxdiff.argmax())
+        if maxdiff[index] > max_error:
+            max_error = int(maxdiff[index])
+            max_index = top*width + index
+
+        lumas_x.append(_downsample(_luma(a), factor))
+        lumas_y.append(_downsample(_luma(b), factor))
+
+    mse = square_error / (255.0*255.0*height*width*channels)
+    with numpy.errstate(divide='ignore'):
+        psnr = 10.0*numpy.log10(1.0/numpy.float64(mse))
+
+    ssim = _ssim(numpy.concatenate(lumas_x), numpy.concatenate(lumas_y))
+
+    return {
+        'ae': ae,
+        'ae_channels': [int(value) for value in ae_channels],
+        'psnr': float(psnr),
+        'ssim': float(ssim),
+        'max_error': max_error/255.0,
+        'max_error_location': (max_index % width, max_index // width),
+    }
+
+
+def compare(refImages, srcImages, fuzz = 0.05, alpha = False):
+    '''Compute the metrics of every image pair.
+
+    Images may be PIL images, filenames, or numpy arrays.  Pairs are loaded
+    and reduced one at a time.  Returns a list of metrics dictionaries, in
+    the same order.'''
+
+    refImages = list(refImages)
+    srcImages = list(srcImages)
+    assert len(refImages) == len(srcImages)
+
+    results = []
+    for refImage, srcImage in zip(refImages, srcImages):
+        ref = to_array(refImage, alpha)
+        src = to_array(srcImage, alpha)
+        if ref.shape != src.shape:
+            results.append(dict(_mismatchMetrics))
+        else:
+            results.append(_compare_pair(ref, src, fuzz))
+    return results
+
+
+def parse_thresholds(entries):
+    '''Translate a list of NAME=VALUE entries into a thresholds dictionary.'''
+
+    thresholds = {}
+    for entry in entries:
+        try:
+            name, value = entry.split('=', 1)
+            value = float(value)
+        except ValueError:
+            raise ValueError('invalid metric threshold %r (expected NAME=VALUE)' % entry)
+        if name not in _higherIsBetter:
+            raise ValueError('unknown metric %r (expected one of %s)' % (name, ', '.join(metricNames)))
+        thresholds[name] = value
+    return thresholds
+
+
+def passes(metrics, thresholds):
+    '''Whether the metrics are within all thresholds.'''
+
+    for name, threshold in thresholds.items():
+        value = metrics[name]
+        if _higherIsBetter[name]:
+            if value < threshold:
+                return False
+        else:
+            if value > threshold:
+                return False
+    return True
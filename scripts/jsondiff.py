@@ -26,10 +26,15 @@
 ##########################################################################/
 
 
+import base64
+import io
 import json
+import math
 import optparse
 import re
 import difflib
+import hashlib
+import struct
 import sys
 
 
@@ -133,15 +138,201 @@ class Dumper(Visitor):
         self._write(']')
 
     def visitValue(self, node):
+        if isinstance(node, (bytes, memoryview)):
+            # Binary data from UBJSON, written as the JSON state writer does
+            node = base64.b64encode(node).decode('ascii')
         self._write(json.dumps(node, allow_nan=True))
 
 
 
+# Lists of numbers at least this long are compared with numpy
+numericArrayThreshold = 64
+
+# Runs of differing elements longer than this are summarized
+numericRunLength = 4
+
+
+def numeric_array(node):
+    '''Convert a long list of numbers into a float64 numpy array.
+
+    Returns the array and a mask of which elements were floats, or None if
+    the list is short, has other values, has integers that don't fit in a
+    float64, or numpy is not available.'''
+
+    if len(node) < numericArrayThreshold:
+        return None
+    types = set(map(type, node))
+    if not types.issubset((int, float)):
+        return None
+    try:
+        import numpy
+    except ImportError:
+        return None
+    array = numpy.array(node, dtype=numpy.float64)
+    if int not in types:
+        isfloat = numpy.ones(len(node), dtype=bool)
+    elif float not in types:
+        isfloat = numpy.zeros(len(node), dtype=bool)
+    else:
+        isfloat = numpy.fromiter((type(value) is float for value in node), dtype=bool, count=len(node))
+    if numpy.any(numpy.abs(array[~isfloat]) >= 2.0 ** 53):
+        return None
+    return array, isfloat
+
+
+# Subtrees with fewer leaf values than this are compared directly rather than
+# through their fingerprints
+fingerprintThreshold = 256
+
+
+class Fingerprinter(Visitor):
+    '''Computes Merkle digests of subtrees.
+
+    Every subtree is given a canonical encoding, where numbers are quantized
+    so that values within the same bucket are always within the relative
+    tolerance.  Subtrees with at least fingerprintThreshold leaf values are
+    replaced in their parent's encoding by a BLAKE2 digest of their own, so
+    equal digests imply equal subtrees, barring a hash collision.  Values
+    which straddle a bucket boundary get different digests, and must be
+    compared in full.
+
+    visit() returns the encoding and the number of leaf values of a node.
+    Digests are memoized by node identity, so the nodes must be kept alive.'''
+
+    def __init__(self, tolerance = 2.0 ** -24):
+        if tolerance > 0:
+            bits = 2 + int(math.ceil(-math.log(tolerance, 2)))
+        else:
+            bits = 53
+        self.scale = float(1 << bits)
+        # Integers only compare exactly among themselves, so those which
+        # don't fit in the quantized mantissa are encoded as they are
+        self.maxInt = 1 << (bits - 1)
+        self.cache = {}
+
+    def digest(self, node):
+        '''Digest of an object or array, or None if it is too small to be
+        worth fingerprinting.'''
+
+        try:
+            return self.cache[id(node)][1]
+        except KeyError:
+            pass
+        encoding, leaves = self.visit(node)
+        if leaves < fingerprintThreshold:
+            self.cache[id(node)] = node, None, leaves
+            return None
+        return encoding
+
+    def visit(self, node):
+        if not isinstance(node, (dict, list)):
+            return self.visitValue(node), 1
+        try:
+            _, digest, leaves = self.cache[id(node)]
+        except KeyError:
+            pass
+        else:
+            if digest is not None:
+                return digest, leaves
+        encoding, leaves = Visitor.visit(self, node)
+        if leaves < fingerprintThreshold:
+            return encoding, leaves
+        digest = '#' + hashlib.blake2b(encoding.encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()
+        self.cache[id(node)] = node, digest, leaves
+        return digest, leaves
+
+    def visitObject(self, node):
+        parts = ['{']
+        total = 0
+        for name in sorted(node.keys()):
+            encoding, leaves = self.visit(node[name])
+            parts.append(repr(name))
+            parts.append(':')
+            parts.append(encoding)
+            parts.append(',')
+            total += leaves
+        parts.append('}')
+        return ''.join(parts), total
+
+    def visitArray(self, node):
+        numeric = numeric_array(node)
+        if numeric is not None:
+            array, isfloat = numeric
+            import numpy
+            if numpy.all(numpy.isfinite(array)) and not numpy.any(numpy.abs(array[~isfloat]) >= self.maxInt):
+                mantissa, exponent = numpy.frexp(array)
+                quantized = numpy.round(mantissa * self.scale).astype(numpy.int64)
+                # Signed zeros must encode the same
+                exponent[quantized == 0] = 0
+                digest = hashlib.blake2b(quantized.tobytes(), digest_size=16)
+                digest.update(exponent.astype(numpy.int32).tobytes())
+                return '<%s>' % digest.hexdigest(), len(node)
+        parts = ['[']
+        total = 0
+        for value in node:
+            encoding, leaves = self.visit(value)
+            parts.append(encoding)
+            parts.append(',')
+            total += leaves
+        parts.append(']')
+        return ''.join(parts), total
+
+    def visitValue(self, node):
+        if isinstance(node, (int, float)) and -self.maxInt < node < self.maxInt:
+            # Quantize, so that integers and floats compare within tolerance
+            mantissa, exponent = math.frexp(node)
+            mantissa = round(mantissa * self.scale)
+            if not mantissa:
+                return '0'
+            return '%d*%d' % (mantissa, exponent)
+        if isinstance(node, float):
+            # Infinities and NaNs
+            return repr(node)
+        if isinstance(node, memoryview):
+            node = bytes(node)
+        # repr() distinguishes types and delimits strings unambiguously
+        return '=' + repr(node)
+
+
 class Comparer(Visitor):
 
-    def __init__(self, ignore_added = False, tolerance = 2.0 ** -24):
+    def __init__(self, ignore_added = False, tolerance = 2.0 ** -24, fingerprint = False):
         self.ignore_added = ignore_added
         self.tolerance = tolerance
+        if fingerprint:
+            self.fingerprinter = Fingerprinter(tolerance)
+        else:
+            self.fingerprinter = None
+
+        # Whether to remember the outcome of comparing objects and arrays,
+        # which Differ enables as it compares the same subtrees at every
+        # level it descends
+        self.memoize = False
+        self.cache = {}
+
+    def visit(self, a, b):
+        if not isinstance(a, (dict, list)) or \
+           not isinstance(b, (dict, list)):
+            return Visitor.visit(self, a, b)
+
+        memoize = self.memoize
+        if self.fingerprinter is not None:
+            # Identical subtrees are skipped in constant time
+            digest = self.fingerprinter.digest(a)
+            if digest is not None:
+                if digest == self.fingerprinter.digest(b):
+                    return True
+                memoize = True
+        if not memoize:
+            return Visitor.visit(self, a, b)
+
+        key = id(a), id(b)
+        try:
+            return self.cache[key][2]
+        except KeyError:
+            result = Visitor.visit(self, a, b)
+            self.cache[key] = a, b, result
+            return result
 
     def visitObject(self, a, b):
         if not isinstance(b, dict):
@@ -169,18 +360,35 @@ class Comparer(Visitor):
             return False
         if len(a) != len(b):
             return False
+        na = numeric_array(a)
+        if na is not None:
+            nb = numeric_array(b)
+            if nb is not None:
+                return bool(self.numeric_equal(na, nb).all())
         for ae, be in zip(a, b):
             if not self.visit(ae, be):
                 return False
         return True
 
+    def numeric_equal(self, a, b):
+        '''Vectorized equivalent of visitValue over numeric_array() results of
+        the same length.'''
+
+        import numpy
+        a, afloat = a
+        b, bfloat = b
+        with numpy.errstate(all='ignore'):
+            equal = (a == b) | (numpy.isnan(a) & numpy.isnan(b))
+            close = numpy.where(a == 0, numpy.abs(b), numpy.abs((b - a)/a)) < self.tolerance
+        return equal | (close & (afloat | bfloat))
+
     def visitValue(self, a, b):
         if isinstance(a, float) and isinstance(b, (int, float)) or \
            isinstance(b, float) and isinstance(a, (int, float)):
-            if a is b:
-                # NaNs take this path
+            if a == b:
                 return True
-            elif a == b:
+            elif a != a and b != b:
+                # NaNs compare equal among themselves, as in numeric_equal()
                 return True
             elif a == 0:
                 return abs(b) < self.tolerance
@@ -192,14 +400,41 @@ class Comparer(Visitor):
 
 class Differ(Visitor):
 
-    def __init__(self, stream = sys.stdout, ignore_added = False):
+    def __init__(self, stream = sys.stdout, ignore_added = False, fingerprint = False):
         self.dumper = Dumper(stream)
-        self.comparer = Comparer(ignore_added = ignore_added)
+        self.comparer = Comparer(ignore_added = ignore_added, fingerprint = fingerprint)
 
     def visit(self, a, b):
-        if self.comparer.visit(a, b):
-            return
-        Visitor.visit(self, a, b)
+        equal, numeric = self.compare(a, b)
+        if not equal:
+            self.diff(a, b, numeric)
+
+    def compare(self, a, b):
+        '''Compare two nodes.
+
+        Returns whether they are equal and, for long numeric arrays, the
+        element-wise equality, so that the arrays are converted only once.'''
+
+        if isinstance(a, list) and isinstance(b, list):
+            na = numeric_array(a)
+            if na is not None:
+                nb = numeric_array(b)
+                if nb is not None:
+                    length = min(len(a), len(b))
+                    na, afloat = na
+                    nb, bfloat = nb
+                    equal = self.comparer.numeric_equal((na[:length], afloat[:length]), (nb[:length], bfloat[:length]))
+                    return len(a) == len(b) and bool(equal.all()), equal
+        return self.comparer.visit(a, b), None
+
+    def diff(self, a, b, numeric = None):
+        # a and b differ, so their subtrees will be compared again while
+        # descending, which is only linear if the outcomes are remembered
+        self.comparer.memoize = True
+        if numeric is not None:
+            self.visitNumericArray(a, b, numeric)
+        else:
+            Visitor.visit(self, a, b)
 
     def visitObject(self, a, b):
         if not isinstance(b, dict):
@@ -216,9 +451,10 @@ class Differ(Visitor):
                 name = names[i]
                 ae = a.get(name, None)
                 be = b.get(name, None)
-                if not self.comparer.visit(ae, be):
+                equal, numeric = self.compare(ae, be)
+                if not equal:
                     self.dumper.enter_member(name)
-                    self.visit(ae, be)
+                    self.diff(ae, be, numeric)
                     self.dumper.leave_member(i == len(names) - 1)
 
             self.dumper.leave_object()
@@ -239,16 +475,62 @@ class Differ(Visitor):
                 except IndexError:
                     be = None
                 self.dumper._indent()
-                if self.comparer.visit(ae, be):
+                equal, numeric = self.compare(ae, be)
+                if equal:
                     self.dumper.visit(ae)
                 else:
-                    self.visit(ae, be)
+                    self.diff(ae, be, numeric)
                 if i != max_len - 1:
                     self.dumper._write(',')
                 self.dumper._newline()
 
             self.dumper.leave_array()
 
+    def visitNumericArray(self, a, b, equal):
+        '''Write only the ranges of differing elements, as
+
+            FIRST-LAST: [a values] -> [b values]
+
+        or, for long ranges, just the number of differing elements.  equal is
+        the element-wise equality of the common prefix.'''
+
+        import numpy
+        length = min(len(a), len(b))
+
+        # Split the differing indices into contiguous runs
+        indices = numpy.flatnonzero(~equal)
+        breaks = numpy.flatnonzero(numpy.diff(indices) != 1) + 1
+        runs = [(int(run[0]), int(run[-1])) for run in numpy.split(indices, breaks) if len(run)]
+        if len(a) != len(b):
+            runs.append((length, max(len(a), len(b)) - 1))
+
+        self.dumper.enter_array()
+        for i in range(len(runs)):
+            first, last = runs[i]
+            self.dumper._indent()
+            if first == last:
+                self.dumper._write('%u: ' % first)
+            else:
+                self.dumper._write('%u-%u: ' % (first, last))
+            if last - first < numericRunLength:
+                if first == last:
+                    ae = a[first] if first < len(a) else None
+                    be = b[first] if first < len(b) else None
+                else:
+                    ae = a[first : last + 1] or None
+                    be = b[first : last + 1] or None
+                self.dumper._write(json.dumps(ae) + ' -> ' + json.dumps(be))
+            elif first >= len(b):
+                self.dumper._write('%u elements removed' % (last + 1 - first))
+            elif first >= len(a):
+                self.dumper._write('%u elements added' % (last + 1 - first))
+            else:
+                self.dumper._write('%u elements differ' % (last + 1 - first))
+            if i != len(runs) - 1:
+                self.dumper._write(',')
+            self.dumper._newline()
+        self.dumper.leave_array()
+
     def visitValue(self, a, b):
         if a != b:
             self.replace(a, b)
@@ -319,17 +601,610 @@ assert _strip_comments('''// a comment
 "'''
 
 
+def is_ubjson(data):
+    '''Whether the leading bytes of a state dump are UBJSON rather than JSON
+    text, based on the length marker of the first member name.'''
+    return data[:1] == b'{' and data[1:2] in (b'i', b'U', b'I', b'l', b'L', b'N')
+
+
 def load(stream, strip_images = True, strip_comments = True):
     if strip_images:
         object_hook = strip_object_hook
     else:
         object_hook = None
+    data = stream.read()
+    if isinstance(data, bytes):
+        if is_ubjson(data):
+            return UBJSONStreamParser(None, strip_images, data).parse_value()
+        data = data.decode('utf-8')
     if strip_comments:
-        data = stream.read()
         data = _strip_comments(data)
-        return json.loads(data, strict=False, object_hook = object_hook)
-    else:
-        return json.load(stream, strict=False, object_hook = object_hook)
+    return json.loads(data, strict=False, object_hook = object_hook)
+
+
+def open_stream(stream, strip_images = True):
+    '''Return a StreamParser or UBJSONStreamParser for the binary stream,
+    depending on its contents.'''
+
+    data = b''
+    while len(data) < 2:
+        chunk = stream.read(2 - len(data))
+        if not chunk:
+            break
+        data += chunk
+    if is_ubjson(data):
+        return UBJSONStreamParser(stream, strip_images, data)
+    return StreamParser(io.TextIOWrapper(stream, encoding='utf-8'), strip_images, data.decode('utf-8'))
+
+
+class StreamParser:
+    '''Incremental JSON parser.
+
+    Reads the stream in chunks, so that only the values actually requested
+    are materialized.  Also skips (non-standard) // comments.  When
+    strip_images is set, members named __*__ (such as the base64 __data__
+    of images) are skipped without being materialized, except for
+    __class__, which marks objects to be replaced by null.'''
+
+    chunkSize = 1 << 16
+
+    _whitespace = ' \t\r\n'
+    _delimiters = ' \t\r\n,:[]{}/'
+
+    def __init__(self, stream, strip_images = True, data = ''):
+        self.stream = stream
+        self.strip_images = strip_images
+        self.buf = data
+        self.pos = 0
+
+    def _fill(self):
+        '''Read another chunk, discarding the consumed part of the buffer.'''
+        chunk = self.stream.read(self.chunkSize)
+        if not chunk:
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _ensure(self, n):
+        while len(self.buf) - self.pos < n:
+            if not self._fill():
+                return False
+        return True
+
+    def peek(self):
+        '''Skip whitespace and comments, and return the next character.'''
+        while True:
+            buf = self.buf
+            pos = self.pos
+            while pos < len(buf) and buf[pos] in self._whitespace:
+                pos += 1
+            self.pos = pos
+            if pos == len(buf):
+                if not self._fill():
+                    return ''
+                continue
+            if buf[pos] == '/':
+                if not self._ensure(2) or self.buf[self.pos + 1] != '/':
+                    raise ValueError('unexpected character %r' % '/')
+                while True:
+                    end = self.buf.find('\n', self.pos)
+                    if end >= 0:
+                        self.pos = end + 1
+                        break
+                    self.pos = len(self.buf)
+                    if not self._fill():
+                        break
+                continue
+            return buf[pos]
+
+    def expect(self, c):
+        if self.peek() != c:
+            raise ValueError('expected %r, got %r' % (c, self.peek()))
+        self.pos += 1
+
+    def _raw_chunks(self):
+        '''Iterate over the text of a string, without the quotes, in chunks
+        with escape sequences intact.'''
+
+        self.expect('"')
+        while True:
+            buf = self.buf
+            end = buf.find('"', self.pos)
+            if end < 0:
+                escape = buf.find('\\', self.pos)
+            else:
+                escape = buf.find('\\', self.pos, end)
+            if escape >= 0:
+                # Keep the escape sequence verbatim, for json to decode
+                if not self._ensure(escape - self.pos + 2):
+                    raise ValueError('unterminated string')
+                escape = self.buf.find('\\', self.pos)
+                length = 2
+                if self.buf[escape + 1] == 'u':
+                    length = 6
+                    if not self._ensure(escape - self.pos + length):
+                        raise ValueError('unterminated string')
+                    escape = self.buf.find('\\', self.pos)
+                yield self.buf[self.pos : escape + length]
+                self.pos = escape + length
+                continue
+            if end >= 0:
+                yield buf[self.pos : end]
+                self.pos = end + 1
+                return
+            yield buf[self.pos:]
+            self.pos = len(buf)
+            if not self._fill():
+                raise ValueError('unterminated string')
+
+    def _string(self, keep):
+        if not keep:
+            for chunk in self._raw_chunks():
+                pass
+            return None
+        return json.loads('"' + ''.join(self._raw_chunks()) + '"', strict=False)
+
+    def data_chunks(self):
+        '''Iterate over the decoded bytes of a base64 string (such as image
+        __data__), in chunks.'''
+
+        pending = ''
+        for chunk in self._raw_chunks():
+            if '\\' in chunk:
+                chunk = json.loads('"' + chunk + '"', strict=False)
+            # Base64 strings are broken in lines
+            pending += chunk.replace('\n', '').replace('\r', '')
+            length = len(pending) - len(pending) % 4
+            if length:
+                yield base64.b64decode(pending[:length])
+                pending = pending[length:]
+        if pending:
+            yield base64.b64decode(pending)
+
+    def _literal(self):
+        # Numbers, true, false, null, NaN, Infinity
+        token = ''
+        while True:
+            buf = self.buf
+            pos = self.pos
+            while pos < len(buf) and buf[pos] not in self._delimiters:
+                pos += 1
+            token += buf[self.pos : pos]
+            self.pos = pos
+            if pos < len(buf) or not self._fill():
+                break
+        if not token:
+            raise ValueError('unexpected character %r' % self.peek())
+        return json.loads(token)
+
+    def members(self):
+        '''Iterate over the member names of an object, leaving the parser at
+        each member value, which must be consumed before continuing.'''
+
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            name = self._string(True)
+            self.expect(':')
+            if self.strip_images and name.startswith('__') and name.endswith('__') and name != '__class__':
+                self.skip_value()
+            else:
+                yield name
+            c = self.peek()
+            self.pos += 1
+            if c == '}':
+                return
+            if c != ',':
+                raise ValueError('expected \',\' or \'}\', got %r' % c)
+
+    def elements(self):
+        '''Iterate over the elements of an array, leaving the parser at each
+        element, which must be consumed before continuing.'''
+
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            c = self.peek()
+            self.pos += 1
+            if c == ']':
+                return
+            if c != ',':
+                raise ValueError('expected \',\' or \']\', got %r' % c)
+
+    def parse_value(self):
+        c = self.peek()
+        if c == '{':
+            obj = {}
+            for name in self.members():
+                obj[name] = self.parse_value()
+            if self.strip_images:
+                obj = strip_object_hook(obj)
+            return obj
+        elif c == '[':
+            array = []
+            for _ in self.elements():
+                array.append(self.parse_value())
+            return array
+        elif c == '"':
+            return self._string(True)
+        else:
+            return self._literal()
+
+    def skip_value(self):
+        c = self.peek()
+        if c == '{':
+            strip_images = self.strip_images
+            self.strip_images = False
+            for name in self.members():
+                self.skip_value()
+            self.strip_images = strip_images
+        elif c == '[':
+            for _ in self.elements():
+                self.skip_value()
+        elif c == '"':
+            self._string(False)
+        else:
+            self._literal()
+
+    def seek_member(self, name):
+        '''Position the parser at the value of the given top-level member.'''
+        for member in self.members():
+            if member == name:
+                return True
+            self.skip_value()
+        return False
+
+
+class UBJSONStreamParser:
+    '''Incremental UBJSON parser, with the same interface as StreamParser.
+
+    Binary data (strongly typed uint8 arrays, which is how image pixels are
+    written) is returned as a memoryview of the read buffer whenever it fits,
+    and is skipped without copying when stripping images.'''
+
+    chunkSize = 1 << 16
+
+    _formats = {
+        'i': struct.Struct('>b'),
+        'U': struct.Struct('>B'),
+        'I': struct.Struct('>h'),
+        'l': struct.Struct('>i'),
+        'L': struct.Struct('>q'),
+        'd': struct.Struct('>f'),
+        'D': struct.Struct('>d'),
+    }
+
+    _constants = {
+        'Z': None,
+        'T': True,
+        'F': False,
+    }
+
+    def __init__(self, stream, strip_images = True, data = b''):
+        self.stream = stream
+        self.strip_images = strip_images
+        self.buf = data
+        self.pos = 0
+
+    def _fill(self, n):
+        '''Ensure at least n bytes are buffered.'''
+        available = len(self.buf) - self.pos
+        while available < n:
+            chunk = None
+            if self.stream is not None:
+                chunk = self.stream.read(max(self.chunkSize, n - available))
+            if not chunk:
+                raise ValueError('unexpected end of UBJSON data')
+            self.buf = self.buf[self.pos:] + chunk
+            self.pos = 0
+            available = len(self.buf)
+
+    def _read(self, n):
+        if len(self.buf) - self.pos < n and n > self.chunkSize:
+            # Large payloads are read directly rather than through the buffer
+            data = self.buf[self.pos:] + self.stream.read(n - (len(self.buf) - self.pos))
+            self.buf = b''
+            self.pos = 0
+            if len(data) < n:
+                raise ValueError('unexpected end of UBJSON data')
+            return data
+        self._fill(n)
+        data = memoryview(self.buf)[self.pos : self.pos + n]
+        self.pos += n
+        return data
+
+    def _skip(self, n):
+        available = len(self.buf) - self.pos
+        if n <= available:
+            self.pos += n
+            return
+        n -= available
+        self.buf = b''
+        self.pos = 0
+        while n:
+            chunk = self.stream.read(min(n, self.chunkSize))
+            if not chunk:
+                raise ValueError('unexpected end of UBJSON data')
+            n -= len(chunk)
+
+    def peek(self):
+        '''Skip no-op markers, and return the next marker.'''
+        while True:
+            if self.pos == len(self.buf):
+                try:
+                    self._fill(1)
+                except ValueError:
+                    return ''
+            marker = chr(self.buf[self.pos])
+            if marker != 'N':
+                return marker
+            self.pos += 1
+
+    def _marker(self):
+        marker = self.peek()
+        if not marker:
+            raise ValueError('unexpected end of UBJSON data')
+        self.pos += 1
+        return marker
+
+    def _number(self, marker):
+        try:
+            format = self._formats[marker]
+        except KeyError:
+            raise ValueError('unexpected UBJSON marker %r' % marker)
+        self._fill(format.size)
+        value, = format.unpack_from(self.buf, self.pos)
+        self.pos += format.size
+        return value
+
+    def _size(self):
+        size = self._number(self._marker())
+        if not isinstance(size, int) or size < 0:
+            raise ValueError('invalid UBJSON size %r' % size)
+        return size
+
+    def _string(self):
+        return str(self._read(self._size()), 'utf-8')
+
+    def _container(self):
+        '''Parse the optional type and count of a container, returning the
+        element type and count (None when not specified).'''
+
+        self._marker()
+        type = None
+        count = None
+        if self.peek() == '$':
+            self.pos += 1
+            type = self._marker()
+            if self.peek() != '#':
+                raise ValueError('UBJSON typed container without count')
+        if self.peek() == '#':
+            self.pos += 1
+            count = self._size()
+        return type, count
+
+    def _scalar(self, marker):
+        if marker in self._constants:
+            return self._constants[marker]
+        elif marker == 'C':
+            return chr(self._number('U'))
+        elif marker == 'S':
+            return self._string()
+        elif marker == 'H':
+            return json.loads(self._string())
+        else:
+            return self._number(marker)
+
+    def members(self):
+        '''Iterate over the member names of an object, leaving the parser at
+        each member value, which must be consumed before continuing.'''
+
+        type, count = self._container()
+        if type is not None:
+            raise ValueError('UBJSON typed objects are not supported')
+        i = 0
+        while True:
+            if count is None:
+                if self.peek() == '}':
+                    self.pos += 1
+                    return
+            elif i == count:
+                return
+            i += 1
+            name = self._string()
+            if self.strip_images and name.startswith('__') and name.endswith('__') and name != '__class__':
+                self.skip_value()
+            else:
+                yield name
+
+    def parse_value(self):
+        marker = self.peek()
+        if marker == '{':
+            obj = {}
+            for name in self.members():
+                obj[name] = self.parse_value()
+            if self.strip_images:
+                obj = strip_object_hook(obj)
+            return obj
+        elif marker == '[':
+            type, count = self._container()
+            if type == 'U':
+                return self._read(count)
+            elif type is not None:
+                return [self._scalar(type) for i in range(count)]
+            array = []
+            while count is None or len(array) < count:
+                if count is None and self.peek() == ']':
+                    self.pos += 1
+                    break
+                array.append(self.parse_value())
+            return array
+        else:
+            self.pos += 1
+            return self._scalar(marker)
+
+    def skip_value(self):
+        marker = self.peek()
+        if marker == '{':
+            strip_images = self.strip_images
+            self.strip_images = False
+            for name in self.members():
+                self.skip_value()
+            self.strip_images = strip_images
+        elif marker == '[':
+            type, count = self._container()
+            if type in self._formats:
+                self._skip(count * self._formats[type].size)
+            elif type is not None:
+                for i in range(count):
+                    self._scalar(type)
+            else:
+                i = 0
+                while count is None or i < count:
+                    if count is None and self.peek() == ']':
+                        self.pos += 1
+                        break
+                    self.skip_value()
+                    i += 1
+        else:
+            self.pos += 1
+            self._scalar(marker)
+
+    def data_chunks(self):
+        '''Iterate over the bytes of binary data (such as image __data__), in
+        chunks.'''
+
+        if self.peek() != '[':
+            value = self.parse_value()
+            if isinstance(value, str):
+                value = base64.b64decode(value)
+            yield value
+            return
+        type, count = self._container()
+        if type != 'U':
+            raise ValueError('expected UBJSON binary data')
+        while count:
+            available = len(self.buf) - self.pos
+            if not available:
+                self._fill(1)
+                available = len(self.buf) - self.pos
+            length = min(count, available)
+            yield memoryview(self.buf)[self.pos : self.pos + length]
+            self.pos += length
+            count -= length
+
+    def seek_member(self, name):
+        '''Position the parser at the value of the given top-level member.'''
+        for member in self.members():
+            if member == name:
+                return True
+            self.skip_value()
+        return False
+
+
+class StreamDiffer:
+    '''Differ which walks two StreamParsers in lockstep.
+
+    Objects are compared member by member as they are read, so that only the
+    current path, arrays, leaf values, and the differences found so far are
+    held in memory.  The output is the same as Differ's.'''
+
+    def __init__(self, stream = sys.stdout, ignore_added = False):
+        self.stream = stream
+        self.comparer = Comparer(ignore_added = ignore_added)
+
+    def diff(self, a, b):
+        text = self._diff(a, b, 0)
+        if text is not None:
+            self.stream.write(text)
+
+    def _diff(self, a, b, level):
+        if a.peek() == '{' and b.peek() == '{':
+            return self._diffObject(a, b, level)
+        return self._render(a.parse_value(), b.parse_value(), level)
+
+    def _render(self, a, b, level):
+        stream = io.StringIO()
+        differ = Differ(stream, self.comparer.ignore_added)
+        # Long numeric arrays must take Differ's vectorized path, so that
+        # they are written as index ranges as well
+        equal, numeric = differ.compare(a, b)
+        if equal:
+            return None
+        differ.dumper.level = level
+        differ.diff(a, b, numeric)
+        return stream.getvalue()
+
+    def _rest(self, parser, name, members):
+        # Materialize the remaining members of an object
+        obj = {}
+        while name is not None:
+            obj[name] = parser.parse_value()
+            name = next(members, None)
+        return obj
+
+    def _diffObject(self, a, b, level):
+        a_members = a.members()
+        b_members = b.members()
+        a_name = next(a_members, None)
+        b_name = next(b_members, None)
+
+        # Images are expected to start with a __class__ member
+        if a.strip_images and (a_name == '__class__' or b_name == '__class__'):
+            a_rest = strip_object_hook(self._rest(a, a_name, a_members))
+            b_rest = strip_object_hook(self._rest(b, b_name, b_members))
+            return self._render(a_rest, b_rest, level)
+
+        names = []
+        diffs = {}
+        keys_differ = False
+        while a_name is not None or b_name is not None:
+            if a_name != b_name:
+                # Member order diverged, so compare the remainder as a whole
+                a_rest = self._rest(a, a_name, a_members)
+                b_rest = self._rest(b, b_name, b_members)
+                rest = set(a_rest.keys())
+                if self.comparer.ignore_added:
+                    keys_differ = not rest.issubset(b_rest.keys())
+                else:
+                    keys_differ = rest != set(b_rest.keys())
+                    rest.update(b_rest.keys())
+                for name in rest:
+                    names.append(name)
+                    text = self._render(a_rest.get(name, None), b_rest.get(name, None), level + 1)
+                    if text is not None:
+                        diffs[name] = text
+                break
+
+            names.append(a_name)
+            text = self._diff(a, b, level + 1)
+            if text is not None:
+                diffs[a_name] = text
+            a_name = next(a_members, None)
+            b_name = next(b_members, None)
+
+        if not diffs and not keys_differ:
+            return None
+
+        stream = io.StringIO()
+        dumper = Dumper(stream)
+        dumper.level = level
+        dumper.enter_object()
+        names.sort()
+        for i in range(len(names)):
+            name = names[i]
+            if name in diffs:
+                dumper.enter_member(name)
+                dumper._write(diffs[name])
+                dumper.leave_member(i == len(names) - 1)
+        dumper.leave_object()
+        return stream.getvalue()
 
 
 def main():
@@ -343,20 +1218,35 @@ def main():
         '--keep-images',
         action="store_false", dest="strip_images", default=True,
         help="compare images")
+    optparser.add_option(
+        '--stream',
+        action="store_true", dest="stream", default=False,
+        help="parse and compare incrementally, with memory proportional to the nesting depth")
+    optparser.add_option(
+        '--fingerprint',
+        action="store_true", dest="fingerprint", default=False,
+        help="skip identical subtrees via digests, which rarely pays off as comparisons are already memoized")
 
     (options, args) = optparser.parse_args(sys.argv[1:])
 
     if len(args) != 2:
         optparser.error('incorrect number of arguments')
 
-    a = load(open(args[0], 'rt'), options.strip_images)
-    b = load(open(args[1], 'rt'), options.strip_images)
+    if options.stream:
+        a = open_stream(open(args[0], 'rb'), options.strip_images)
+        b = open_stream(open(args[1], 'rb'), options.strip_images)
+        differ = StreamDiffer(ignore_added = options.ignore_added)
+        differ.diff(a, b)
+        return
+
+    a = load(open(args[0], 'rb'), options.strip_images)
+    b = load(open(args[1], 'rb'), options.strip_images)
 
     if False:
         dumper = Dumper()
         dumper.visit(a)
 
-    differ = Differ(ignore_added = options.ignore_added)
+    differ = Differ(ignore_added = options.ignore_added, fingerprint = options.fingerprint)
     differ.visit(a, b)
 
 
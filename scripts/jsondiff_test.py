@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+##########################################################################
+#
+# Copyright 2026 Jose Fonseca
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the 'Software'), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+##########################################################################/
+
+
+'''Check that StreamDiffer produces the same output as Differ.'''
+
+
+import copy
+import io
+import json
+import random
+import unittest
+
+import jsondiff
+
+
+def randomValue(rng, depth = 0):
+    r = rng.random()
+    if depth > 3 or r < 0.4:
+        return rng.choice([0, 1, 1.0, 1.5, 'a', 'a\nb', None, True])
+    if r < 0.6:
+        return [randomValue(rng, depth + 1) for i in range(rng.randint(0, 6))]
+    if r < 0.7:
+        # Long enough to take the vectorized numeric path
+        return [rng.choice([1, 2.0, 3.5]) for i in range(rng.randint(60, 200))]
+    return dict([('k%u' % i, randomValue(rng, depth + 1)) for i in range(rng.randint(0, 6))])
+
+
+def mutate(rng, value):
+    if isinstance(value, list) and value and rng.random() < 0.8:
+        i = rng.randrange(len(value))
+        value[i] = mutate(rng, value[i])
+        return value
+    if isinstance(value, dict) and value and rng.random() < 0.8:
+        name = rng.choice(sorted(value.keys()))
+        value[name] = mutate(rng, value[name])
+        return value
+    return randomValue(rng, 2)
+
+
+class StreamDifferTest(unittest.TestCase):
+
+    def assertSameDiff(self, a, b, ignore_added = False):
+        expected = io.StringIO()
+        jsondiff.Differ(expected, ignore_added = ignore_added).visit(a, b)
+
+        actual = io.StringIO()
+        differ = jsondiff.StreamDiffer(actual, ignore_added = ignore_added)
+        differ.diff(jsondiff.StreamParser(io.StringIO(json.dumps(a))),
+                    jsondiff.StreamParser(io.StringIO(json.dumps(b))))
+
+        self.assertEqual(actual.getvalue(), expected.getvalue())
+
+    def testNumericArray(self):
+        a = {'buffer': {'data': list(range(100)), 'size': 100}}
+        b = copy.deepcopy(a)
+        b['buffer']['data'][10] = -1
+        for i in range(50, 60):
+            b['buffer']['data'][i] = 0.5
+        self.assertSameDiff(a, b)
+
+    def testNumericArrayLength(self):
+        a = {'data': [0.25]*80}
+        b = {'data': [0.25]*70}
+        self.assertSameDiff(a, b)
+        self.assertSameDiff(b, a)
+
+    def testRandom(self):
+        rng = random.Random(0)
+        for i in range(500):
+            a = {'parameters': randomValue(rng)}
+            b = mutate(rng, copy.deepcopy(a))
+            self.assertSameDiff(a, b)
+            self.assertSameDiff(a, b, ignore_added = True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -25,56 +25,223 @@
 ##########################################################################/
 
 
-'''Simple script to extract PNG files from the JSON state dumps.'''
+'''Simple script to extract PNG files from the JSON state dumps.
 
+The dumps (JSON or UBJSON) are parsed incrementally, and image data is decoded
+and written as it is read, so that memory usage does not depend on the size of
+the dumps.  When several dumps are given, they are extracted in parallel.
+PNM/PFM images can optionally be converted to PNG, in parallel too.
+'''
 
-import json
+
+import multiprocessing
 import optparse
-import base64
+import os.path
 import sys
 
+from jsondiff import open_stream
+
 
 pngSignature = b"\x89\x50\x4E\x47\x0D\x0A\x1A\x0A"
 
 
-def dumpSurfaces(state, memberName):
-    for name, imageObj in state[memberName].items():
-        data = imageObj['__data__']
-        data = base64.b64decode(data)
+def imageExtension(data):
+    if data.startswith(pngSignature):
+        return 'png'
+    magic = data[:2]
+    if magic in (b'P1', b'P4'):
+        return 'pbm'
+    elif magic in (b'P2', b'P5'):
+        return 'pgm'
+    elif magic in (b'P3', b'P6'):
+        return 'ppm'
+    elif magic in (b'Pf', b'PF', b'PX'):
+        return 'pfm'
+    else:
+        sys.stderr.write('warning: unsupport Netpbm format %s\n' % magic)
+        return None
+
+
+def dumpImage(parser, members, prefix):
+    '''Write the __data__ of the image whose remaining members are being
+    iterated, and return the file name, or None.'''
+
+    imageName = None
+    for name in members:
+        if name != '__data__':
+            parser.skip_value()
+            continue
+
+        # Gather enough bytes to recognize the format
+        chunks = parser.data_chunks()
+        head = b''
+        for chunk in chunks:
+            head += chunk
+            if len(head) >= len(pngSignature):
+                break
+
+        extName = imageExtension(head)
+        if extName is None:
+            for chunk in chunks:
+                pass
+            continue
+
+        imageName = '%s.%s' % (prefix, extName)
+        stream = open(imageName, 'wb')
+        stream.write(head)
+        for chunk in chunks:
+            stream.write(chunk)
+        stream.close()
+        sys.stderr.write('Wrote %s\n' % imageName)
+
+    return imageName
+
+
+def dumpSurfaces(parser, path, outputDir):
+    '''Walk the value the parser is at, writing every image found, and
+    yielding the names of the written files.'''
+
+    if parser.peek() != '{':
+        parser.skip_value()
+        return
 
-        if data.startswith(pngSignature):
-            extName = 'png'
+    members = parser.members()
+    name = next(members, None)
+    if name == '__class__':
+        # Images are objects with a leading __class__ member
+        if parser.parse_value() == 'image':
+            prefix = '-'.join(path[1:]).replace(os.sep, '_')
+            imageName = dumpImage(parser, members, os.path.join(outputDir, prefix))
+            if imageName is not None:
+                yield imageName
         else:
-            magic = data[:2]
-            if magic in (b'P1', b'P4'):
-                extName = 'pbm'
-            elif magic in (b'P2', b'P5'):
-                extName = 'pgm'
-            elif magic in (b'P3', b'P6'):
-                extName = 'ppm'
-            elif magic in (b'Pf', b'PF'):
-                extName = 'pfm'
-            else:
-                sys.stderr.write('warning: unsupport Netpbm format %s\n' % magic)
-                continue
+            for name in members:
+                parser.skip_value()
+        return
+
+    while name is not None:
+        for imageName in dumpSurfaces(parser, path + [name], outputDir):
+            yield imageName
+        name = next(members, None)
+
+
+def dumpState(stream, groups, outputDir):
+    '''Extract the images of the given top-level groups (all when empty).'''
+
+    parser = open_stream(stream, strip_images = False)
+    for name in parser.members():
+        if groups and name not in groups:
+            parser.skip_value()
+            continue
+        for imageName in dumpSurfaces(parser, [name], outputDir):
+            yield imageName
 
-        imageName = '%s.%s' % (name, extName)
-        open(imageName, 'wb').write(data)
-        sys.stderr.write('Wrote %s\n' % imageName)
+
+def extractDump(args):
+    '''Extract the images of a whole dump, returning the names of the written
+    files.
+
+    Runs in a worker process.'''
+
+    filename, groups, outputDir = args
+    return list(dumpState(open(filename, 'rb'), groups, outputDir))
+
+
+def convertToPNG(imageName):
+    '''Convert a PNM/PFM image to PNG, removing the original.'''
+
+    from PIL import Image
+
+    stream = open(imageName, 'rb')
+    magic = stream.readline().rstrip()
+    line = stream.readline()
+    while line.startswith(b'#'):
+        line = stream.readline()
+    width, height = list(map(int, line.split()))
+    stream.readline()
+    data = stream.read()
+    stream.close()
+
+    if magic in (b'P5', b'P6'):
+        mode = {b'P5': 'L', b'P6': 'RGB'}[magic]
+        image = Image.frombuffer(mode, (width, height), data, 'raw', mode, 0, 1)
+    elif magic in (b'Pf', b'PF', b'PX'):
+        import numpy
+        channels = {b'Pf': 1, b'PF': 3, b'PX': 4}[magic]
+        pixels = numpy.frombuffer(data, dtype=numpy.float32, count=width*height*channels)
+        pixels = (pixels*255).clip(0, 255).astype(numpy.uint8)
+        mode = {1: 'L', 3: 'RGB', 4: 'RGBA'}[channels]
+        image = Image.frombuffer(mode, (width, height), pixels.tobytes(), 'raw', mode, 0, 1)
+    else:
+        return None
+
+    pngName = os.path.splitext(imageName)[0] + '.png'
+    image.save(pngName)
+    os.remove(imageName)
+    return pngName
 
 
 def main():
     optparser = optparse.OptionParser(
-        usage="\n\t%prog [options] <json>")
+        usage="\n\t%prog [options] <json> ...")
+    optparser.add_option(
+        '-g', '--group', metavar='NAME',
+        type='string', action='append', dest='groups', default=[],
+        help='only extract images from this top-level member, e.g. textures or framebuffer [default: all]')
+    optparser.add_option(
+        '-o', '--output-dir', metavar='PATH',
+        type='string', dest='output_dir', default='.',
+        help='output directory; when several dumps are given, each gets a subdirectory [default: %default]')
+    optparser.add_option(
+        '--png',
+        action='store_true', dest='png', default=False,
+        help='convert PNM/PFM images to PNG')
+    optparser.add_option(
+        '-j', '--jobs', metavar='N',
+        type='int', dest='jobs', default=os.cpu_count() or 1,
+        help='number of processes extracting dumps and converting images [default: %default]')
 
     (options, args) = optparser.parse_args(sys.argv[1:])
 
+    tasks = []
     for arg in args:
-        state = json.load(open(arg, 'rt'), strict=False)
-
-        dumpSurfaces(state, 'textures')
-        dumpSurfaces(state, 'framebuffer')
-
+        outputDir = options.output_dir
+        if len(args) > 1:
+            outputDir = os.path.join(outputDir, os.path.basename(arg))
+        if not os.path.isdir(outputDir):
+            os.makedirs(outputDir)
+        tasks.append((arg, options.groups, outputDir))
+
+    pool = None
+    if options.jobs > 1 and (options.png or len(tasks) > 1):
+        pool = multiprocessing.Pool(options.jobs)
+    conversions = []
+
+    # A single dump is a single stream, which can only be decoded in order,
+    # so it is extracted here while its images are converted by the pool
+    if pool is not None and len(tasks) > 1:
+        imageNameLists = pool.imap_unordered(extractDump, tasks)
+    else:
+        imageNameLists = [dumpState(open(filename, 'rb'), groups, outputDir) for filename, groups, outputDir in tasks]
+
+    for imageNames in imageNameLists:
+        for imageName in imageNames:
+            if not options.png or imageName.endswith('.png'):
+                continue
+            if pool is not None:
+                conversions.append(pool.apply_async(convertToPNG, (imageName,)))
+            else:
+                pngName = convertToPNG(imageName)
+                if pngName is not None:
+                    sys.stderr.write('Wrote %s\n' % pngName)
+
+    if pool is not None:
+        pool.close()
+        for conversion in conversions:
+            pngName = conversion.get()
+            if pngName is not None:
+                sys.stderr.write('Wrote %s\n' % pngName)
+        pool.join()
 
 
 if __name__ == '__main__':
@@ -33,8 +33,125 @@ import re
 import unpickle
 
 
+def _handleType(type):
+    '''Return the Handle type, if type is a (const) handle, else None.'''
+
+    from specs import stdapi
+
+    while isinstance(type, stdapi.Const):
+        type = type.type
+    if isinstance(type, stdapi.Handle):
+        return type
+    return None
+
+
+def buildDispatchTable(functions):
+    '''Build a map from function name to (verb, kind, argIndex, rangeIndex),
+    where verb is 'Gen' or 'Delete', kind is the handle name, argIndex is
+    the index of the argument with the object names (or None for the return
+    value), and rangeIndex that of the argument with the number of
+    consecutive names (or None).'''
+
+    from specs import stdapi
+
+    table = {}
+    for function in functions:
+        mo = LeakDetector.verbRegExp.match(function.name)
+        if not mo:
+            continue
+        verb = LeakDetector.verbs[mo.group(1)]
+
+        argNames = [arg.name for arg in function.args]
+        rangeIndex = None
+        if 'range' in argNames:
+            rangeIndex = argNames.index('range')
+
+        entry = None
+        if verb == 'Gen':
+            handle = _handleType(function.type)
+            if handle is not None:
+                entry = verb, handle.name, None, rangeIndex
+        for index in range(len(function.args)):
+            arg = function.args[index]
+            if entry is not None:
+                break
+            type = arg.type
+            if isinstance(type, stdapi.Array):
+                handle = _handleType(type.type)
+                if handle is not None and arg.output == (verb == 'Gen'):
+                    entry = verb, handle.name, index, None
+            elif verb == 'Delete':
+                handle = _handleType(type)
+                if handle is not None:
+                    entry = verb, handle.name, index, rangeIndex
+        if entry is not None:
+            table[function.name] = entry
+    return table
+
+
+def undeletableKinds(table):
+    '''Return the sorted kinds of objects which the dispatch table can
+    generate but not delete.
+
+    Every object of such a kind would be reported as leaked, which usually
+    means that the Delete function's names are not typed as handles in the
+    specs.'''
+
+    kinds = {}
+    for verb, kind, argIndex, rangeIndex in table.values():
+        kinds.setdefault(kind, set()).add(verb)
+    return sorted([kind for kind, verbs in kinds.items() if 'Delete' not in verbs])
+
+
+def loadDispatchTable():
+    '''Build the dispatch table from the GL specs, if available.'''
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+    try:
+        from specs.glapi import glapi
+    except ImportError:
+        return None
+    finally:
+        sys.path.pop(0)
+    table = buildDispatchTable(glapi.functions)
+    for kind in undeletableKinds(table):
+        sys.stderr.write('warning: no function deletes %s objects, so they will all be reported as leaked\n' % kind)
+    return table
+
+
 class LeakDetector(unpickle.Unpickler):
 
+    # Functions which create or destroy objects
+    verbRegExp = re.compile('^gl(Gen|Create|Fence|Delete|Destroy)[A-Z]')
+    verbs = {
+        'Gen': 'Gen',
+        'Create': 'Gen',
+        'Fence': 'Gen',
+        'Delete': 'Delete',
+        'Destroy': 'Delete',
+    }
+
+    # Fallback for when the specs are not available
+    genDelRegExp = re.compile('^gl(Gen|Delete)(Buffers|Textures|FrameBuffers|RenderBuffers)[A-Z]*$')
+
+    contextCreateFunctions = [
+        'CGLCreateContext',
+        'eglCreateContext',
+        'glXCreateContext',
+        'glXCreateNewContext',
+        'glXCreateContextAttribsARB',
+        'glXCreateContextWithConfigSGIX',
+        'wglCreateContext',
+        'wglCreateContextAttribsARB',
+    ]
+
+    contextDestroyFunctions = [
+        'CGLDestroyContext',
+        'glXDestroyContext',
+        'eglDestroyContext',
+        'wglDeleteContext',
+    ]
+
     def __init__(self, apitrace, trace):
         stream = unpickle.pickleTrace(trace, apitrace=apitrace, symbolic=True)
         unpickle.Unpickler.__init__(self, stream)
@@ -44,14 +161,42 @@ class LeakDetector(unpickle.Unpickler):
         # a map of maps
         self.objectDicts = {}
 
+        # function name -> (handler, args), or None for calls to ignore
+        self.dispatchTable = {}
+        self.specTable = loadDispatchTable()
+        if self.specTable is not None:
+            for functionName, entry in self.specTable.items():
+                self.dispatchTable[functionName] = self.bindHandler(*entry)
+        for functionName in self.contextCreateFunctions:
+            self.dispatchTable[functionName] = self.handleCreateContext, ()
+        for functionName in self.contextDestroyFunctions:
+            self.dispatchTable[functionName] = self.handleDestroyContext, ()
+
+    def bindHandler(self, verb, kind, argIndex, rangeIndex):
+        objectDict = self.objectDicts.setdefault(kind, {})
+        if verb == 'Gen':
+            handler = self.handleGenerate
+        else:
+            handler = self.handleDelete
+        return handler, (objectDict, argIndex, rangeIndex)
+
+    def lookupHandler(self, functionName):
+        '''Handler for a function not in the dispatch table.'''
+
+        if self.specTable is None:
+            mo = self.genDelRegExp.match(functionName)
+            if mo:
+                verb = mo.group(1)
+                kind = mo.group(2).lower().rstrip('s')
+                return self.bindHandler(verb, kind, 1, None)
+        return None
+
     def parse(self):
         unpickle.Unpickler.parse(self)
 
         # Reached the end of the trace -- dump any live objects
         self.dumpLeaks("<EOF>")
 
-    genDelRegExp = re.compile('^gl(Gen|Delete)(Buffers|Textures|FrameBuffers|RenderBuffers)[A-Z]*$')
-
     def handleCall(self, call):
         # Ignore calls without side effects
         if call.flags & unpickle.CALL_FLAG_NO_SIDE_EFFECTS:
@@ -61,58 +206,49 @@ class LeakDetector(unpickle.Unpickler):
         if 0:
             sys.stderr.write('%s\n' % call)
 
-        mo = self.genDelRegExp.match(call.functionName)
-        if mo:
-            verb = mo.group(1)
-            subject = mo.group(2)
+        try:
+            entry = self.dispatchTable[call.functionName]
+        except KeyError:
+            entry = self.lookupHandler(call.functionName)
+            self.dispatchTable[call.functionName] = entry
+        if entry is not None:
+            handler, args = entry
+            handler(call, *args)
 
-            subject = subject.lower().rstrip('s')
-            objectDict = self.objectDicts.setdefault(subject, {})
+        # TODO: Track labels via glObjectLabel* calls
 
-            if verb == 'Gen':
-                self.handleGenerate(call, objectDict)
-            elif verb == 'Delete':
-                self.handleDelete(call, objectDict)
-            else:
-                assert 0
+    def handleCreateContext(self, call):
+        # FIXME: Ignore failing context creation calls
+        self.numContexts += 1
 
-        # TODO: Track labels via glObjectLabel* calls
+    def handleDestroyContext(self, call):
+        assert self.numContexts > 0
+        self.numContexts -= 1
+        if self.numContexts == 0:
+            self.dumpLeaks(call.no)
+
+    def objectNames(self, call, argIndex, rangeIndex):
+        if argIndex is None:
+            value = call.ret
+        else:
+            value = call.args[argIndex][1]
+        if value is None:
+            return []
+        if rangeIndex is not None:
+            return list(range(value, value + call.args[rangeIndex][1]))
+        if isinstance(value, (list, tuple)):
+            return value
+        return [value]
 
-        if call.functionName in [
-            'CGLCreateContext',
-            'eglCreateContext',
-            'glXCreateContext',
-            'glXCreateNewContext',
-            'glXCreateContextAttribsARB',
-            'glXCreateContextWithConfigSGIX',
-            'wglCreateContext',
-            'wglCreateContextAttribsARB',
-        ]:
-            # FIXME: Ignore failing context creation calls
-            self.numContexts += 1
-
-        if call.functionName in [
-            'CGLDestroyContext',
-            'glXDestroyContext',
-            'eglDestroyContext',
-            'wglDeleteContext',
-        ]:
-            assert self.numContexts > 0
-            self.numContexts -= 1
-            if self.numContexts == 0:
-                self.dumpLeaks(call.no)
-
-    def handleGenerate(self, call, objectDict):
-        n, names = call.argValues()
-        for i in range(n):
-            name = names[i]
-            objectDict[name] = call.no
+    def handleGenerate(self, call, objectDict, argIndex, rangeIndex):
+        for name in self.objectNames(call, argIndex, rangeIndex):
+            # Zero denotes failure (e.g., glCreateProgram)
+            if name:
+                objectDict[name] = call.no
             # TODO: Keep track of call stack backtrace too
 
-    def handleDelete(self, call, objectDict):
-        n, names = call.argValues()
-        for i in range(n):
-            name = names[i]
+    def handleDelete(self, call, objectDict, argIndex, rangeIndex):
+        for name in self.objectNames(call, argIndex, rangeIndex):
             try:
                 del objectDict[name]
             except KeyError:
@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+##########################################################################
+#
+# Copyright 2026 Jose Fonseca
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the 'Software'), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+##########################################################################/
+
+'''Estimate the GPU memory footprint of a trace over time.
+
+Builds on the object tracking of leaks.py, and estimates the bytes behind
+buffers, textures, and renderbuffers from the calls which define their storage.
+Writes, for every frame, the number of live objects and the estimated bytes of
+every kind, plus the number of objects created and deleted in that frame.
+
+The estimates ignore driver padding, alignment, and compression, and assume
+a single share group.
+'''
+
+
+import csv
+import json
+import optparse
+import os.path
+import sys
+
+import unpickle
+from leaks import LeakDetector
+
+
+# Bytes per pixel of internal formats
+formatSizes = {
+    'GL_ALPHA': 1,
+    'GL_ALPHA8': 1,
+    'GL_LUMINANCE': 1,
+    'GL_LUMINANCE8': 1,
+    'GL_LUMINANCE_ALPHA': 2,
+    'GL_LUMINANCE8_ALPHA8': 2,
+    'GL_INTENSITY': 1,
+    'GL_INTENSITY8': 1,
+    'GL_RED': 1,
+    'GL_R8': 1,
+    'GL_R8I': 1,
+    'GL_R8UI': 1,
+    'GL_R8_SNORM': 1,
+    'GL_R16': 2,
+    'GL_R16F': 2,
+    'GL_R16I': 2,
+    'GL_R16UI': 2,
+    'GL_R32F': 4,
+    'GL_R32I': 4,
+    'GL_R32UI': 4,
+    'GL_RG': 2,
+    'GL_RG8': 2,
+    'GL_RG8I': 2,
+    'GL_RG8UI': 2,
+    'GL_RG8_SNORM': 2,
+    'GL_RG16': 4,
+    'GL_RG16F': 4,
+    'GL_RG16I': 4,
+    'GL_RG16UI': 4,
+    'GL_RG32F': 8,
+    'GL_RG32I': 8,
+    'GL_RG32UI': 8,
+    'GL_RGB': 3,
+    'GL_RGB8': 3,
+    'GL_RGB8I': 3,
+    'GL_RGB8UI': 3,
+    'GL_SRGB': 3,
+    'GL_SRGB8': 3,
+    'GL_RGB565': 2,
+    'GL_RGB5_A1': 2,
+    'GL_RGBA4': 2,
+    'GL_RGB10_A2': 4,
+    'GL_RGB10_A2UI': 4,
+    'GL_R11F_G11F_B10F': 4,
+    'GL_RGB9_E5': 4,
+    'GL_RGB16': 6,
+    'GL_RGB16F': 6,
+    'GL_RGB16I': 6,
+    'GL_RGB16UI': 6,
+    'GL_RGB32F': 12,
+    'GL_RGB32I': 12,
+    'GL_RGB32UI': 12,
+    'GL_RGBA': 4,
+    'GL_BGRA': 4,
+    'GL_RGBA8': 4,
+    'GL_RGBA8I': 4,
+    'GL_RGBA8UI': 4,
+    'GL_RGBA8_SNORM': 4,
+    'GL_SRGB_ALPHA': 4,
+    'GL_SRGB8_ALPHA8': 4,
+    'GL_RGBA16': 8,
+    'GL_RGBA16F': 8,
+    'GL_RGBA16I': 8,
+    'GL_RGBA16UI': 8,
+    'GL_RGBA32F': 16,
+    'GL_RGBA32I': 16,
+    'GL_RGBA32UI': 16,
+    'GL_DEPTH_COMPONENT': 4,
+    'GL_DEPTH_COMPONENT16': 2,
+    'GL_DEPTH_COMPONENT24': 4,
+    'GL_DEPTH_COMPONENT32': 4,
+    'GL_DEPTH_COMPONENT32F': 4,
+    'GL_DEPTH_STENCIL': 4,
+    'GL_DEPTH24_STENCIL8': 4,
+    'GL_DEPTH32F_STENCIL8': 8,
+    'GL_STENCIL_INDEX8': 1,
+}
+
+# Bytes per pixel of compressed internal formats, for glTexStorage*
+compressedFormatSizes = {
+    'GL_COMPRESSED_RGB_S3TC_DXT1_EXT': 0.5,
+    'GL_COMPRESSED_RGBA_S3TC_DXT1_EXT': 0.5,
+    'GL_COMPRESSED_SRGB_S3TC_DXT1_EXT': 0.5,
+    'GL_COMPRESSED_SRGB_ALPHA_S3TC_DXT1_EXT': 0.5,
+    'GL_COMPRESSED_RED_RGTC1': 0.5,
+    'GL_COMPRESSED_SIGNED_RED_RGTC1': 0.5,
+    'GL_COMPRESSED_RGB8_ETC2': 0.5,
+    'GL_COMPRESSED_SRGB8_ETC2': 0.5,
+    'GL_COMPRESSED_R11_EAC': 0.5,
+    'GL_COMPRESSED_SIGNED_R11_EAC': 0.5,
+    'GL_ETC1_RGB8_OES': 0.5,
+}
+
+defaultFormatSize = 4
+
+
+def formatSize(internalformat):
+    '''Estimated bytes per pixel of an internal format.'''
+
+    if isinstance(internalformat, int):
+        # Legacy number of components
+        if 1 <= internalformat <= 4:
+            return internalformat
+        return defaultFormatSize
+    try:
+        return formatSizes[internalformat]
+    except KeyError:
+        pass
+    try:
+        return compressedFormatSizes[internalformat]
+    except KeyError:
+        pass
+    if internalformat.startswith('GL_COMPRESSED_'):
+        # Most other block formats are 128 bits per 4x4 block
+        return 1
+    return defaultFormatSize
+
+
+# Binding points of cube map faces
+cubeMapFaces = {
+    'GL_TEXTURE_CUBE_MAP_POSITIVE_X': 'GL_TEXTURE_CUBE_MAP',
+    'GL_TEXTURE_CUBE_MAP_NEGATIVE_X': 'GL_TEXTURE_CUBE_MAP',
+    'GL_TEXTURE_CUBE_MAP_POSITIVE_Y': 'GL_TEXTURE_CUBE_MAP',
+    'GL_TEXTURE_CUBE_MAP_NEGATIVE_Y': 'GL_TEXTURE_CUBE_MAP',
+    'GL_TEXTURE_CUBE_MAP_POSITIVE_Z': 'GL_TEXTURE_CUBE_MAP',
+    'GL_TEXTURE_CUBE_MAP_NEGATIVE_Z': 'GL_TEXTURE_CUBE_MAP',
+}
+
+
+def mipmapPixels(levels, width, height, depth, target):
+    '''Number of pixels of a full texture storage, across all levels.'''
+
+    # Only 3D textures have their depth halved at every level
+    halveDepth = target in ('GL_TEXTURE_3D', 'GL_PROXY_TEXTURE_3D')
+    faces = 1
+    if target in ('GL_TEXTURE_CUBE_MAP', 'GL_TEXTURE_CUBE_MAP_ARB'):
+        faces = 6
+    pixels = 0
+    for level in range(levels):
+        pixels += max(width >> level, 1) * max(height >> level, 1) * (max(depth >> level, 1) if halveDepth else depth)
+    return pixels * faces
+
+
+class MemoryTimeline(LeakDetector):
+
+    # Kinds whose storage is estimated
+    storageKinds = ('buffer', 'texture', 'renderbuffer')
+
+    def __init__(self, apitrace, trace, reportLeaks = False):
+        LeakDetector.__init__(self, apitrace, trace)
+        self.reportLeaks = reportLeaks
+
+        # kind -> name -> key -> bytes, where key identifies texture images
+        self.objectBytes = {}
+        self.liveBytes = dict.fromkeys(self.storageKinds, 0)
+
+        self.activeTexture = 'GL_TEXTURE0'
+        self.textureBindings = {}
+        self.bufferBindings = {}
+        self.renderbufferBinding = 0
+
+        self.frameNo = 0
+        self.created = 0
+        self.deleted = 0
+        self.lastCallNo = None
+        self.rows = []
+
+        for functionName, handler in [
+            ('glActiveTexture', self.handleActiveTexture),
+            ('glActiveTextureARB', self.handleActiveTexture),
+            ('glBindTexture', self.handleBindTexture),
+            ('glBindTextureEXT', self.handleBindTexture),
+            ('glBindBuffer', self.handleBindBuffer),
+            ('glBindBufferARB', self.handleBindBuffer),
+            ('glBindRenderbuffer', self.handleBindRenderbuffer),
+            ('glBindRenderbufferEXT', self.handleBindRenderbuffer),
+            ('glBufferData', self.handleBufferData),
+            ('glBufferDataARB', self.handleBufferData),
+            ('glBufferStorage', self.handleBufferData),
+            ('glNamedBufferData', self.handleNamedBufferData),
+            ('glNamedBufferStorage', self.handleNamedBufferData),
+            ('glTexImage1D', self.handleTexImage),
+            ('glTexImage2D', self.handleTexImage),
+            ('glTexImage3D', self.handleTexImage),
+            ('glTexImage2DMultisample', self.handleTexImageMultisample),
+            ('glTexImage3DMultisample', self.handleTexImageMultisample),
+            ('glCompressedTexImage1D', self.handleCompressedTexImage),
+            ('glCompressedTexImage2D', self.handleCompressedTexImage),
+            ('glCompressedTexImage3D', self.handleCompressedTexImage),
+            ('glTexStorage1D', self.handleTexStorage),
+            ('glTexStorage2D', self.handleTexStorage),
+            ('glTexStorage3D', self.handleTexStorage),
+            ('glTextureStorage1D', self.handleTextureStorage),
+            ('glTextureStorage2D', self.handleTextureStorage),
+            ('glTextureStorage3D', self.handleTextureStorage),
+            ('glRenderbufferStorage', self.handleRenderbufferStorage),
+            ('glRenderbufferStorageEXT', self.handleRenderbufferStorage),
+            ('glRenderbufferStorageMultisample', self.handleRenderbufferStorage),
+            ('glRenderbufferStorageMultisampleEXT', self.handleRenderbufferStorage),
+            ('glNamedRenderbufferStorage', self.handleNamedRenderbufferStorage),
+            ('glNamedRenderbufferStorageMultisample', self.handleNamedRenderbufferStorage),
+        ]:
+            self.dispatchTable[functionName] = handler, ()
+
+    def handleCall(self, call):
+        LeakDetector.handleCall(self, call)
+        self.lastCallNo = call.no
+        if call.flags & unpickle.CALL_FLAG_END_FRAME:
+            self.addRow(call.no)
+
+    def parse(self):
+        unpickle.Unpickler.parse(self)
+
+        # Calls after the last frame
+        if self.lastCallNo is not None and (not self.rows or self.rows[-1]['call'] != self.lastCallNo):
+            self.addRow(self.lastCallNo)
+
+        self.dumpLeaks("<EOF>")
+
+    def addRow(self, callNo):
+        row = {
+            'frame': self.frameNo,
+            'call': callNo,
+            'created': self.created,
+            'deleted': self.deleted,
+        }
+        for kind, objectDict in self.objectDicts.items():
+            row[kind] = len(objectDict)
+        total = 0
+        for kind in self.storageKinds:
+            row[kind + '_bytes'] = self.liveBytes[kind]
+            total += self.liveBytes[kind]
+        row['total_bytes'] = total
+        self.rows.append(row)
+
+        self.frameNo += 1
+        self.created = 0
+        self.deleted = 0
+
+    def handleGenerate(self, call, objectDict, argIndex, rangeIndex):
+        for name in self.objectNames(call, argIndex, rangeIndex):
+            if name and name not in objectDict:
+                self.created += 1
+        LeakDetector.handleGenerate(self, call, objectDict, argIndex, rangeIndex)
+
+    def handleDelete(self, call, objectDict, argIndex, rangeIndex):
+        for kind, kindDict in self.objectDicts.items():
+            if kindDict is objectDict:
+                break
+        for name in self.objectNames(call, argIndex, rangeIndex):
+            if name in objectDict:
+                self.deleted += 1
+            self.freeBytes(kind, name)
+        LeakDetector.handleDelete(self, call, objectDict, argIndex, rangeIndex)
+
+    def dumpLeaks(self, currentCallNo):
+        if self.reportLeaks:
+            LeakDetector.dumpLeaks(self, currentCallNo)
+        else:
+            for objectDict in self.objectDicts.values():
+                objectDict.clear()
+
+        # Objects are gone with their context
+        self.objectBytes.clear()
+        for kind in self.storageKinds:
+            self.liveBytes[kind] = 0
+
+    def setBytes(self, kind, name, key, size):
+        if not name:
+            return
+        size = int(size)
+        images = self.objectBytes.setdefault(kind, {}).setdefault(name, {})
+        self.liveBytes[kind] += size - images.get(key, 0)
+        images[key] = size
+
+    def freeBytes(self, kind, name):
+        try:
+            images = self.objectBytes[kind].pop(name)
+        except KeyError:
+            return
+        self.liveBytes[kind] -= sum(images.values())
+
+    def handleActiveTexture(self, call):
+        self.activeTexture = call.arg('texture')
+
+    def handleBindTexture(self, call):
+        self.textureBindings[self.activeTexture, call.arg('target')] = call.arg('texture')
+
+    def boundTexture(self, target):
+        target = cubeMapFaces.get(target, target)
+        return self.textureBindings.get((self.activeTexture, target), 0)
+
+    def handleBindBuffer(self, call):
+        self.bufferBindings[call.arg('target')] = call.arg('buffer')
+
+    def handleBindRenderbuffer(self, call):
+        self.renderbufferBinding = call.arg('renderbuffer')
+
+    def handleBufferData(self, call):
+        buffer = self.bufferBindings.get(call.arg('target'), 0)
+        self.setBytes('buffer', buffer, None, call.arg('size'))
+
+    def handleNamedBufferData(self, call):
+        self.setBytes('buffer', call.arg('buffer'), None, call.arg('size'))
+
+    def textureImageSize(self, call, internalformat):
+        width = call.arg('width')
+        try:
+            height = call.arg('height')
+        except NameError:
+            height = 1
+        try:
+            depth = call.arg('depth')
+        except NameError:
+            depth = 1
+        return width * height * depth * formatSize(internalformat)
+
+    def handleTexImage(self, call):
+        target = call.arg('target')
+        if target.startswith('GL_PROXY_'):
+            return
+        texture = self.boundTexture(target)
+        size = self.textureImageSize(call, call.arg('internalformat'))
+        self.setBytes('texture', texture, (target, call.arg('level')), size)
+
+    def handleTexImageMultisample(self, call):
+        target = call.arg('target')
+        if target.startswith('GL_PROXY_'):
+            return
+        texture = self.boundTexture(target)
+        size = self.textureImageSize(call, call.arg('internalformat')) * call.arg('samples')
+        self.setBytes('texture', texture, (target, 0), size)
+
+    def handleCompressedTexImage(self, call):
+        target = call.arg('target')
+        if target.startswith('GL_PROXY_'):
+            return
+        texture = self.boundTexture(target)
+        self.setBytes('texture', texture, (target, call.arg('level')), call.arg('imageSize'))
+
+    def textureStorageSize(self, call, target):
+        width = call.arg('width')
+        try:
+            height = call.arg('height')
+        except NameError:
+            height = 1
+        try:
+            depth = call.arg('depth')
+        except NameError:
+            depth = 1
+        pixels = mipmapPixels(call.arg('levels'), width, height, depth, target)
+        return pixels * formatSize(call.arg('internalformat'))
+
+    def handleTexStorage(self, call):
+        target = call.arg('target')
+        if target.startswith('GL_PROXY_'):
+            return
+        texture = self.boundTexture(target)
+        # Storage replaces any images previously defined
+        self.freeBytes('texture', texture)
+        self.setBytes('texture', texture, None, self.textureStorageSize(call, target))
+
+    def handleTextureStorage(self, call):
+        texture = call.arg('texture')
+        self.freeBytes('texture', texture)
+        # The target is not known, so cube maps and 3D textures are
+        # estimated as 2D arrays
+        self.setBytes('texture', texture, None, self.textureStorageSize(call, None))
+
+    def renderbufferStorageSize(self, call):
+        try:
+            samples = max(call.arg('samples'), 1)
+        except NameError:
+            samples = 1
+        return call.arg('width') * call.arg('height') * samples * formatSize(call.arg('internalformat'))
+
+    def handleRenderbufferStorage(self, call):
+        self.setBytes('renderbuffer', self.renderbufferBinding, None, self.renderbufferStorageSize(call))
+
+    def handleNamedRenderbufferStorage(self, call):
+        self.setBytes('renderbuffer', call.arg('renderbuffer'), None, self.renderbufferStorageSize(call))
+
+
+def writeTimeline(rows, stream, format):
+    # Columns of all object kinds that were ever live
+    fieldnames = ['frame', 'call', 'created', 'deleted']
+    kinds = set()
+    for row in rows:
+        for name, value in row.items():
+            if name not in fieldnames and not name.endswith('_bytes') and value:
+                kinds.add(name)
+    fieldnames += sorted(kinds)
+    fieldnames += [kind + '_bytes' for kind in MemoryTimeline.storageKinds]
+    fieldnames.append('total_bytes')
+
+    rows = [dict((name, row.get(name, 0)) for name in fieldnames) for row in rows]
+
+    if format == 'json':
+        json.dump(rows, stream, indent=2)
+        stream.write('\n')
+    else:
+        writer = csv.DictWriter(stream, fieldnames=fieldnames, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    '''Main program.
+    '''
+
+    # Parse command line options
+    optparser = optparse.OptionParser(
+        usage='\n\t%prog [options] TRACE',
+        version='%%prog')
+    optparser.add_option(
+        '-a', '--apitrace', metavar='PROGRAM',
+        type='string', dest='apitrace', default='apitrace',
+        help='apitrace command [default: %default]')
+    optparser.add_option(
+        '-o', '--output', metavar='FILE',
+        type='string', dest='output',
+        help='output file [default: stdout]')
+    optparser.add_option(
+        '--format', metavar='FORMAT',
+        type='choice', choices=('csv', 'json'), dest='format',
+        help='output format, csv or json [default: from the output file extension, or csv]')
+    optparser.add_option(
+        '--leaks',
+        action='store_true', dest='leaks', default=False,
+        help='also report leaked objects, as leaks.py does')
+
+    options, args = optparser.parse_args(sys.argv[1:])
+    if len(args) != 1:
+        optparser.error("incorrect number of arguments")
+
+    inTrace = args[0]
+    if not os.path.isfile(inTrace):
+        sys.stderr.write("error: `%s` does not exist\n" % inTrace)
+        sys.exit(1)
+
+    format = options.format
+    if format is None:
+        if options.output is not None and options.output.endswith('.json'):
+            format = 'json'
+        else:
+            format = 'csv'
+
+    timeline = MemoryTimeline(options.apitrace, inTrace, options.leaks)
+    timeline.parse()
+
+    if options.output:
+        output = open(options.output, 'wt')
+    else:
+        output = sys.stdout
+    writeTimeline(timeline.rows, output, format)
+
+    # Summarize the high-water mark
+    if timeline.rows:
+        peak = max(timeline.rows, key=lambda row: row['total_bytes'])
+        sys.stderr.write('peak: %u bytes at frame %u (call %u)\n' % (peak['total_bytes'], peak['frame'], peak['call']))
+
+
+if __name__ == '__main__':
+    main()
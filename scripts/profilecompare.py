@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+##########################################################################
+#
+# Copyright 2026 Jose Fonseca
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the 'Software'), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+##########################################################################/
+
+'''Compare several profile runs of a baseline against several of a candidate.
+
+Every run is reduced to the total of a field (e.g., gpu_dura) per group of
+calls (e.g., per program), so that every group gets one sample per run.  For
+every group, the candidate samples are compared against the baseline ones
+with a Mann-Whitney U test, and the relative change of the mean gets a
+bootstrap confidence interval.  P-values are adjusted for the number of groups
+compared (Benjamini-Hochberg), so that comparing thousands of groups doesn't
+yield spurious regressions.
+
+A group is a regression when its adjusted p-value is below the significance
+level, and its whole confidence interval is above the minimum change.  The
+exit code is 1 when there are regressions, so this can gate driver updates.
+'''
+
+
+import json
+import math
+import optparse
+import sys
+
+import numpy
+
+import profiledata
+
+
+def loadRuns(filenames, fields, value):
+    '''Per-run totals of every group.
+
+    Returns a list of {key: total} dictionaries, where key is a tuple of
+    labels.'''
+
+    runs = []
+    for filename in filenames:
+        profile = profiledata.loadFile(filename)
+        groups = profiledata.groupBy(profile, fields, value)
+        labels = [profile.labels(field, groups[field]) for field in fields]
+        totals = {}
+        for key, total in zip(zip(*labels) if fields else [()], groups['sum'].tolist()):
+            totals[key] = total
+        runs.append(totals)
+    return runs
+
+
+def alignRuns(baseRuns, candRuns):
+    '''Align groups across runs into G x N arrays.
+
+    Groups missing from a run count as zero.'''
+
+    keys = set()
+    for run in baseRuns + candRuns:
+        keys.update(run.keys())
+    keys = sorted(keys)
+
+    def samples(runs):
+        array = numpy.zeros((len(keys), len(runs)))
+        for j in range(len(runs)):
+            run = runs[j]
+            array[:, j] = [run.get(key, 0) for key in keys]
+        return array
+
+    return keys, samples(baseRuns), samples(candRuns)
+
+
+def _exactUDistribution(n, m):
+    # Number of arrangements of n and m samples for every U value
+    counts = numpy.zeros((n + 1, m + 1, n*m + 1), dtype=numpy.float64)
+    counts[0, :, 0] = 1
+    counts[:, 0, 0] = 1
+    for i in range(1, n + 1):
+        for j in range(1, m + 1):
+            counts[i, j] = counts[i, j - 1]
+            counts[i, j, j:] += counts[i - 1, j, :n*m + 1 - j]
+    distribution = counts[n, m]
+    return distribution / distribution.sum()
+
+
+# Largest n*m for which exact p-values are computed
+_exactLimit = 400
+
+
+def mannWhitney(a, b):
+    '''Two-sided Mann-Whitney U test of every row of a against every row of b.
+
+    Returns the p-values.  P-values are exact when there are no ties and few
+    samples, otherwise use the normal approximation with tie correction.'''
+
+    g, n = a.shape
+    m = b.shape[1]
+    if n == 0 or m == 0:
+        return numpy.ones(g)
+
+    greater = (a[:, :, numpy.newaxis] > b[:, numpy.newaxis, :]).sum(axis=(1, 2))
+    equal = (a[:, :, numpy.newaxis] == b[:, numpy.newaxis, :]).sum(axis=(1, 2))
+    u = greater + 0.5*equal
+
+    # Normal approximation, with tie and continuity corrections
+    combined = numpy.sort(numpy.concatenate((a, b), axis=1), axis=1)
+    total = n + m
+    boundaries = numpy.ones((g, total), dtype=bool)
+    boundaries[:, 1:] = combined[:, 1:] != combined[:, :-1]
+    # Runs of equal values never span rows, as every row starts a run
+    runs = numpy.cumsum(boundaries.ravel()) - 1
+    sizes = numpy.bincount(runs).astype(numpy.float64)
+    runRows = numpy.flatnonzero(boundaries.ravel()) // total
+    tieTerm = numpy.bincount(runRows, weights=sizes**3 - sizes, minlength=g)
+    hasTies = tieTerm > 0
+    mean = 0.5*n*m
+    variance = n*m/12.0*((total + 1) - tieTerm/(total*(total - 1))) if total > 1 else numpy.zeros(g)
+    deviation = numpy.maximum(numpy.abs(u - mean) - 0.5, 0)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        z = deviation/numpy.sqrt(variance)
+    z = numpy.where(variance > 0, z, 0.0)
+    erfc = numpy.vectorize(math.erfc, otypes=[numpy.float64])
+    pvalues = erfc(z/math.sqrt(2.0))
+
+    if n*m <= _exactLimit:
+        distribution = _exactUDistribution(n, m)
+        cdf = numpy.cumsum(distribution)
+        # U values are integers when there are no ties
+        uMin = numpy.minimum(u, n*m - u).astype(numpy.int64)
+        exact = numpy.minimum(2.0*cdf[uMin], 1.0)
+        pvalues = numpy.where(hasTies, pvalues, exact)
+
+    return numpy.minimum(pvalues, 1.0)
+
+
+def adjustPValues(pvalues):
+    '''Benjamini-Hochberg adjusted p-values.'''
+
+    g = len(pvalues)
+    if g == 0:
+        return pvalues
+    order = numpy.argsort(pvalues)
+    adjusted = pvalues[order]*g/numpy.arange(1, g + 1)
+    adjusted = numpy.minimum.accumulate(adjusted[::-1])[::-1]
+    result = numpy.empty(g)
+    result[order] = numpy.minimum(adjusted, 1.0)
+    return result
+
+
+def bootstrapInterval(a, b, confidence=0.95, resamples=1000, seed=0, chunkSize=1024):
+    '''Bootstrap confidence interval of the relative change of the mean, per
+    row.
+
+    Returns (lower, upper) arrays.  Rows with a zero baseline get NaNs.'''
+
+    g, n = a.shape
+    m = b.shape[1]
+    rng = numpy.random.default_rng(seed)
+    aIndices = rng.integers(0, n, size=(resamples, n))
+    bIndices = rng.integers(0, m, size=(resamples, m))
+    tail = (1.0 - confidence)*50.0
+
+    lower = numpy.empty(g)
+    upper = numpy.empty(g)
+    for start in range(0, g, chunkSize):
+        stop = min(start + chunkSize, g)
+        aMeans = a[start:stop][:, aIndices].mean(axis=2)
+        bMeans = b[start:stop][:, bIndices].mean(axis=2)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            deltas = bMeans/aMeans - 1.0
+        deltas[~numpy.isfinite(deltas)] = numpy.nan
+        lower[start:stop], upper[start:stop] = numpy.percentile(deltas, [tail, 100.0 - tail], axis=1)
+    return lower, upper
+
+
+def compare(base, cand, options):
+    '''Compare aligned G x N sample arrays.
+
+    Returns a dictionary of columns, with one element per group.'''
+
+    baseMean = base.mean(axis=1)
+    candMean = cand.mean(axis=1)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        delta = numpy.where(baseMean > 0, candMean/baseMean - 1.0, numpy.nan)
+
+    pvalues = mannWhitney(base, cand)
+    adjusted = adjustPValues(pvalues) if options.adjust else pvalues
+    lower, upper = bootstrapInterval(base, cand, options.confidence, options.resamples)
+
+    significant = adjusted < options.alpha
+    regression = significant & (lower > options.min_delta)
+    improvement = significant & (upper < -options.min_delta)
+
+    return {
+        'base': baseMean,
+        'cand': candMean,
+        'delta': delta,
+        'lower': lower,
+        'upper': upper,
+        'p': adjusted,
+        'regression': regression,
+        'improvement': improvement,
+    }
+
+
+def _percent(value):
+    if math.isnan(value):
+        return 'n/a'
+    return '%+.1f%%' % (value*100.0)
+
+
+def render(keys, fields, result, showAll, limit):
+    # Sort by decreasing absolute change of the mean
+    impact = numpy.abs(result['cand'] - result['base'])
+    order = (-impact).argsort(kind='stable')
+    if not showAll:
+        order = [i for i in order if result['regression'][i] or result['improvement'][i]]
+    if limit:
+        order = order[:limit]
+
+    titles = [field for field in fields] + ['Base', 'Cand', 'Delta', 'CI', 'p', '']
+    rows = []
+    for i in order:
+        if result['regression'][i]:
+            verdict = 'REGRESSION'
+        elif result['improvement'][i]:
+            verdict = 'improvement'
+        else:
+            verdict = ''
+        rows.append(list(keys[i]) + [
+            '%.0f' % result['base'][i],
+            '%.0f' % result['cand'][i],
+            _percent(result['delta'][i]),
+            '[%s, %s]' % (_percent(result['lower'][i]), _percent(result['upper'][i])),
+            '%.3g' % result['p'][i],
+            verdict,
+        ])
+
+    widths = [max([len(title)] + [len(row[i]) for row in rows]) for i, title in enumerate(titles)]
+    sys.stdout.write('  '.join([title.rjust(width) for title, width in zip(titles, widths)]).rstrip() + '\n')
+    for row in rows:
+        sys.stdout.write('  '.join([cell.rjust(width) for cell, width in zip(row, widths)]).rstrip() + '\n')
+
+
+def main():
+    '''Main program.
+    '''
+
+    # Parse command line options
+    optparser = optparse.OptionParser(
+        usage='\n\t%prog [options] -b BASELINE_PROFILE ... -c CANDIDATE_PROFILE ...',
+        version='%%prog')
+    optparser.add_option(
+        '-b', '--baseline', metavar='PROFILE',
+        type='string', action='append', dest='baseline', default=[],
+        help='add a profile run of the baseline')
+    optparser.add_option(
+        '-c', '--candidate', metavar='PROFILE',
+        type='string', action='append', dest='candidate', default=[],
+        help='add a profile run of the candidate')
+    optparser.add_option(
+        '-g', '--group', metavar='FIELD[,FIELD...]',
+        type='string', dest='group', default='program',
+        help='group by the specified fields, such as program, name, frame, or no [default: %default]')
+    optparser.add_option(
+        '-v', '--value', metavar='FIELD',
+        type='string', dest='value', default='gpu_dura',
+        help='field to compare [default: %default]')
+    optparser.add_option(
+        '--alpha', metavar='P',
+        type='float', dest='alpha', default=0.05,
+        help='significance level [default: %default]')
+    optparser.add_option(
+        '--no-adjust',
+        action='store_false', dest='adjust', default=True,
+        help='don\'t adjust p-values for the number of groups')
+    optparser.add_option(
+        '--min-delta', metavar='FRACTION',
+        type='float', dest='min_delta', default=0.02,
+        help='minimum relative change of the mean to report [default: %default]')
+    optparser.add_option(
+        '--confidence', metavar='FRACTION',
+        type='float', dest='confidence', default=0.95,
+        help='confidence level of the intervals [default: %default]')
+    optparser.add_option(
+        '--resamples', metavar='N',
+        type='int', dest='resamples', default=1000,
+        help='number of bootstrap resamples [default: %default]')
+    optparser.add_option(
+        '-a', '--all',
+        action='store_true', dest='all', default=False,
+        help='show all groups, not only significant changes')
+    optparser.add_option(
+        '-n', '--limit', metavar='N',
+        type='int', dest='limit', default=0,
+        help='show at most N groups')
+    optparser.add_option(
+        '--json', metavar='FILE',
+        type='string', dest='json',
+        help='also write the comparison of all groups to FILE')
+
+    (options, args) = optparser.parse_args(sys.argv[1:])
+    if args:
+        optparser.error('unexpected arguments')
+    if not options.baseline or not options.candidate:
+        optparser.error('both baseline and candidate profiles are required')
+    if not 0 < options.confidence < 1:
+        optparser.error('invalid confidence level %r' % options.confidence)
+
+    fields = [field for field in options.group.split(',') if field]
+
+    try:
+        baseRuns = loadRuns(options.baseline, fields, options.value)
+        candRuns = loadRuns(options.candidate, fields, options.value)
+    except ValueError as ex:
+        sys.stderr.write('error: %s\n' % ex)
+        sys.exit(1)
+
+    if min(len(baseRuns), len(candRuns)) < 5:
+        sys.stderr.write('warning: with fewer than 5 runs per side, few changes can be significant\n')
+
+    keys, base, cand = alignRuns(baseRuns, candRuns)
+
+    # Overall totals
+    overall = compare(base.sum(axis=0, keepdims=True), cand.sum(axis=0, keepdims=True), options)
+    sys.stdout.write('total: %.0f -> %.0f (%s, CI [%s, %s], p=%.3g)\n\n' % (
+        overall['base'][0], overall['cand'][0],
+        _percent(overall['delta'][0]), _percent(overall['lower'][0]), _percent(overall['upper'][0]),
+        overall['p'][0]))
+
+    result = compare(base, cand, options)
+    render(keys, fields, result, options.all, options.limit)
+
+    numRegressions = int(result['regression'].sum())
+    numImprovements = int(result['improvement'].sum())
+    sys.stdout.write('\n%u groups, %u regressions, %u improvements\n' % (len(keys), numRegressions, numImprovements))
+
+    if options.json:
+        groups = []
+        for i in range(len(keys)):
+            group = dict(zip(fields, keys[i]))
+            for name, column in result.items():
+                value = column[i].item()
+                if isinstance(value, float) and math.isnan(value):
+                    value = None
+                group[name] = value
+            groups.append(group)
+        stream = open(options.json, 'wt')
+        json.dump({'fields': fields, 'value': options.value, 'groups': groups}, stream, indent=2)
+        stream.close()
+
+    if numRegressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,398 @@
+##########################################################################
+#
+# Copyright 2026 Jose Fonseca
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+##########################################################################/
+
+
+'''Columnar loading and aggregation of glretrace profiles.
+
+Reads the output of `glretrace --pgpu/--pcpu/--ppd/--pmem` into one numpy
+array per field, with one element per call, plus a `frame` column with the
+number of the frame every call belongs to.  Function names are stored as
+integer codes into `Profile.names`.
+
+Both the text format and the binary format (`--profile-format=binary`) are
+read.  Binary profile files are memory mapped, so that loading them is
+immediate regardless of their size.
+'''
+
+
+import mmap
+
+import numpy
+
+
+# Statistics computed for every group
+statNames = ('count', 'sum', 'mean', 'p50', 'p95', 'p99', 'max')
+
+_percentiles = {
+    'p50': 50.0,
+    'p95': 95.0,
+    'p99': 99.0,
+}
+
+# Bytes read at a time
+_blockSize = 16*1024*1024
+
+
+# Binary format, as described in trace_profiler.hpp
+_binaryMagic = b'APITPROF'
+_binaryFooterMagic = b'APITPEND'
+_binaryVersion = 2
+
+_headerDtype = numpy.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('record_size', '<u4'),
+    ('fields', '<u4'),
+    ('reserved', '<u4'),
+])
+
+_footerDtype = numpy.dtype([
+    ('magic', 'S8'),
+    ('frame_ends_offset', '<u8'),
+    ('rendering_finished_offset', '<u8'),
+    ('string_table_offset', '<u8'),
+])
+
+# Fields every record starts with
+_recordFields = [
+    ('no', '<u4'),
+    ('program', '<u4'),
+    ('name', '<u4'),
+    ('frame', '<u4'),
+]
+
+# Optional fields, by header mask bit, in record order
+_optionalFields = [
+    (1 << 0, ['gpu_start', 'gpu_dura']),
+    (1 << 1, ['cpu_start', 'cpu_dura']),
+    (1 << 2, ['pixels']),
+    (1 << 3, ['vsize_start', 'vsize_dura', 'rss_start', 'rss_dura']),
+]
+
+# Columns of binary profiles, in the same order as text profiles
+_binaryColumns = ['no', 'gpu_start', 'gpu_dura', 'cpu_start', 'cpu_dura', 'vsize_start', 'vsize_dura', 'rss_start', 'rss_dura', 'pixels', 'program']
+
+
+class Profile:
+    '''Columns of a profile.'''
+
+    def __init__(self, columns, names, numFrames, renderingFinished=None):
+        # field -> numpy array
+        self.columns = columns
+
+        # function names, indexed by the name column
+        self.names = names
+
+        # number of complete frames
+        self.numFrames = numFrames
+
+        # times at which every frame finished rendering, when profiling
+        # with --pframe-times
+        if renderingFinished is None:
+            renderingFinished = numpy.zeros(0, dtype=numpy.int64)
+        self.renderingFinished = renderingFinished
+
+    def __len__(self):
+        return len(self.columns['no'])
+
+    def fields(self):
+        return list(self.columns.keys())
+
+    def labels(self, field, values):
+        '''Printable labels of values of a column.'''
+
+        if field == 'name':
+            return [self.names[value] for value in values]
+        return [str(value) for value in values]
+
+
+def _parseHeader(header):
+    header = header.decode()
+    if not header.startswith('#'):
+        raise ValueError('not a profile: missing header')
+    fields = header.split()[1:]
+    if fields[:1] != ['call'] or fields[-1:] != ['name']:
+        raise ValueError('unexpected profile header %r' % header.rstrip())
+    return fields[1:-1]
+
+
+def _blocks(stream):
+    # Blocks of whole lines
+    while True:
+        block = stream.read(_blockSize)
+        if not block:
+            return
+        if not block.endswith(b'\n'):
+            block += stream.readline()
+        yield block
+
+
+def _peek(stream, size):
+    if stream.seekable():
+        position = stream.tell()
+        data = stream.read(size)
+        stream.seek(position)
+        return data
+    return stream.peek(size)[:size]
+
+
+def _recordDtype(recordSize, fields, byteorder):
+    # Records may grow new fields at the end
+    names = [name for name, format in _recordFields]
+    formats = [format for name, format in _recordFields]
+    for mask, optionalNames in _optionalFields:
+        if fields & mask:
+            names += optionalNames
+            formats += ['<i8']*len(optionalNames)
+    dtype = numpy.dtype({
+        'names': names,
+        'formats': formats,
+        'itemsize': recordSize,
+    }, align=True)
+    return dtype.newbyteorder(byteorder)
+
+
+def loadBinary(buffer):
+    '''Load a binary profile from a buffer, without copying the records.
+
+    Fields which were not profiled are all zeros.'''
+
+    size = len(buffer)
+    if size < _headerDtype.itemsize:
+        raise ValueError('truncated binary profile')
+    header = numpy.frombuffer(buffer, dtype=_headerDtype, count=1)[0]
+    if header['magic'] != _binaryMagic:
+        raise ValueError('not a binary profile')
+
+    # Profiles are written in the byte order of the retracing host
+    byteorder = '<'
+    if header['version'] != _binaryVersion:
+        byteorder = '>'
+        header = numpy.frombuffer(buffer, dtype=_headerDtype.newbyteorder(byteorder), count=1)[0]
+        if header['version'] != _binaryVersion:
+            raise ValueError('unsupported binary profile version')
+    recordSize = int(header['record_size'])
+    dtype = _recordDtype(recordSize, int(header['fields']), byteorder)
+    headerSize = _headerDtype.itemsize
+
+    footerSize = _footerDtype.itemsize
+    if size >= headerSize + footerSize and bytes(buffer[size - footerSize:size - footerSize + 8]) == _binaryFooterMagic:
+        footer = numpy.frombuffer(buffer, dtype=_footerDtype.newbyteorder(byteorder), count=1, offset=size - footerSize)[0]
+        recordsEnd = int(footer['frame_ends_offset'])
+        renderingFinishedOffset = int(footer['rendering_finished_offset'])
+        stringTableOffset = int(footer['string_table_offset'])
+        # Anything else written to the same stream (e.g., retrace messages)
+        # shifts the trailer away from the offsets in the footer
+        if not (headerSize <= recordsEnd <= renderingFinishedOffset <= stringTableOffset <= size - footerSize) or \
+           (recordsEnd - headerSize) % recordSize or \
+           (renderingFinishedOffset - recordsEnd) % 8 or \
+           (stringTableOffset - renderingFinishedOffset) % 8:
+            raise ValueError('corrupted binary profile')
+        frameEnds = numpy.frombuffer(buffer, dtype=numpy.dtype('<u8').newbyteorder(byteorder),
+                                     count=(renderingFinishedOffset - recordsEnd) // 8,
+                                     offset=recordsEnd)
+        if numpy.any(frameEnds[1:] < frameEnds[:-1]) or \
+           (len(frameEnds) and frameEnds[-1] > (recordsEnd - headerSize) // recordSize):
+            raise ValueError('corrupted binary profile')
+        numFrames = len(frameEnds)
+        renderingFinished = numpy.frombuffer(buffer, dtype=numpy.dtype('<i8').newbyteorder(byteorder),
+                                             count=(stringTableOffset - renderingFinishedOffset) // 8,
+                                             offset=renderingFinishedOffset)
+        names = [name.decode() for name in bytes(buffer[stringTableOffset:size - footerSize]).split(b'\0')[:-1]]
+    else:
+        # Truncated profile: use all complete records, and count the frames
+        # which calls were seen after
+        recordsEnd = headerSize + (size - headerSize) // recordSize * recordSize
+        numFrames = None
+        renderingFinished = None
+        names = None
+
+    calls = numpy.frombuffer(buffer, dtype=dtype, count=(recordsEnd - headerSize) // recordSize, offset=headerSize)
+
+    columns = {}
+    for field in _binaryColumns:
+        if field in dtype.names:
+            columns[field] = calls[field]
+        else:
+            columns[field] = numpy.zeros(len(calls), dtype=numpy.int64)
+    columns['name'] = calls['name']
+    columns['frame'] = calls['frame']
+
+    if numFrames is None:
+        numFrames = int(calls['frame'][-1]) if len(calls) else 0
+
+    if names is None:
+        numNames = int(calls['name'].max()) + 1 if len(calls) else 0
+        names = ['#%u' % i for i in range(numNames)]
+
+    return Profile(columns, names, numFrames, renderingFinished)
+
+
+def loadFile(filename):
+    '''Load a text or binary profile file.'''
+
+    stream = open(filename, 'rb')
+    if stream.read(len(_binaryMagic)) != _binaryMagic:
+        stream.seek(0)
+        return load(stream)
+    try:
+        buffer = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):
+        stream.seek(0)
+        buffer = stream.read()
+    stream.close()
+    return loadBinary(buffer)
+
+
+def load(stream):
+    '''Load a profile from a binary stream.'''
+
+    if _peek(stream, len(_binaryMagic)) == _binaryMagic:
+        return loadBinary(stream.read())
+
+    header = stream.readline()
+    while header.startswith(b'#') and not header.startswith(b'# call'):
+        header = stream.readline()
+    numericFields = _parseHeader(header)
+    numNumericFields = len(numericFields)
+
+    numbers = []
+    names = []
+    codes = []
+    frames = []
+    renderingFinished = []
+    nameCodes = {}
+    frameNo = 0
+
+    for block in _blocks(stream):
+        block = block.replace(b'\r\n', b'\n')
+
+        # Every frame_end line splits the block into frames
+        pieces = (b'\n' + block).split(b'\nframe_end\n')
+        for i in range(len(pieces)):
+            if i:
+                frameNo += 1
+            if b'rendering_finished ' in pieces[i]:
+                renderingFinished += [int(line.split()[1]) for line in pieces[i].split(b'\n') if line.startswith(b'rendering_finished ')]
+            lines = [line.rpartition(b' ') for line in pieces[i].split(b'\n') if line.startswith(b'call ')]
+            if not lines:
+                continue
+
+            values = numpy.fromstring(b' '.join([line[0][5:] for line in lines]), dtype=numpy.int64, sep=' ')
+            if len(values) != len(lines)*numNumericFields:
+                raise ValueError('malformed profile call lines in frame %u' % frameNo)
+            numbers.append(values.reshape(len(lines), numNumericFields))
+
+            for line in lines:
+                name = line[2]
+                if name not in nameCodes:
+                    nameCodes[name] = len(names)
+                    names.append(name.decode())
+            codes.append(numpy.fromiter((nameCodes[line[2]] for line in lines), dtype=numpy.int32, count=len(lines)))
+
+            frames.append(numpy.full(len(lines), frameNo, dtype=numpy.int32))
+
+    if numbers:
+        numbers = numpy.concatenate(numbers)
+        codes = numpy.concatenate(codes)
+        frames = numpy.concatenate(frames)
+    else:
+        numbers = numpy.zeros((0, numNumericFields), dtype=numpy.int64)
+        codes = numpy.zeros(0, dtype=numpy.int32)
+        frames = numpy.zeros(0, dtype=numpy.int32)
+
+    columns = {}
+    for i in range(numNumericFields):
+        columns[numericFields[i]] = numpy.ascontiguousarray(numbers[:, i])
+    columns['name'] = codes
+    columns['frame'] = frames
+
+    return Profile(columns, names, frameNo, numpy.array(renderingFinished, dtype=numpy.int64))
+
+
+def _groupKeys(profile, fields):
+    # Dense group number of every call, across all fields
+    key = numpy.zeros(len(profile), dtype=numpy.int64)
+    for field in fields:
+        uniques, inverse = numpy.unique(profile.columns[field], return_inverse=True)
+        key = key*len(uniques) + inverse.reshape(-1)
+        # Keep keys dense, so they never overflow
+        key = numpy.unique(key, return_inverse=True)[1].reshape(-1)
+    return key
+
+
+def groupBy(profile, fields, value='gpu_dura'):
+    '''Aggregate a column over the groups of calls with equal fields.
+
+    Returns a dictionary of columns, with one element per group: the group
+    fields, every statistic in statNames, and `longest`, the number of the
+    first call with the maximum value.'''
+
+    for field in list(fields) + [value]:
+        if field not in profile.columns:
+            raise ValueError('unknown profile field %r (expected one of %s)' % (field, ', '.join(profile.fields())))
+
+    n = len(profile)
+    result = {}
+    if n == 0:
+        for field in fields:
+            result[field] = profile.columns[field][:0]
+        for name in statNames:
+            result[name] = numpy.zeros(0)
+        result['longest'] = profile.columns['no'][:0]
+        return result
+
+    key = _groupKeys(profile, fields)
+    values = profile.columns[value]
+
+    # Sort by group, then value, then decreasing call order, so that the last
+    # element of every group is the first call with the maximum value
+    order = numpy.lexsort((numpy.arange(n)[::-1], values, key))
+    key = key[order]
+    sortedValues = values[order]
+
+    starts = numpy.flatnonzero(numpy.diff(key)) + 1
+    starts = numpy.concatenate(([0], starts))
+    counts = numpy.diff(numpy.append(starts, n))
+    lasts = starts + counts - 1
+
+    for field in fields:
+        result[field] = profile.columns[field][order[starts]]
+
+    sums = numpy.add.reduceat(sortedValues, starts)
+    result['count'] = counts
+    result['sum'] = sums
+    result['mean'] = sums / counts
+    for name, percentile in _percentiles.items():
+        # Linear interpolation, as numpy.percentile
+        position = starts + (counts - 1)*(percentile/100.0)
+        lower = numpy.floor(position).astype(numpy.int64)
+        upper = numpy.ceil(position).astype(numpy.int64)
+        fraction = position - lower
+        result[name] = sortedValues[lower] + (sortedValues[upper] - sortedValues[lower])*fraction
+    result['max'] = sortedValues[lasts]
+    result['longest'] = profile.columns['no'][order[lasts]]
+
+    return result
@@ -28,75 +28,70 @@
 import optparse
 import sys
 
+import profiledata
 
-def process(stream, groupField):
-    times = {}
 
-    # Read header describing fields
-    header = stream.readline()
-    assert header.startswith('#')
+# Title and unit of the columns that can be aggregated
+_valueTitles = {
+    'gpu_dura': ('Duration', 'ns'),
+    'cpu_dura': ('Duration', 'ns'),
+    'pixels': ('Pixels', '#'),
+    'vsize_dura': ('Memory', 'B'),
+    'rss_dura': ('Memory', 'B'),
+}
 
-    fields = header.rstrip('\r\n').split(' ')[1:]
-    columns = {}
-    for column in range(len(fields)):
-        columns[fields[column]] = column
 
-    callCol = columns['call']
-    callIdCol = columns['no']
-    gpuDuraCol = columns['gpu_dura']
-    programCol = columns['program']
-    funcNameCol = columns['name']
+# Titles whose width group columns are padded to
+_groupTitles = {
+    'program': 'Shader[id]',
+}
 
-    groupCol = columns[groupField]
 
-    maxGroupLen = 0
+def render(profile, groups, groupFields, value, stats):
+    '''Print the groups as a table, sorted by decreasing total.'''
 
-    for line in stream:
-        fields = line.rstrip('\r\n').split(' ')
+    title, unit = _valueTitles.get(value, (value, '#'))
 
-        if line.startswith('#'):
-            continue
+    # Each column is a (title, width, formatter) tuple
+    columns = []
+    for field in groupFields:
+        labels = profile.labels(field, groups[field])
+        width = max([len(_groupTitles.get(field, field))] + [len(label) for label in labels])
+        columns.append((field.center(width), width, lambda i, labels=labels: labels[i]))
+    columns.append(('  Draws [#] ', 12, lambda i: str(groups['count'][i])))
+    columns.append(('  %s [%s]  v' % (title, unit), 18, lambda i: str(groups['sum'][i])))
+    for stat in stats:
+        if stat == 'mean':
+            # Integer division, as integers are what's measured
+            columns.append(('Per Call[%s]' % unit, 12, lambda i: str(groups['sum'][i] // groups['count'][i])))
+        else:
+            columns.append(('%s[%s]' % (stat.capitalize(), unit), 12, lambda i, stat=stat: '%.0f' % groups[stat][i]))
+    columns.append(('Longest[id]', 11, lambda i: str(groups['longest'][i])))
 
-        if fields[callCol] == 'call':
-            callId = int(fields[callIdCol])
-            duration = int(fields[gpuDuraCol])
-            group = fields[groupCol]
+    widths = [max(width, len(title)) for title, width, formatter in columns]
+    line = '+-' + '-+-'.join(['-' * width for width in widths]) + '-+'
 
-            maxGroupLen = max(maxGroupLen, len(group))
+    print(line)
+    print('| ' + ' | '.join([title.rjust(width) for (title, _, _), width in zip(columns, widths)]) + ' |')
+    print(line)
 
-            if group in times:
-                times[group]['draws'] += 1
-                times[group]['duration'] += duration
+    order = (-groups['sum']).argsort(kind='stable')
+    for i in order:
+        print('| ' + ' | '.join([formatter(i).rjust(width) for (_, _, formatter), width in zip(columns, widths)]) + ' |')
 
-                if duration > times[group]['longestDuration']:
-                    times[group]['longest'] = callId
-                    times[group]['longestDuration'] = duration
-            else:
-                times[group] = {'draws': 1, 'duration': duration, 'longest': callId, 'longestDuration': duration}
+    print(line)
 
-    times = sorted(list(times.items()), key=lambda x: x[1]['duration'], reverse=True)
 
-    if groupField == 'program':
-        groupTitle = 'Shader[id]'
-    else:
-        groupTitle = groupField
-    maxGroupLen = max(maxGroupLen, len(groupTitle))
-    groupTitle = groupField.center(maxGroupLen)
-    groupLine = '-' * maxGroupLen
+def process(stream, groupFields, value='gpu_dura', stats=('mean',)):
+    profile = profiledata.load(stream)
+    groups = profiledata.groupBy(profile, groupFields, value)
+    render(profile, groups, groupFields, value, stats)
 
-    print('+-%s-+--------------+--------------------+--------------+-------------+' % groupLine)
-    print('| %s |   Draws [#]  |   Duration [ns]  v | Per Call[ns] | Longest[id] |' % groupTitle)
-    print('+-%s-+--------------+--------------------+--------------+-------------+' % groupLine)
 
-    for group in times:
-        id = str(group[0]).rjust(maxGroupLen)
-        draw = str(group[1]['draws']).rjust(12)
-        dura = str(group[1]['duration']).rjust(18)
-        perCall = str(group[1]['duration'] // group[1]['draws']).rjust(12)
-        longest = str(group[1]['longest']).rjust(11)
-        print("| %s | %s | %s | %s | %s |" % (id, draw, dura, perCall, longest))
-
-    print('+-%s-+--------------+--------------------+--------------+-------------+' % groupLine)
+def processFile(filename, groupFields, value='gpu_dura', stats=('mean',)):
+    profile = profiledata.loadFile(filename)
+    groups = profiledata.groupBy(profile, groupFields, value)
+    render(profile, groups, groupFields, value, stats)
 
 
 def main():
@@ -107,17 +102,35 @@ def main():
         version='%%prog')
 
     optparser.add_option(
-        '-g', '--group', metavar='FIELD',
+        '-g', '--group', metavar='FIELD[,FIELD...]',
         type="string", dest="group", default='program',
-        help="group by specified field [default: %default]")
-    
+        help="group by the specified fields, such as program, name, or frame [default: %default]")
+    optparser.add_option(
+        '-v', '--value', metavar='FIELD',
+        type="string", dest="value", default='gpu_dura',
+        help="field to aggregate, such as gpu_dura, cpu_dura, or pixels [default: %default]")
+    optparser.add_option(
+        '-s', '--stats', metavar='STAT[,STAT...]',
+        type="string", dest="stats", default='mean',
+        help="statistics to show besides the count and sum, among mean, p50, p95, p99, and max [default: %default]")
+
     (options, args) = optparser.parse_args(sys.argv[1:])
 
-    if len(args):
-        for arg in args:
-            process(open(arg, 'rt'), options.group)
-    else:
-        process(sys.stdin, options.group)
+    groupFields = options.group.split(',')
+    stats = [stat for stat in options.stats.split(',') if stat]
+    for stat in stats:
+        if stat not in profiledata.statNames or stat in ('count', 'sum'):
+            optparser.error('unknown statistic %r' % stat)
+
+    try:
+        if len(args):
+            for arg in args:
+                processFile(arg, groupFields, options.value, stats)
+        else:
+            process(sys.stdin.buffer, groupFields, options.value, stats)
+    except ValueError as ex:
+        sys.stderr.write('error: %s\n' % ex)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
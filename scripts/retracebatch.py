@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+##########################################################################
+#
+# Copyright 2026 Jose Fonseca
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the 'Software'), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+##########################################################################/
+
+'''Run retracediff.py over many traces, described by a JSON manifest.
+
+The manifest looks like:
+
+    {
+        "retrace": "glretrace",
+        "ref": {"driver": "sw", "args": [], "env": {}},
+        "src": {"env": {"LD_LIBRARY_PATH": "/path/to/driver"}},
+        "options": ["--adaptive"],
+        "traces": [
+            "foo.trace",
+            {"name": "bar", "trace": "bar.trace", "args": ["--core"], "options": ["-S", "frame"]}
+        ]
+    }
+
+where "options" are extra retracediff options, and "args" extra retrace
+arguments.  Relative trace paths are relative to the manifest.
+
+Every trace gets a NAME.json result file in the output directory, and a
+summary.json is written at the end.  Traces with a result file are skipped, so
+an interrupted batch can be resumed by running the same command again.
+'''
+
+
+import json
+import optparse
+import os.path
+import queue
+import subprocess
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+retracediff = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'retracediff.py')
+
+
+class Entry:
+    '''A trace to be compared.'''
+
+    def __init__(self, manifest, item, basedir):
+        if isinstance(item, str):
+            item = {'trace': item}
+        self.trace = os.path.join(basedir, item['trace'])
+        self.name = item.get('name', os.path.splitext(os.path.basename(item['trace']))[0])
+        self.args = item.get('args', [])
+        self.options = manifest.get('options', []) + item.get('options', [])
+
+
+def load_manifest(filename):
+    manifest = json.load(open(filename, 'rt'))
+    basedir = os.path.dirname(os.path.abspath(filename))
+    entries = [Entry(manifest, item, basedir) for item in manifest['traces']]
+    names = set()
+    for entry in entries:
+        if entry.name in names:
+            raise ValueError('duplicate trace name %r' % entry.name)
+        names.add(entry.name)
+    return manifest, entries
+
+
+def write_json(filename, obj):
+    '''Write the JSON file atomically, so that interrupted writes are never
+    mistaken for completed results.'''
+
+    tmpname = filename + '.tmp'
+    stream = open(tmpname, 'wt')
+    json.dump(obj, stream, indent=2)
+    stream.close()
+    os.replace(tmpname, filename)
+
+
+class Batch:
+
+    def __init__(self, manifest, options):
+        self.manifest = manifest
+        self.options = options
+
+        # Each job takes a slot, which is returned once the job is done
+        self.slots = queue.Queue()
+        slotEnvs = options.slot_envs or [None]
+        for i in range(options.jobs):
+            self.slots.put(slotEnvs[i % len(slotEnvs)])
+
+    def result_path(self, entry):
+        return os.path.join(self.options.output_dir, entry.name + '.json')
+
+    def command(self, entry, slotEnv, outdir):
+        manifest = self.manifest
+        cmd = [
+            sys.executable, retracediff,
+            '--retrace', manifest.get('retrace', 'glretrace'),
+            '--diff-prefix', outdir,
+            '--output', os.path.join(outdir, 'retracediff.txt'),
+            '--json', os.path.join(outdir, 'retracediff.json'),
+        ]
+        for side in ('ref', 'src'):
+            config = manifest.get(side, {})
+            if 'driver' in config:
+                cmd += ['--%s-driver' % side, config['driver']]
+            for arg in config.get('args', []):
+                cmd += ['--%s-arg' % side, arg]
+            env = dict(config.get('env', {}))
+            if slotEnv is not None:
+                name, value = slotEnv.split('=', 1)
+                env[name] = value
+            for name, value in sorted(env.items()):
+                cmd += ['--%s-env' % side, '%s=%s' % (name, value)]
+        cmd += entry.options
+        cmd += ['--'] + entry.args + [entry.trace]
+        return cmd
+
+    def run(self, entry):
+        slotEnv = self.slots.get()
+        try:
+            outdir = os.path.join(self.options.output_dir, entry.name)
+            if not os.path.isdir(outdir):
+                os.makedirs(outdir)
+            # Remove results of previous runs, so that a retracediff that dies
+            # before writing its report is not mistaken for a pass
+            jsonPath = os.path.join(outdir, 'retracediff.json')
+            if os.path.exists(jsonPath):
+                os.remove(jsonPath)
+            cmd = self.command(entry, slotEnv, outdir)
+            log = open(os.path.join(outdir, 'retracediff.log'), 'wt')
+            startTime = time.time()
+            returncode = subprocess.call(cmd, stdout=log, stderr=subprocess.STDOUT)
+            duration = time.time() - startTime
+            log.close()
+        finally:
+            self.slots.put(slotEnv)
+
+        result = {
+            'name': entry.name,
+            'trace': entry.trace,
+            'returncode': returncode,
+            'duration': duration,
+        }
+        try:
+            result.update(json.load(open(jsonPath, 'rt')))
+        except (IOError, ValueError):
+            result['status'] = 'error'
+        else:
+            if returncode:
+                result['status'] = 'error'
+            elif result['mismatches']:
+                result['status'] = 'fail'
+            else:
+                result['status'] = 'pass'
+
+        write_json(self.result_path(entry), result)
+        sys.stdout.write('%s\t%s\n' % (result['status'].upper(), entry.name))
+        sys.stdout.flush()
+        return result
+
+    def summarize(self, entries):
+        summary = {
+            'total': len(entries),
+            'pass': [],
+            'fail': [],
+            'error': [],
+            'pending': [],
+        }
+        for entry in entries:
+            try:
+                result = json.load(open(self.result_path(entry), 'rt'))
+            except (IOError, ValueError):
+                summary['pending'].append(entry.name)
+            else:
+                summary[result['status']].append(entry.name)
+        write_json(os.path.join(self.options.output_dir, 'summary.json'), summary)
+        return summary
+
+
+def main():
+    '''Main program.
+    '''
+
+    # Parse command line options
+    optparser = optparse.OptionParser(
+        usage='\n\t%prog [options] <manifest>',
+        version='%%prog')
+    optparser.add_option(
+        '-j', '--jobs', metavar='N',
+        type='int', dest='jobs', default=max((os.cpu_count() or 1) // 2, 1),
+        help='maximum number of traces compared concurrently [default: %default]')
+    optparser.add_option(
+        '--slot-env', metavar='NAME=VALUE',
+        type='string', action='append', dest='slot_envs', default=[],
+        help='add a slot (e.g., a GPU) selected by this environment variable; jobs are spread across slots')
+    optparser.add_option(
+        '-o', '--output-dir', metavar='PATH',
+        type='string', dest='output_dir', default='results',
+        help='output directory [default: %default]')
+    optparser.add_option(
+        '--rerun',
+        action='store_true', dest='rerun', default=False,
+        help='rerun traces which already have results')
+
+    (options, args) = optparser.parse_args(sys.argv[1:])
+    if len(args) != 1:
+        optparser.error('incorrect number of arguments')
+    for slotEnv in options.slot_envs:
+        if '=' not in slotEnv:
+            optparser.error('invalid slot environment entry %r' % slotEnv)
+    if options.jobs < 1:
+        optparser.error('invalid number of jobs %r' % options.jobs)
+
+    manifest, entries = load_manifest(args[0])
+
+    if not os.path.isdir(options.output_dir):
+        os.makedirs(options.output_dir)
+
+    batch = Batch(manifest, options)
+
+    pending = []
+    for entry in entries:
+        if not options.rerun and os.path.exists(batch.result_path(entry)):
+            continue
+        pending.append(entry)
+    sys.stderr.write('%u traces, %u already done\n' % (len(entries), len(entries) - len(pending)))
+
+    executor = ThreadPoolExecutor(max_workers=options.jobs)
+    futures = [executor.submit(batch.run, entry) for entry in pending]
+    try:
+        for future in futures:
+            future.result()
+    finally:
+        # Don't start new traces when interrupted
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+    summary = batch.summarize(entries)
+    sys.stdout.write('%u passed, %u failed, %u errors\n' % (len(summary['pass']), len(summary['fail']), len(summary['error'])))
+
+    if summary['fail'] or summary['error']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
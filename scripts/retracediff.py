@@ -28,9 +28,12 @@
 '''
 
 
+import io
+import json
 import math
 import optparse
 import os.path
+import re
 import subprocess
 import platform
 import sys
@@ -60,6 +63,18 @@ class RetraceRun:
 
         return image, callNo
 
+    def nextChecksum(self):
+        '''Read the next snapshot checksum, as a (callNo, (width, height, md5))
+        tuple.'''
+
+        line = self.process.stdout.readline()
+        if not line:
+            return None, None
+
+        callNo, width, height, md5 = line.split()
+
+        return int(callNo), (int(width), int(height), md5)
+
     def terminate(self):
         try:
             self.process.terminate()
@@ -70,10 +85,11 @@ class RetraceRun:
 
 class Retracer:
 
-    def __init__(self, retraceExe, args, env=None):
+    def __init__(self, retraceExe, args, env=None, dumpFormat='json'):
         self.retraceExe = retraceExe
         self.args = args
         self.env = env
+        self.dumpFormat = dumpFormat
 
     def _retrace(self, args, stdout=subprocess.PIPE):
         cmd = [
@@ -94,6 +110,20 @@ class Retracer:
         p.wait()
         return p.returncode
 
+    def benchmark(self, loop=0):
+        '''Replay in benchmark mode, and return the return code and the
+        (frames, seconds) reported, or None if not reported.'''
+
+        args = ['-b']
+        if loop:
+            args.append('--loop=%u' % loop)
+        p = self._retrace(args)
+        stdout, _ = p.communicate()
+        mo = re.search(rb'Rendered (\d+) frames in ([0-9.eE+-]+) secs', stdout)
+        if mo is None:
+            return p.returncode, None
+        return p.returncode, (int(mo.group(1)), float(mo.group(2)))
+
     def snapshot(self, call_nos):
         process = self._retrace([
             '-s', '-',
@@ -101,27 +131,67 @@ class Retracer:
         ])
         return RetraceRun(process)
 
+    def checksum(self, call_nos):
+        process = self._retrace([
+            '-s', '-',
+            '--snapshot-format=MD5SUM',
+            '-S', call_nos,
+        ])
+        return RetraceRun(process)
+
     def dump_state(self, call_no):
         '''Get the state dump at the specified call no.'''
 
         p = self._retrace([
             '-D', str(call_no),
+            '--dump-format=' + self.dumpFormat,
         ])
         state = jsondiff.load(p.stdout)
         p.wait()
         return state.get('parameters', {})
 
-    def diff_state(self, ref_call_no, src_call_no, stream):
-        '''Compare the state between two calls.'''
+    def stream_state(self, call_no):
+        '''Start a state dump at the specified call no, and return the process
+        and a parser positioned at the state parameters.'''
+
+        p = self._retrace([
+            '-D', str(call_no),
+            '--dump-format=' + self.dumpFormat,
+        ])
+        parser = jsondiff.open_stream(p.stdout)
+        if not parser.seek_member('parameters'):
+            parser = jsondiff.StreamParser(io.StringIO('{}'))
+        return p, parser
+
+    def diff_state(self, ref_call_no, src_call_no, stream, incremental = False):
+        '''Compare the state between two calls.
+
+        When incremental, both state dumps are parsed and compared as they are
+        produced, so that memory usage does not grow with the size of the
+        dumps, at the expense of speed.'''
+
+        if not incremental:
+            ref_state = self.dump_state(ref_call_no)
+            src_state = self.dump_state(src_call_no)
 
-        ref_state = self.dump_state(ref_call_no)
-        src_state = self.dump_state(src_call_no)
+            stream.flush()
+            differ = jsondiff.Differ(stream)
+            differ.visit(ref_state, src_state)
+            stream.write('\n')
+            return
+
+        ref_process, ref_state = self.stream_state(ref_call_no)
+        src_process, src_state = self.stream_state(src_call_no)
 
         stream.flush()
-        differ = jsondiff.Differ(stream)
-        differ.visit(ref_state, src_state)
+        differ = jsondiff.StreamDiffer(stream)
+        differ.diff(ref_state, src_state)
         stream.write('\n')
 
+        for p in (ref_process, src_process):
+            p.stdout.close()
+            p.wait()
+
 
 def read_pnm(stream):
     '''Read a PNM from the stream, and return the image object, and the comment.'''
@@ -227,6 +297,340 @@ def parse_env(optparser, entries):
     return env
 
 
+def compare_images(refImage, srcImage, options):
+    '''Compare two snapshots.
+
+    Returns the precision in bits, and a Comparer object (or None for floating
+    point images).'''
+
+    if isinstance(refImage, Image.Image) and isinstance(srcImage, Image.Image):
+        # Using PIL
+        comparer = Comparer(refImage, srcImage)
+        if options.tile_size:
+            precision = comparer.tiled_precision(options.threshold, options.tile_size)
+        else:
+            precision = comparer.precision()
+        return precision, comparer
+
+    # Using numpy (for floating point images)
+    # TODO: drop PIL when numpy path becomes general enough
+    import numpy
+    assert not isinstance(refImage, Image.Image)
+    assert not isinstance(srcImage, Image.Image)
+    assert refImage.shape == srcImage.shape
+    diffImage = numpy.square(srcImage - refImage)
+
+    height, width, channels = diffImage.shape
+    square_error = numpy.sum(diffImage)
+    square_error += numpy.finfo(numpy.float32).eps
+    rel_error = square_error / float(height*width*channels)
+    bits = -math.log(rel_error)/math.log(2.0)
+    return bits, None
+
+
+def is_mismatch(precision, refImage, srcImage, options):
+    '''Whether two snapshots differ beyond the thresholds.'''
+
+    if not options.metrics:
+        return precision < options.threshold
+
+    if refImage is None:
+        # Identical checksums
+        return False
+
+    import imagemetrics
+    metrics, = imagemetrics.compare([refImage], [srcImage])
+    return not imagemetrics.passes(metrics, options.thresholds)
+
+
+def compare_snapshots(refRetracer, srcRetracer, call_nos, options):
+    '''Retrace both instances in parallel, snapshotting the given calls.
+
+    Yields (callNo, precision, refImage, srcImage, comparer) tuples.'''
+
+    if options.checksum:
+        return compare_checksums(refRetracer, srcRetracer, call_nos, options)
+    else:
+        return compare_pixels(refRetracer, srcRetracer, call_nos, options)
+
+
+def compare_pixels(refRetracer, srcRetracer, call_nos, options):
+    '''Compare the snapshot images of every call.'''
+
+    refRun = refRetracer.snapshot(call_nos)
+    try:
+        srcRun = srcRetracer.snapshot(call_nos)
+        try:
+            while True:
+                # Get the reference image
+                refImage, refCallNo = refRun.nextSnapshot()
+                if refImage is None:
+                    break
+
+                # Get the source image
+                srcImage, srcCallNo = srcRun.nextSnapshot()
+                if srcImage is None:
+                    break
+
+                assert refCallNo == srcCallNo
+                callNo = refCallNo
+
+                precision, comparer = compare_images(refImage, srcImage, options)
+
+                yield callNo, precision, refImage, srcImage, comparer
+        finally:
+            srcRun.terminate()
+    finally:
+        refRun.terminate()
+
+
+def compare_checksums(refRetracer, srcRetracer, call_nos, options):
+    '''Compare snapshot checksums first, fetching the pixels only for the
+    calls whose checksums differ.
+
+    Calls with identical checksums are yielded with infinite precision and no
+    images.'''
+
+    checksums = []
+    mismatches = []
+    refRun = refRetracer.checksum(call_nos)
+    try:
+        srcRun = srcRetracer.checksum(call_nos)
+        try:
+            while True:
+                refCallNo, refChecksum = refRun.nextChecksum()
+                if refCallNo is None:
+                    break
+
+                srcCallNo, srcChecksum = srcRun.nextChecksum()
+                if srcCallNo is None:
+                    break
+
+                assert refCallNo == srcCallNo
+                callNo = refCallNo
+
+                match = refChecksum == srcChecksum
+                checksums.append((callNo, match))
+                if not match:
+                    mismatches.append(callNo)
+        finally:
+            srcRun.terminate()
+    finally:
+        refRun.terminate()
+
+    if mismatches:
+        results = compare_pixels(refRetracer, srcRetracer, ','.join(map(str, mismatches)), options)
+    else:
+        results = iter([])
+    result = next(results, None)
+
+    for callNo, match in checksums:
+        if match:
+            yield callNo, float('inf'), None, None, None
+            continue
+
+        # Skip snapshots that were not reproduced on the second run
+        while result is not None and result[0] < callNo:
+            result = next(results, None)
+        if result is not None and result[0] == callNo:
+            yield result
+            result = next(results, None)
+
+
+class Reporter:
+    '''Writes comparison results, difference images, and state diffs.'''
+
+    def __init__(self, output, srcRetracer, options):
+        self.output = output
+        self.highligher = AutoHighlighter(output)
+        self.srcRetracer = srcRetracer
+        self.options = options
+        self.numSnapshots = 0
+        self.mismatches = []
+        self.frames = []
+
+    def write(self, fields, mismatch):
+        highligher = self.highligher
+        if mismatch:
+            highligher.color(highligher.red)
+            highligher.bold()
+        highligher.write('\t'.join(fields) + '\n')
+        if mismatch:
+            highligher.normal()
+        highligher.flush()
+
+    def report(self, callNo, precision, refImage, srcImage, comparer):
+        mismatch = is_mismatch(precision, refImage, srcImage, self.options)
+        self.write(['%u' % callNo, '%f' % precision], mismatch)
+        self.numSnapshots += 1
+        if mismatch:
+            self.mismatches.append({'call': callNo, 'precision': precision})
+            self.dump_diff(callNo, refImage, srcImage, comparer)
+        return mismatch
+
+    def report_frame(self, frameCallNo, callNo, precision, missing=None):
+        '''Report the first offending call of a mismatching frame.
+
+        When a snapshot went missing at call `missing`, the frame could not be
+        narrowed down, and callNo is only an upper bound.'''
+
+        if missing is not None:
+            self.write(['%u' % frameCallNo, '%u' % callNo, 'inconclusive'], True)
+        elif precision is None:
+            self.write(['%u' % frameCallNo, '%u' % callNo, '-'], True)
+        else:
+            self.write(['%u' % frameCallNo, '%u' % callNo, '%f' % precision], True)
+        self.frames.append({'frame': frameCallNo, 'call': callNo, 'precision': precision, 'missing': missing})
+
+    def dump_json(self, filename):
+        '''Write the results as JSON.'''
+
+        results = {
+            'snapshots': self.numSnapshots,
+            'mismatches': self.mismatches,
+        }
+        if self.options.adaptive:
+            results['frames'] = self.frames
+        stream = open(filename, 'wt')
+        json.dump(results, stream, indent=2)
+        stream.close()
+
+    def dump_diff(self, callNo, refImage, srcImage, comparer):
+        if not self.options.diff_prefix:
+            return
+        prefix = os.path.join(self.options.diff_prefix, '%010u' % callNo)
+        prefix_dir = os.path.dirname(prefix)
+        if not os.path.isdir(prefix_dir):
+            os.makedirs(prefix_dir)
+        if comparer is None:
+            dumpNumpyImage(self.output, refImage, prefix + '.ref.png')
+            dumpNumpyImage(self.output, srcImage, prefix + '.src.png')
+        else:
+            box = None
+            if self.options.crop_diff:
+                box = comparer.diff_box(self.options.tile_size or 64)
+            if box is not None:
+                refImage = refImage.crop(box)
+                srcImage = srcImage.crop(box)
+            refImage.save(prefix + '.ref.png')
+            srcImage.save(prefix + '.src.png')
+            comparer.write_diff(prefix + '.diff.png', box=box)
+
+    def diff_state(self, goodCallNo, badCallNo):
+        if self.options.diff_state:
+            self.srcRetracer.diff_state(goodCallNo, badCallNo, self.output, self.options.stream_state)
+
+
+def retrace_diff(refRetracer, srcRetracer, reporter, options):
+    '''Compare snapshots at every call of the snapshot frequency.'''
+
+    reporter.write(['call', 'precision'], False)
+
+    last_bad = -1
+    last_good = 0
+    for callNo, precision, refImage, srcImage, comparer in \
+            compare_snapshots(refRetracer, srcRetracer, options.snapshot_frequency, options):
+        mismatch = reporter.report(callNo, precision, refImage, srcImage, comparer)
+        if mismatch:
+            if last_bad < last_good:
+                reporter.diff_state(last_good, callNo)
+            last_bad = callNo
+        else:
+            last_good = callNo
+
+
+class Frame:
+    '''A mismatching frame being refined.
+
+    Calls in the (good, bad] interval are yet to be narrowed down.'''
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.good = start - 1
+        self.bad = end
+        self.precision = None
+        self.images = None
+        # Call at which a snapshot went missing, if any
+        self.missing = None
+
+
+def adaptive_retrace_diff(refRetracer, srcRetracer, reporter, options):
+    '''Compare snapshots coarse-to-fine.
+
+    Snapshots are first compared at the end of every frame.  Only the frames
+    that mismatch are then retraced again with a snapshot per draw call, and,
+    if no draw call explains the mismatch, their remaining call range is
+    bisected, so that the first offending call of every frame is found without
+    reading back the framebuffer at every draw.'''
+
+    reporter.write(['call', 'precision'], False)
+
+    frames = []
+    start = 0
+    for callNo, precision, refImage, srcImage, comparer in \
+            compare_snapshots(refRetracer, srcRetracer, 'frame', options):
+        if reporter.report(callNo, precision, refImage, srcImage, comparer):
+            frames.append(Frame(start, callNo))
+        start = callNo + 1
+
+    if not frames:
+        return
+
+    # Snapshot every draw call of the mismatching frames
+    callset = ','.join(['%u-%u/draw' % (frame.start, frame.end) for frame in frames])
+    it = iter(frames)
+    frame = next(it)
+    for callNo, precision, refImage, srcImage, comparer in \
+            compare_snapshots(refRetracer, srcRetracer, callset, options):
+        while callNo > frame.end:
+            frame = next(it)
+        if frame.precision is not None:
+            continue
+        if is_mismatch(precision, refImage, srcImage, options):
+            frame.bad = callNo
+            frame.precision = precision
+            frame.images = refImage, srcImage, comparer
+        else:
+            frame.good = callNo
+
+    # Bisect the calls following the last matching draw call.  The end of
+    # the frame is known to mismatch, so no snapshot needs to be taken there.
+    pending = [frame for frame in frames if frame.precision is None]
+    while pending:
+        probes = {}
+        for frame in pending:
+            if frame.missing is None and frame.bad - frame.good > 1:
+                probes[(frame.good + frame.bad) // 2] = frame
+        if not probes:
+            break
+        callset = ','.join(map(str, sorted(probes)))
+        for callNo, precision, refImage, srcImage, comparer in \
+                compare_snapshots(refRetracer, srcRetracer, callset, options):
+            frame = probes.pop(callNo)
+            if is_mismatch(precision, refImage, srcImage, options):
+                frame.bad = callNo
+                frame.precision = precision
+                frame.images = refImage, srcImage, comparer
+            else:
+                frame.good = callNo
+        # A missing snapshot means that a retrace crashed or exited early, so
+        # nothing can be concluded about the remaining calls of the frame
+        for callNo, frame in probes.items():
+            sys.stderr.write('warning: no snapshot taken at call %u, frame ending at call %u is inconclusive\n' % (callNo, frame.end))
+            frame.missing = callNo
+
+    reporter.write(['frame', 'call', 'precision'], False)
+    for frame in frames:
+        reporter.report_frame(frame.end, frame.bad, frame.precision, frame.missing)
+        if frame.precision is None:
+            # Bisection converged on the end of frame itself, whose snapshot
+            # was already reported above
+            continue
+        reporter.dump_diff(frame.bad, *frame.images)
+        reporter.diff_state(max(frame.good, 0), frame.bad)
+
+
 def main():
     '''Main program.
     '''
@@ -273,118 +677,85 @@ def main():
         '-t', '--threshold', metavar='BITS',
         type="float", dest="threshold", default=12.0,
         help="threshold precision  [default: %default]")
+    optparser.add_option(
+        '-m', '--metric', metavar='NAME=THRESHOLD',
+        type="string", action="append", dest="metrics", default=[],
+        help="detect mismatches with the given metric threshold (ae, max_error, psnr, or ssim) instead of the precision")
+    optparser.add_option(
+        '--tile-size', metavar='PIXELS',
+        type="int", dest="tile_size", default=0,
+        help="compare images in tiles, stopping once the threshold verdict is certain [default: disabled]")
+    optparser.add_option(
+        '--crop-diff',
+        action='store_true', dest='crop_diff', default=False,
+        help='crop the difference images to the tiles that differ')
     optparser.add_option(
         '-S', '--snapshot-frequency', metavar='CALLSET',
         type="string", dest="snapshot_frequency", default='draw',
         help="calls to compare [default: %default]")
+    optparser.add_option(
+        '--adaptive',
+        action='store_true', dest='adaptive', default=False,
+        help='compare frames first, and only then the draw calls of mismatching frames')
+    optparser.add_option(
+        '--checksum',
+        action='store_true', dest='checksum', default=False,
+        help='compare snapshot checksums, and only fetch the images of calls whose checksums differ')
     optparser.add_option(
         '--diff-state',
         action='store_true', dest='diff_state', default=False,
         help='diff state between failing calls')
+    optparser.add_option(
+        '--stream-state',
+        action='store_true', dest='stream_state', default=False,
+        help='diff state dumps incrementally, for dumps too large to load in memory')
+    optparser.add_option(
+        '--dump-format', metavar='FORMAT',
+        type='choice', choices=('json', 'ubjson'), dest='dump_format', default='json',
+        help='state dump format requested from retrace for --diff-state (json or ubjson) [default: %default]')
     optparser.add_option(
         '-o', '--output', metavar='FILE',
         type="string", dest="output",
         help="output file [default: stdout]")
+    optparser.add_option(
+        '--json', metavar='FILE',
+        type="string", dest="json",
+        help="also write the results to a JSON file")
 
     (options, args) = optparser.parse_args(sys.argv[1:])
     ref_env = parse_env(optparser, options.ref_env)
     src_env = parse_env(optparser, options.src_env)
     if not args:
         optparser.error("incorrect number of arguments")
+    if options.metrics:
+        import imagemetrics
+        try:
+            options.thresholds = imagemetrics.parse_thresholds(options.metrics)
+        except ValueError as ex:
+            optparser.error(str(ex))
     
     if options.ref_driver:
         options.ref_args.insert(0, '--driver=' + options.ref_driver)
     if options.src_driver:
         options.src_args.insert(0, '--driver=' + options.src_driver)
 
-    refRetracer = Retracer(options.retrace, options.ref_args + args, ref_env)
-    srcRetracer = Retracer(options.retrace, options.src_args + args, src_env)
+    refRetracer = Retracer(options.retrace, options.ref_args + args, ref_env, options.dump_format)
+    srcRetracer = Retracer(options.retrace, options.src_args + args, src_env, options.dump_format)
 
     if options.output:
         output = open(options.output, 'wt')
     else:
         output = sys.stdout
 
-    highligher = AutoHighlighter(output)
+    reporter = Reporter(output, srcRetracer, options)
 
-    highligher.write('call\tprecision\n')
-
-    last_bad = -1
-    last_good = 0
-    refRun = refRetracer.snapshot(options.snapshot_frequency)
-    try:
-        srcRun = srcRetracer.snapshot(options.snapshot_frequency)
-        try:
-            while True:
-                # Get the reference image
-                refImage, refCallNo = refRun.nextSnapshot()
-                if refImage is None:
-                    break
-
-                # Get the source image
-                srcImage, srcCallNo = srcRun.nextSnapshot()
-                if srcImage is None:
-                    break
-
-                assert refCallNo == srcCallNo
-                callNo = refCallNo
+    if options.adaptive:
+        adaptive_retrace_diff(refRetracer, srcRetracer, reporter, options)
+    else:
+        retrace_diff(refRetracer, srcRetracer, reporter, options)
 
-                # Compare the two images
-                if isinstance(refImage, Image.Image) and isinstance(srcImage, Image.Image):
-                    # Using PIL
-                    numpyImages = False
-                    comparer = Comparer(refImage, srcImage)
-                    precision = comparer.precision()
-                else:
-                    # Using numpy (for floating point images)
-                    # TODO: drop PIL when numpy path becomes general enough
-                    import numpy
-                    assert not isinstance(refImage, Image.Image)
-                    assert not isinstance(srcImage, Image.Image)
-                    numpyImages = True
-                    assert refImage.shape == srcImage.shape
-                    diffImage = numpy.square(srcImage - refImage)
-
-                    height, width, channels = diffImage.shape
-                    square_error = numpy.sum(diffImage)
-                    square_error += numpy.finfo(numpy.float32).eps
-                    rel_error = square_error / float(height*width*channels)
-                    bits = -math.log(rel_error)/math.log(2.0)
-                    precision = bits
-
-                mismatch = precision < options.threshold
-
-                if mismatch:
-                    highligher.color(highligher.red)
-                    highligher.bold()
-                highligher.write('%u\t%f\n' % (callNo, precision))
-                if mismatch:
-                    highligher.normal()
-
-                if mismatch:
-                    if options.diff_prefix:
-                        prefix = os.path.join(options.diff_prefix, '%010u' % callNo)
-                        prefix_dir = os.path.dirname(prefix)
-                        if not os.path.isdir(prefix_dir):
-                            os.makedirs(prefix_dir)
-                        if numpyImages:
-                            dumpNumpyImage(output, refImage, prefix + '.ref.png')
-                            dumpNumpyImage(output, srcImage, prefix + '.src.png')
-                        else:
-                            refImage.save(prefix + '.ref.png')
-                            srcImage.save(prefix + '.src.png')
-                            comparer.write_diff(prefix + '.diff.png')
-                    if last_bad < last_good and options.diff_state:
-                        srcRetracer.diff_state(last_good, callNo, output)
-                    last_bad = callNo
-                else:
-                    last_good = callNo
-
-                highligher.flush()
-        finally:
-            srcRun.terminate()
-    finally:
-        refRun.terminate()
+    if options.json:
+        reporter.dump_json(options.json)
 
 
 if __name__ == '__main__':
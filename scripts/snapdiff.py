@@ -30,11 +30,17 @@
 '''
 
 
+import hashlib
+import io
+import itertools
+import json
 import sys
 import os.path
 import optparse
 import math
+import multiprocessing
 import operator
+import time
 
 from PIL import Image
 from PIL import ImageChops
@@ -45,6 +51,9 @@ from functools import reduce
 
 thumbSize = 320
 
+# Number of image pairs compared together by each worker
+batchSize = 16
+
 gaussian_kernel = ImageFilter.Kernel((3, 3), [1, 2, 1, 2, 4, 2, 1, 2, 1], 16)
 
 class Comparer:
@@ -66,12 +75,22 @@ class Comparer:
             self.ref_im = self.ref_im.convert('RGB')
             self.src_im = self.src_im.convert('RGB')
 
-        self.diff = ImageChops.difference(self.src_im, self.ref_im)
+        self._diff = None
+
+        # Square error of every (left, upper, right, lower) tile, when known
+        self.tile_errors = None
+
+    @property
+    def diff(self):
+        # Computed lazily, so that tiled comparisons can bail out early
+        if self._diff is None:
+            self._diff = ImageChops.difference(self.src_im, self.ref_im)
+        return self._diff
 
     def size_mismatch(self):
         return self.ref_im.size != self.src_im.size
 
-    def write_diff(self, diff_image, fuzz = 0.05):
+    def write_diff(self, diff_image, fuzz = 0.05, box = None):
         if self.size_mismatch():
             return
 
@@ -92,6 +111,8 @@ class Comparer:
         diff_im = Image.composite(highlight, lowlight, mask)
 
         diff_im = Image.blend(self.src_im, diff_im, 0xcc/255.0)
+        if box is not None:
+            diff_im = diff_im.crop(box)
         diff_im.save(diff_image)
 
     def precision(self, filter=False):
@@ -102,12 +123,110 @@ class Comparer:
         if filter:
             diff = diff.filter(gaussian_kernel)
 
+        square_error = self._square_error(diff)
+        return self._bits(square_error)
+
+    def tiled_precision(self, threshold = None, tile_size = 64):
+        '''Compute the precision one band of rows at a time.
+
+        When a threshold is given, stops as soon as it is certain whether the
+        precision is above or below it, in which case the returned value is
+        only a bound on the precision, but on the right side of the threshold.
+        Bands start tile_size rows high and double every step, so that
+        mismatches near the top are found early, while matching images cost
+        little more than precision().
+
+        Otherwise the per tile errors are kept in tile_errors.'''
+
+        if self.size_mismatch():
+            return 0.0
+
+        if threshold is None:
+            return self._tile_errors(tile_size)
+
+        width, height = self.src_im.size
+        square_error = 0
+        remaining_error = width*height*3*255*255
+        # Square error above which the precision drops below threshold
+        max_square_error = (self._denominator() * 2.0**-threshold - 1) / 2
+
+        upper = 0
+        band_size = tile_size
+        while upper < height:
+            lower = min(upper + band_size, height)
+            if upper == 0 and lower == height:
+                diff = self.diff
+            elif self._diff is not None:
+                diff = self._diff.crop((0, upper, width, lower))
+            else:
+                box = (0, upper, width, lower)
+                diff = ImageChops.difference(self.src_im.crop(box), self.ref_im.crop(box))
+            square_error += self._square_error(diff)
+            remaining_error -= width*(lower - upper)*3*255*255
+            if square_error > max_square_error or \
+               square_error + remaining_error <= max_square_error:
+                break
+            upper = lower
+            band_size *= 2
+
+        return self._bits(square_error)
+
+    def _tile_errors(self, tile_size):
+        # Square error of every tile, in a single pass over the difference
+        import numpy
+
+        width, height = self.src_im.size
+        diff = numpy.asarray(self.diff, dtype=numpy.uint8)
+        if diff.ndim == 3:
+            square = numpy.square(diff[:, :, :3], dtype=numpy.uint32).sum(axis=2, dtype=numpy.uint32)
+        else:
+            square = numpy.square(diff, dtype=numpy.uint32)
+        rows = numpy.add.reduceat(square, numpy.arange(0, height, tile_size), axis=0, dtype=numpy.int64)
+        tiles = numpy.add.reduceat(rows, numpy.arange(0, width, tile_size), axis=1, dtype=numpy.int64)
+
+        tile_errors = {}
+        for i in range(tiles.shape[0]):
+            upper = i*tile_size
+            lower = min(upper + tile_size, height)
+            for j in range(tiles.shape[1]):
+                left = j*tile_size
+                right = min(left + tile_size, width)
+                tile_errors[(left, upper, right, lower)] = int(tiles[i, j])
+        self.tile_errors = tile_errors
+        return self._bits(int(tiles.sum()))
+
+    def diff_box(self, tile_size = 64):
+        '''Bounding box of the tiles that differ, or None if none does.'''
+
+        if self.size_mismatch():
+            return None
+        if self.tile_errors is None:
+            self.tiled_precision(tile_size = tile_size)
+
+        boxes = [box for box, error in self.tile_errors.items() if error]
+        if not boxes:
+            return None
+        return (
+            min([box[0] for box in boxes]),
+            min([box[1] for box in boxes]),
+            max([box[2] for box in boxes]),
+            max([box[3] for box in boxes]),
+        )
+
+    def _square_error(self, diff):
         # See also http://effbot.org/zone/pil-comparing-images.htm
         h = diff.histogram()
         square_error = 0
         for i in range(1, 256):
             square_error += sum(h[i : 3*256: 256])*i*i
-        rel_error = float(square_error*2 + 1) / float(self.diff.size[0]*self.diff.size[1]*3*255*255*2)
+        return square_error
+
+    def _denominator(self):
+        width, height = self.src_im.size
+        return float(width*height*3*255*255*2)
+
+    def _bits(self, square_error):
+        rel_error = float(square_error*2 + 1) / self._denominator()
         bits = -math.log(rel_error)/math.log(2.0)
         return bits
 
@@ -123,13 +242,13 @@ class Comparer:
         return ae
 
 
-def surface(html, image):
+def surface(html, image, cached = False):
     if True:
         name, ext = os.path.splitext(image)
         thumb = name + '.thumb' + ext
         if os.path.exists(image) \
            and (not os.path.exists(thumb) \
-                or os.path.getmtime(thumb) < os.path.getmtime(image)):
+                or (not cached and os.path.getmtime(thumb) < os.path.getmtime(image))):
             im = Image.open(image)
             imageWidth, imageHeight = im.size
             if imageWidth <= thumbSize and imageHeight <= thumbSize:
@@ -139,7 +258,7 @@ def surface(html, image):
                 else:
                     imageWidth = imageWidth*thumbSize/imageHeight
                     imageHeight = thumbSize
-                html.write('        <td><img src="%s" width="%u" height="%u"/></td>\n' % (image, imageWidth, imageHeight))
+                html.write('        <td><img src="%s" width="%u" height="%u" loading="lazy"/></td>\n' % (image, imageWidth, imageHeight))
                 return
 
             im.thumbnail((thumbSize, thumbSize))
@@ -149,32 +268,394 @@ def surface(html, image):
                 thumb = image
     else:
         thumb = image
-    html.write('        <td><a href="%s"><img src="%s"/></a></td>\n' % (image, thumb))
+    html.write('        <td><a href="%s"><img src="%s" loading="lazy"/></a></td>\n' % (image, thumb))
 
 
 def is_image(path):
     name = os.path.basename(path)
     name, ext1 = os.path.splitext(name)
+    if ext1 not in ('.png', '.bmp'):
+        return False
     name, ext2 = os.path.splitext(name)
-    return ext1 in ('.png', '.bmp') and ext2 not in ('.diff', '.thumb')
+    return ext2 not in ('.diff', '.thumb')
+
+
+def listdir(dirname):
+    '''List the subdirectories and image files of a directory.'''
+
+    dirs = []
+    files = []
+    try:
+        entries = list(os.scandir(dirname or os.curdir))
+    except OSError:
+        # Missing directory, as os.walk would have
+        return dirs, files
+    for entry in entries:
+        try:
+            if entry.is_dir():
+                dirs.append(entry.name)
+            elif entry.is_file() and is_image(entry.name):
+                files.append(entry.name)
+        except OSError:
+            # Dangling symlinks, etc.
+            pass
+    return dirs, files
+
+
+class ImageIndex:
+    '''Persisted image directory listings.
+
+    A directory is only listed again when its modification time changes,
+    which is much cheaper than walking snapshot stores on network mounts.
+
+    Files added within the filesystem's timestamp granularity of a listing
+    leave the modification time unchanged, so listings of directories
+    modified that recently are not trusted, and are taken again next time.'''
+
+    # Nanoseconds within which a modification time may not change
+    racyInterval = 2*1000*1000*1000
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.dirty = False
+        try:
+            self.entries = json.load(open(filename, 'rt'))
+        except (IOError, ValueError):
+            self.entries = {}
+
+    def listdir(self, dirname):
+        key = os.path.abspath(dirname or os.curdir)
+        try:
+            mtime = os.stat(key).st_mtime_ns
+        except OSError:
+            return [], []
+        entry = self.entries.get(key)
+        if entry is None or entry['mtime'] != mtime:
+            dirs, files = listdir(dirname)
+            if time.time()*1e9 - mtime < self.racyInterval:
+                mtime = None
+            entry = {'mtime': mtime, 'dirs': dirs, 'files': files}
+            self.entries[key] = entry
+            self.dirty = True
+        return entry['dirs'], entry['files']
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmpname = self.filename + '.tmp'
+        stream = open(tmpname, 'wt')
+        json.dump(self.entries, stream)
+        stream.close()
+        os.replace(tmpname, self.filename)
+        self.dirty = False
 
 
-def find_images(prefix):
+def find_images(prefix, index = None):
     if os.path.isdir(prefix):
         prefix_dir = prefix
     else:
         prefix_dir = os.path.dirname(prefix)
 
     images = []
-    for dirname, dirnames, filenames in os.walk(prefix_dir, followlinks=True):
+    pending = [prefix_dir]
+    while pending:
+        dirname = pending.pop()
+        if index is not None:
+            dirnames, filenames = index.listdir(dirname)
+        else:
+            dirnames, filenames = listdir(dirname)
         for filename in filenames:
             filepath = os.path.join(dirname, filename)
-            if filepath.startswith(prefix) and is_image(filepath):
+            if filepath.startswith(prefix):
                 images.append(filepath[len(prefix):])
+        for subdirname in dirnames:
+            # Only descend into directories which can contain matches
+            subdirpath = os.path.join(dirname, subdirname)
+            if subdirpath.startswith(prefix) or prefix.startswith(subdirpath + os.path.sep):
+                pending.append(subdirpath)
 
     return images
 
 
+def hash_file(path):
+    '''Hash the file contents, or return None if the file doesn't exist.'''
+
+    try:
+        stream = open(path, 'rb')
+    except IOError:
+        return None
+    h = hashlib.sha1()
+    while True:
+        data = stream.read(1 << 20)
+        if not data:
+            break
+        h.update(data)
+    stream.close()
+    return h.hexdigest()
+
+
+class Manifest:
+    '''Cache of comparison results, keyed by the image contents.
+
+    Stored as JSON lines, appended as results come in, where later lines
+    override earlier ones for the same image.'''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {}
+        try:
+            stream = open(filename, 'rt')
+        except IOError:
+            pass
+        else:
+            for line in stream:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Truncated line from an interrupted run
+                    continue
+                self.entries[entry['image']] = entry
+            stream.close()
+        self.stream = open(filename, 'at')
+
+    def get(self, image):
+        return self.entries.get(image)
+
+    def update(self, entry):
+        if self.entries.get(entry['image']) == entry:
+            return
+        self.entries[entry['image']] = entry
+        self.stream.write(json.dumps(entry) + '\n')
+        self.stream.flush()
+
+    def close(self, images):
+        '''Compact the manifest, dropping images which no longer exist.'''
+
+        self.stream.close()
+        tmpname = self.filename + '.tmp'
+        stream = open(tmpname, 'wt')
+        for image in images:
+            entry = self.entries.get(image)
+            if entry is not None:
+                stream.write(json.dumps(entry) + '\n')
+        stream.close()
+        os.replace(tmpname, self.filename)
+
+
+class Report:
+    '''Single page HTML report, written as results come in.'''
+
+    def __init__(self, filename, header):
+        if filename:
+            self.html = open(filename, 'wt')
+        else:
+            self.html = sys.stdout
+        self.html.write('<html>\n')
+        self.html.write('  <body>\n')
+        self.html.write('    <table border="1">\n')
+        self.html.write(header)
+
+    def add(self, image, result, row):
+        self.html.write(row)
+        self.html.flush()
+
+    def close(self):
+        self.html.write('    </table>\n')
+        self.html.write('  </body>\n')
+        self.html.write('</html>\n')
+
+
+class PagedReport:
+    '''HTML report split in several pages, with mismatches first, plus an
+    index page with summary statistics.'''
+
+    def __init__(self, filename, header, page_size):
+        self.filename = filename
+        self.header = header
+        self.page_size = page_size
+        self.rows = []
+        self.counts = {}
+
+    def add(self, image, result, row):
+        self.rows.append((result == 'MATCH', len(self.rows), image, result, row))
+        self.counts[result] = self.counts.get(result, 0) + 1
+
+    def page_name(self, page):
+        root, ext = os.path.splitext(self.filename)
+        return '%s-%04u%s' % (root, page, ext or '.html')
+
+    def close(self):
+        self.rows.sort()
+        pages = []
+        for start in range(0, len(self.rows), self.page_size):
+            pages.append(self.rows[start : start + self.page_size])
+
+        html = open(self.filename, 'wt')
+        html.write('<html>\n')
+        html.write('  <body>\n')
+        html.write('    <table border="1">\n')
+        html.write('      <tr><th>Total</th><td>%u</td></tr>\n' % len(self.rows))
+        for result in ('MISMATCH', 'MISSING', 'MATCH'):
+            html.write('      <tr><th>%s</th><td>%u</td></tr>\n' % (result.capitalize(), self.counts.get(result, 0)))
+        html.write('    </table>\n')
+        html.write('    <ol>\n')
+        for page, rows in enumerate(pages):
+            failures = len([row for row in rows if not row[0]])
+            html.write('      <li><a href="%s">%s &ndash; %s</a> (%u failures)</li>\n' % (
+                os.path.basename(self.page_name(page + 1)), rows[0][2], rows[-1][2], failures))
+        html.write('    </ol>\n')
+        html.write('  </body>\n')
+        html.write('</html>\n')
+        html.close()
+
+        for page, rows in enumerate(pages):
+            html = open(self.page_name(page + 1), 'wt')
+            html.write('<html>\n')
+            html.write('  <body>\n')
+            html.write('    <p>%s</p>\n' % self.navigation(page + 1, len(pages)))
+            html.write('    <table border="1">\n')
+            html.write(self.header)
+            for row in rows:
+                html.write(row[4])
+            html.write('    </table>\n')
+            html.write('    <p>%s</p>\n' % self.navigation(page + 1, len(pages)))
+            html.write('  </body>\n')
+            html.write('</html>\n')
+            html.close()
+
+    def navigation(self, page, num_pages):
+        links = ['<a href="%s">Index</a>' % os.path.basename(self.filename)]
+        if page > 1:
+            links.append('<a href="%s">Previous</a>' % os.path.basename(self.page_name(page - 1)))
+        links.append('Page %u of %u' % (page, num_pages))
+        if page < num_pages:
+            links.append('<a href="%s">Next</a>' % os.path.basename(self.page_name(page + 1)))
+        return ' | '.join(links)
+
+
+def delta_name(src_image):
+    root, ext = os.path.splitext(src_image)
+    return "%s.diff.png" % (root, )
+
+
+def lookup(args):
+    '''Look up the image pair in the manifest.
+
+    Returns the manifest key, and whether the recorded result can be reused
+    because the contents didn't change.'''
+
+    image, ref_image, src_image, options, entry = args
+    if not options.manifest:
+        return None, False
+
+    key = {
+        'image': image,
+        'ref': hash_file(ref_image),
+        'src': hash_file(src_image),
+        'fuzz': options.fuzz,
+        'alpha': options.alpha,
+        'metrics': options.metrics,
+    }
+    cached = False
+    if entry is not None and all([entry.get(name) == value for name, value in key.items()]):
+        # The delta image is linked from the report for mismatches, and for
+        # matches too with --show-all, so it must still be there
+        result = entry['result']
+        needs_delta = result == 'MISMATCH' or (result == 'MATCH' and options.show_all)
+        cached = not needs_delta or os.path.exists(delta_name(src_image))
+    return key, cached
+
+
+def compare_batch(batch):
+    '''Compare a batch of image pairs.
+
+    Runs in a worker process, so that the per-task overhead is amortized over
+    several pairs.'''
+
+    options = batch[0][3]
+    lookups = [lookup(args) for args in batch]
+    metrics = [None]*len(batch)
+    if options.metrics:
+        import imagemetrics
+        indices = [i for i in range(len(batch))
+                   if not lookups[i][1]
+                   and os.path.exists(batch[i][1])
+                   and os.path.exists(batch[i][2])]
+        values = imagemetrics.compare(
+            [batch[i][1] for i in indices],
+            [batch[i][2] for i in indices],
+            fuzz=options.fuzz, alpha=options.alpha)
+        for i, value in zip(indices, values):
+            metrics[i] = value
+    return [compare(args, lookups[i], metrics[i]) for i, args in enumerate(batch)]
+
+
+def compare(args, lookup, metrics = None):
+    '''Compare an image pair and generate its diff image and thumbnails.
+
+    Takes and returns picklable values only.  Returns the comparison result,
+    whether it is a match, the HTML of the table row, and the manifest entry
+    (if any).'''
+
+    image, ref_image, src_image, options, entry = args
+    key, cached = lookup
+
+    delta_image = delta_name(src_image)
+
+    title = ''
+    if cached:
+        # Reuse the previous result as the contents didn't change
+        comparer = None
+        result = entry['result']
+        match = {'MATCH': True, 'MISMATCH': False}.get(result)
+        bgcolor = match and '#20ff20' or '#ff2020'
+    elif os.path.exists(ref_image) and os.path.exists(src_image):
+        if metrics is not None:
+            import imagemetrics
+            match = imagemetrics.passes(metrics, options.thresholds)
+            title = ' title="%s"' % ' '.join(['%s=%g' % (name, metrics[name]) for name in imagemetrics.metricNames])
+            comparer = None
+            if not match or options.show_all:
+                comparer = Comparer(ref_image, src_image, options.alpha)
+        else:
+            comparer = Comparer(ref_image, src_image, options.alpha)
+            match = comparer.ae(fuzz=options.fuzz) == 0
+        if match:
+            result = 'MATCH'
+            bgcolor = '#20ff20'
+        else:
+            result = 'MISMATCH'
+            bgcolor = '#ff2020'
+    else:
+        comparer = None
+        match = None
+        result = 'MISSING'
+        bgcolor = '#ff2020'
+
+    html = io.StringIO()
+    html.write('      <tr>\n')
+    html.write('        <td bgcolor="%s"%s><a href="%s">%s<a/></td>\n' % (bgcolor, title, ref_image, image))
+    if not match or options.show_all:
+        if comparer is not None \
+           and (options.overwrite \
+                or not os.path.exists(delta_image) \
+                 or (os.path.getmtime(delta_image) < os.path.getmtime(ref_image) \
+                     and os.path.getmtime(delta_image) < os.path.getmtime(src_image))):
+                comparer.write_diff(delta_image, fuzz=options.fuzz)
+        surface(html, ref_image, cached)
+        surface(html, src_image, cached)
+        surface(html, delta_image, cached)
+    html.write('      </tr>\n')
+
+    if options.manifest:
+        entry = key
+        entry['result'] = result
+    else:
+        entry = None
+
+    return result, match, html.getvalue(), entry
+
+
 def main():
     global options
 
@@ -204,72 +685,97 @@ def main():
         '--show-all',
         action="store_true", dest="show_all", default=False,
         help="show all images, including similar ones")
+    optparser.add_option(
+        '-m', '--metric', metavar='NAME=THRESHOLD',
+        type="string", action="append", dest="metrics", default=[],
+        help="compare with the given metric threshold (ae, max_error, psnr, or ssim) instead of the fuzzed absolute error")
+    optparser.add_option(
+        '--page-size', metavar='N',
+        type="int", dest="page_size", default=0,
+        help="split the report in pages of N images, mismatches first [default: single page]")
+    optparser.add_option(
+        '--manifest', metavar='FILE',
+        type="string", dest="manifest", default=None,
+        help="cache results in FILE, keyed by image contents, to only compare changed images")
+    optparser.add_option(
+        '--image-index', metavar='FILE',
+        type="string", dest="image_index", default=None,
+        help="persist image directory listings in FILE, refreshing only modified directories")
+    optparser.add_option(
+        '-j', '--jobs', metavar='N',
+        type="int", dest="jobs", default=os.cpu_count() or 1,
+        help="number of worker processes [default: %default]")
 
     (options, args) = optparser.parse_args(sys.argv[1:])
 
     if len(args) != 2:
         optparser.error('incorrect number of arguments')
+    if options.page_size and not options.output:
+        optparser.error('paginated reports need an output filename')
+    if options.metrics:
+        import imagemetrics
+        try:
+            options.thresholds = imagemetrics.parse_thresholds(options.metrics)
+        except ValueError as ex:
+            optparser.error(str(ex))
 
     ref_prefix = args[0]
     src_prefix = args[1]
 
-    ref_images = find_images(ref_prefix)
-    src_images = find_images(src_prefix)
+    if options.image_index:
+        index = ImageIndex(options.image_index)
+    else:
+        index = None
+    ref_images = find_images(ref_prefix, index)
+    src_images = find_images(src_prefix, index)
+    if index is not None:
+        index.save()
     images = list(set(ref_images).union(set(src_images)))
     images.sort()
 
-    if options.output:
-        html = open(options.output, 'wt')
+    header = '      <tr><th>File</th><th>%s</th><th>%s</th><th>&Delta;</th></tr>\n' % (ref_prefix, src_prefix)
+    if options.page_size:
+        report = PagedReport(options.output, header, options.page_size)
+    else:
+        report = Report(options.output, header)
+
+    if options.manifest:
+        manifest = Manifest(options.manifest)
+        entries = [manifest.get(image) for image in images]
     else:
-        html = sys.stdout
-    html.write('<html>\n')
-    html.write('  <body>\n')
-    html.write('    <table border="1">\n')
-    html.write('      <tr><th>File</th><th>%s</th><th>%s</th><th>&Delta;</th></tr>\n' % (ref_prefix, src_prefix))
+        manifest = None
+        entries = [None]*len(images)
+
+    work = [(image, ref_prefix + image, src_prefix + image, options, entry) for image, entry in zip(images, entries)]
+    batches = [work[i : i + batchSize] for i in range(0, len(work), batchSize)]
+    if options.jobs > 1:
+        pool = multiprocessing.Pool(options.jobs)
+        # Results come back in the original (sorted) order
+        results = pool.imap(compare_batch, batches)
+    else:
+        pool = None
+        results = map(compare_batch, batches)
+    results = itertools.chain.from_iterable(results)
+
     failures = 0
-    for image in images:
-        ref_image = ref_prefix + image
-        src_image = src_prefix + image
-        root, ext = os.path.splitext(src_image)
-        delta_image = "%s.diff.png" % (root, )
-        if os.path.exists(ref_image) and os.path.exists(src_image):
+    try:
+        for (image, ref_image, src_image, _, _), (result, match, row, entry) in zip(work, results):
             if options.verbose:
-                sys.stdout.write('Comparing %s and %s ...' % (ref_image, src_image))
-            comparer = Comparer(ref_image, src_image, options.alpha)
-            match = comparer.ae(fuzz=options.fuzz) == 0
-            if match:
-                result = 'MATCH'
-                bgcolor = '#20ff20'
-            else:
-                result = 'MISMATCH'
+                sys.stdout.write('Comparing %s and %s ... %s\n' % (ref_image, src_image, result))
+            if not match:
                 failures += 1
-                bgcolor = '#ff2020'
-        else:
-            comparer = None
-            match = None
-            result = 'MISSING'
-            failures += 1
-            bgcolor = '#ff2020'
-
-        if options.verbose:
-            sys.stdout.write(' %s\n' % (result,))
-        html.write('      <tr>\n')
-        html.write('        <td bgcolor="%s"><a href="%s">%s<a/></td>\n' % (bgcolor, ref_image, image))
-        if not match or options.show_all:
-            if comparer is not None \
-               and (options.overwrite \
-                    or not os.path.exists(delta_image) \
-                     or (os.path.getmtime(delta_image) < os.path.getmtime(ref_image) \
-                         and os.path.getmtime(delta_image) < os.path.getmtime(src_image))):
-                    comparer.write_diff(delta_image, fuzz=options.fuzz)
-            surface(html, ref_image)
-            surface(html, src_image)
-            surface(html, delta_image)
-        html.write('      </tr>\n')
-        html.flush()
-    html.write('    </table>\n')
-    html.write('  </body>\n')
-    html.write('</html>\n')
+            if manifest is not None:
+                manifest.update(entry)
+            report.add(image, result, row)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if manifest is not None:
+        manifest.close(images)
+
+    report.close()
 
     if failures:
         sys.exit(1)
@@ -31,14 +31,21 @@ details.
 '''
 
 
+import collections
+import json
 import optparse
 import os.path
 import platform
 import re
 import subprocess
 import sys
+import threading
 import traceback
 
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
 import snapdiff
 import retracediff
 
@@ -87,6 +94,200 @@ def which(executable):
     return False
 
 
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    return 0.5*(values[(n - 1)//2] + values[n//2])
+
+
+def medianInterval(values, confidence=0.95):
+    '''Distribution-free confidence interval of the median, from order
+    statistics.
+
+    Returns the widest interval, (min, max), when there are too few values to
+    reach the confidence.'''
+
+    values = sorted(values)
+    n = len(values)
+
+    # Largest k such that P(Binomial(n, 1/2) < k) <= (1 - confidence)/2
+    tail = 0.0
+    # P(Binomial(n, 1/2) == k)
+    probability = 0.5**n
+    k = 0
+    while k < n:
+        if tail + probability > (1.0 - confidence)/2:
+            break
+        tail += probability
+        probability = probability * (n - k) / (k + 1)
+        k += 1
+    k = max(k, 1)
+    return values[k - 1], values[n - k]
+
+
+def measureFrameTime(retracer, loop):
+    '''Average frame time of a benchmark replay, in seconds.'''
+
+    returncode, result = retracer.benchmark(loop)
+    if returncode:
+        sys.stderr.write('retrace failed with %d\n' % returncode)
+        bad()
+    if result is None:
+        sys.stderr.write('retrace did not report the frame rate\n')
+        skip()
+    frames, seconds = result
+    if frames == 0:
+        skip()
+    frameTime = seconds/frames
+    sys.stderr.write('%u frames in %.3f secs, %.3f ms per frame\n' % (frames, seconds, frameTime*1e3))
+    return frameTime
+
+
+def checkPerformance(retracer, options):
+    '''Compare the median frame time against the baseline, replaying more
+    times while the result is inconclusive.'''
+
+    frameTimes = []
+    for i in range(options.perf_runs):
+        frameTimes.append(measureFrameTime(retracer, options.perf_loop))
+
+    if options.perf_save:
+        frameTime = median(frameTimes)
+        baseline = {
+            'frame_time': frameTime,
+            'fps': 1.0/frameTime,
+            'frame_times': frameTimes,
+        }
+        json.dump(baseline, open(options.perf_baseline, 'wt'), indent=2)
+        sys.stderr.write('saved baseline of %.3f ms per frame\n' % (frameTime*1e3))
+        good()
+
+    try:
+        baseline = json.load(open(options.perf_baseline, 'rt'))
+    except (IOError, ValueError) as ex:
+        sys.stderr.write('error: failed to load baseline %s: %s\n' % (options.perf_baseline, ex))
+        abort()
+    threshold = baseline['frame_time']*(1.0 + options.perf_tolerance)
+
+    while True:
+        frameTime = median(frameTimes)
+        lower, upper = medianInterval(frameTimes)
+        sys.stderr.write('median %.3f ms per frame, interval [%.3f, %.3f] ms, threshold %.3f ms\n' % (
+            frameTime*1e3, lower*1e3, upper*1e3, threshold*1e3))
+        if upper <= threshold:
+            good()
+        if lower > threshold:
+            bad()
+        if len(frameTimes) >= options.perf_max_runs:
+            break
+        frameTimes.append(measureFrameTime(retracer, options.perf_loop))
+
+    # Still inconclusive, so judge by the median, unless the measurements are
+    # too noisy to resolve the tolerance
+    frameTimes.sort()
+    quartile = (len(frameTimes) - 1)//4
+    if (frameTimes[-1 - quartile] - frameTimes[quartile])/frameTime > options.perf_tolerance:
+        sys.stderr.write('measurements too noisy\n')
+        skip()
+    if frameTime > threshold:
+        bad()
+    good()
+
+
+def loadReference(filename):
+    '''Decode a reference snapshot.'''
+
+    return Image.open(filename).convert('RGB')
+
+
+def compareSnapshot(refFuture, srcImage, threshold):
+    '''Whether the snapshot mismatches its (decoded) reference image.'''
+
+    comparer = snapdiff.Comparer(refFuture.result(), srcImage)
+    return comparer.tiled_precision(threshold) < threshold
+
+
+def checkSnapshots(retracer, refImages, options):
+    '''Compare the snapshots against the reference images while they are
+    being produced, stopping the replay on the first mismatch.
+
+    Reference images are decoded ahead of the replay, a bounded window at a
+    time, and the comparisons run on a thread pool, while the main thread
+    keeps reading snapshots from the retrace process.'''
+
+    callNos = sorted(refImages)
+    window = 2*options.jobs
+    decoder = ThreadPoolExecutor(max_workers=options.jobs)
+    comparator = ThreadPoolExecutor(max_workers=options.jobs)
+
+    # Decoded reference images, in call order
+    references = collections.OrderedDict()
+    nextRef = 0
+
+    pending = collections.deque()
+    mismatch = threading.Event()
+
+    run = retracer.snapshot(','.join(map(str, callNos)))
+
+    def done(future):
+        if not future.cancelled() and future.exception() is None and future.result():
+            # Don't wait for the main thread, which might be blocked reading
+            mismatch.set()
+            run.terminate()
+
+    try:
+        while not mismatch.is_set():
+            while nextRef < len(callNos) and len(references) < window:
+                callNo = callNos[nextRef]
+                references[callNo] = decoder.submit(loadReference, refImages[callNo])
+                nextRef += 1
+
+            try:
+                srcImage, callNo = run.nextSnapshot()
+            except Exception:
+                # Truncated snapshot from a terminated replay
+                if mismatch.is_set():
+                    break
+                raise
+            if srcImage is None:
+                break
+
+            # Drop references of snapshots that were not produced
+            while references and next(iter(references)) < callNo:
+                references.popitem(last=False)[1].cancel()
+            refFuture = references.pop(callNo, None)
+            if refFuture is None:
+                refFuture = decoder.submit(loadReference, refImages[callNo])
+
+            future = comparator.submit(compareSnapshot, refFuture, srcImage, options.precision_threshold)
+            future.add_done_callback(done)
+            pending.append(future)
+
+            # Limit the number of snapshots held in memory
+            while len(pending) > window:
+                pending.popleft().result()
+
+        if not mismatch.is_set():
+            for future in pending:
+                future.result()
+    finally:
+        # Drop the work that is no longer needed
+        for future in pending:
+            future.cancel()
+        for future in references.values():
+            future.cancel()
+        decoder.shutdown(wait=False)
+        comparator.shutdown(wait=False)
+
+    if mismatch.is_set():
+        run.terminate()
+        run.process.wait()
+        bad()
+    run.process.wait()
+    if run.process.returncode:
+        skip()
+
+
 def main():
     '''Main program.
 
@@ -117,10 +318,42 @@ def main():
         '-c', '--compare', metavar='PREFIX',
         type='string', dest='compare_prefix', default=None,
         help='snapshot comparison prefix')
+    optparser.add_option(
+        '--image-index', metavar='FILE',
+        type='string', dest='image_index', default=None,
+        help='persist snapshot directory listings in FILE')
+    optparser.add_option(
+        '-j', '--jobs', metavar='N',
+        type='int', dest='jobs', default=os.cpu_count() or 1,
+        help='number of snapshot comparison threads [default: %default]')
     optparser.add_option(
         '--precision-threshold', metavar='BITS',
         type='float', dest='precision_threshold', default=8.0,
         help='precision threshold in bits [default: %default]')
+    optparser.add_option(
+        '--perf-baseline', metavar='FILE',
+        type='string', dest='perf_baseline', default=None,
+        help='check the median frame time of benchmark replays against the baseline in FILE')
+    optparser.add_option(
+        '--perf-save',
+        action='store_true', dest='perf_save', default=False,
+        help='measure and save the baseline to the --perf-baseline FILE instead')
+    optparser.add_option(
+        '--perf-tolerance', metavar='FRACTION',
+        type='float', dest='perf_tolerance', default=0.05,
+        help='allowed frame time increase over the baseline [default: %default]')
+    optparser.add_option(
+        '--perf-runs', metavar='N',
+        type='int', dest='perf_runs', default=5,
+        help='number of benchmark replays [default: %default]')
+    optparser.add_option(
+        '--perf-max-runs', metavar='N',
+        type='int', dest='perf_max_runs', default=15,
+        help='maximum number of benchmark replays when results are inconclusive [default: %default]')
+    optparser.add_option(
+        '--perf-loop', metavar='N',
+        type='int', dest='perf_loop', default=0,
+        help='replay the final frame N more times [default: %default]')
     optparser.add_option(
         '--gl-renderer', metavar='REGEXP',
         type='string', dest='gl_renderer_re', default='^.*$',
@@ -129,6 +362,12 @@ def main():
     (options, args) = optparser.parse_args(sys.argv[1:])
     if not args:
         optparser.error("incorrect number of arguments")
+    if options.jobs < 1:
+        optparser.error("invalid number of jobs %r" % options.jobs)
+    if options.perf_save and not options.perf_baseline:
+        optparser.error("--perf-save requires --perf-baseline")
+    if options.perf_runs < 1 or options.perf_max_runs < options.perf_runs:
+        optparser.error("invalid number of benchmark replays")
 
     # Build the source
     if options.build:
@@ -172,9 +411,14 @@ def main():
 
     if options.compare_prefix:
         refImages = {}
-        callNos = []
-            
-        images = snapdiff.find_images(options.compare_prefix)
+
+        if options.image_index:
+            index = snapdiff.ImageIndex(options.image_index)
+        else:
+            index = None
+        images = snapdiff.find_images(options.compare_prefix, index)
+        if index is not None:
+            index.save()
         images.sort()
         for image in images:
             imageName, ext = os.path.splitext(image)
@@ -183,32 +427,16 @@ def main():
             except ValueError:
                 continue
             refImages[callNo] = options.compare_prefix + image
-            callNos.append(callNo)
-
-        run = retracer.snapshot(','.join(map(str, callNos)))
-        while True:
-            srcImage, callNo = run.nextSnapshot()
-            if srcImage is None:
-                break
-
-            refImage = refImages[callNo]
-
-            # Compare the two images
-            comparer = snapdiff.Comparer(refImage, srcImage)
-            precision = comparer.precision()
 
-            mismatch = precision < options.precision_threshold
-            if mismatch:
-                bad()
-        run.process.wait()
-        if run.process.returncode:
-            skip()
-    else:
+        checkSnapshots(retracer, refImages, options)
+    elif not options.perf_baseline:
         returncode = retracer.retrace('-b')
         if returncode:
             bad()
 
-    # TODO: allow more criterias here, such as, performance threshold
+    # Benchmark replays also catch crashes
+    if options.perf_baseline:
+        checkPerformance(retracer, options)
 
     # Success
     good()
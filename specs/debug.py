@@ -27,8 +27,6 @@
 
 
 import sys
-import traceback
-import inspect
 
 
 def excepthook(type, value, tb):
@@ -26,6 +26,7 @@
 """C basic types"""
 
 
+import re
 import sys
 
 from . import debug
@@ -36,6 +37,11 @@ class Type:
 
     __tags = set()
 
+    # Next suffix to try for each tag, as tags are never released
+    __suffixes = {}
+
+    __nonTagChars = re.compile(r'[^0-9A-Za-z_]')
+
     def __init__(self, expr, tag = None):
         self.expr = expr
 
@@ -44,7 +50,7 @@ class Type:
         # the type.
         if tag is None:
             if expr is not None:
-                tag = ''.join([c for c in expr if c.isalnum() or c in '_'])
+                tag = Type.__nonTagChars.sub('', expr)
             else:
                 tag = 'anonynoums'
         else:
@@ -53,9 +59,10 @@ class Type:
 
         # Ensure it is unique.
         if tag in Type.__tags:
-            suffix = 1
+            suffix = Type.__suffixes.get(tag, 1)
             while tag + str(suffix) in Type.__tags:
                 suffix += 1
+            Type.__suffixes[tag] = suffix + 1
             tag += str(suffix)
 
         assert tag not in Type.__tags
@@ -73,9 +80,9 @@ class Type:
     def mutable(self):
         '''Return a mutable version of this type.
 
-        Convenience wrapper around MutableRebuilder.'''
-        visitor = MutableRebuilder()
-        return visitor.visit(self)
+        Convenience wrapper around MutableRebuilder.  Results are shared
+        between calls.'''
+        return _mutableRebuilder.visit(self)
 
     def depends(self, other):
         '''Whether this type depends on another.'''
@@ -274,17 +281,20 @@ def EnumFlags(name, values):
 
 class Array(Type):
 
+    # Length expressions already known not to be constant
+    __variableLengths = set()
+
     def __init__(self, type_, length):
         Type.__init__(self, type_.expr + " *")
         self.type = type_
         self.length = length
-        if not isinstance(length, int):
+        if not isinstance(length, int) and length not in Array.__variableLengths:
             assert isinstance(length, str)
             # Check if length is actually a valid constant expression
             try:
                 eval(length, {}, {})
             except:
-                pass
+                Array.__variableLengths.add(length)
             else:
                 raise ValueError("length %r should be an integer" % length)
 
@@ -717,26 +727,41 @@ class Rebuilder(Visitor):
 
     def visitStruct(self, struct):
         members = [(self.visit(type), name) for type, name in struct.members]
-        return Struct(struct.name, members)
+        if all([type is member[0] for type, member in zip(members, struct.members)]):
+            return struct
+        else:
+            return Struct(struct.name, members)
 
     def visitArray(self, array):
         type = self.visit(array.type)
-        return Array(type, array.length)
+        if type is array.type:
+            return array
+        else:
+            return Array(type, array.length)
 
     def visitAttribArray(self, array):
         type = self.visit(array.baseType)
-        return AttribArray(type, array.valueTypes, array.terminator)
+        if type is array.baseType:
+            return array
+        else:
+            return AttribArray(type, array.valueTypes, array.terminator)
 
     def visitBlob(self, blob):
         type = self.visit(blob.type)
-        return Blob(type, blob.size)
+        if type is blob.type:
+            return blob
+        else:
+            return Blob(type, blob.size)
 
     def visitEnum(self, enum):
         return enum
 
     def visitBitmask(self, bitmask):
         type = self.visit(bitmask.type)
-        return Bitmask(type, bitmask.values)
+        if type is bitmask.type:
+            return bitmask
+        else:
+            return Bitmask(type, bitmask.values)
 
     def visitPointer(self, pointer):
         pointer_type = self.visit(pointer.type)
@@ -796,11 +821,28 @@ class Rebuilder(Visitor):
             defaultType = None
         else:
             defaultType = self.visit(polymorphic.defaultType)
+        if defaultType is polymorphic.defaultType and \
+           all([type is switchType for (_, type), (_, switchType) in zip(switchTypes, polymorphic.switchTypes)]):
+            return polymorphic
         return Polymorphic(switchExpr, switchTypes, defaultType, polymorphic.contextLess)
 
 
 class MutableRebuilder(Rebuilder):
-    '''Type visitor which derives a mutable type.'''
+    '''Type visitor which derives a mutable type.
+
+    Rebuilt types are memoized, so that each type is only rebuilt once, and
+    types sharing a subtype share its rebuilt version too.'''
+
+    def __init__(self):
+        self.__cache = {}
+
+    def visit(self, type):
+        try:
+            return self.__cache[type]
+        except KeyError:
+            mutableType = Rebuilder.visit(self, type)
+            self.__cache[type] = mutableType
+            return mutableType
 
     def visitString(self, string):
         return string
@@ -820,6 +862,8 @@ class MutableRebuilder(Rebuilder):
         # Strip out references
         return self.visit(reference.type)
 
+_mutableRebuilder = MutableRebuilder()
+
 
 class Traverser(Visitor):
     '''Visitor which all types.'''
@@ -964,22 +1008,42 @@ class Module:
         self.functions = []
         self.interfaces = []
 
+        # Lookup tables by name, built on demand
+        self.__functionsByName = None
+        self.__interfacesByName = None
+
     def addFunctions(self, functions):
         self.functions.extend(functions)
+        self.__functionsByName = None
 
     def addInterfaces(self, interfaces):
         self.interfaces.extend(interfaces)
+        self.__interfacesByName = None
 
     def mergeModule(self, module):
         self.headers.extend(module.headers)
         self.functions.extend(module.functions)
         self.interfaces.extend(module.interfaces)
+        self.__functionsByName = None
+        self.__interfacesByName = None
 
     def getFunctionByName(self, name):
-        for function in self.functions:
-            if function.name == name:
-                return function
-        return None
+        if self.__functionsByName is None:
+            self.__functionsByName = _indexByName(self.functions)
+        return self.__functionsByName.get(name)
+
+    def getInterfaceByName(self, name):
+        if self.__interfacesByName is None:
+            self.__interfacesByName = _indexByName(self.interfaces)
+        return self.__interfacesByName.get(name)
+
+
+def _indexByName(objects):
+    # The first object takes precedence, as with a linear search
+    index = {}
+    for obj in objects:
+        index.setdefault(obj.name, obj)
+    return index
 
 
 class API:
@@ -993,20 +1057,38 @@ class API:
         if modules is not None:
             self.modules.extend(modules)
 
+        # Collections derived from the modules, computed on demand
+        self.__cacheKey = None
+        self.__types = None
+        self.__interfaces = None
+        self.__interfacesByName = None
+
+    def __validateCache(self):
+        # Modules may still grow after being added
+        key = [(module, len(module.functions), len(module.interfaces)) for module in self.modules]
+        if key != self.__cacheKey:
+            self.__cacheKey = key
+            self.__types = None
+            self.__interfaces = None
+            self.__interfacesByName = None
+
     def getAllTypes(self):
-        collector = Collector()
-        for module in self.modules:
-            for function in module.functions:
-                for arg in function.args:
-                    collector.visit(arg.type)
-                collector.visit(function.type)
-            for interface in module.interfaces:
-                collector.visit(interface)
-                for method in interface.iterMethods():
-                    for arg in method.args:
+        self.__validateCache()
+        if self.__types is None:
+            collector = Collector()
+            for module in self.modules:
+                for function in module.functions:
+                    for arg in function.args:
                         collector.visit(arg.type)
-                    collector.visit(method.type)
-        return collector.types
+                    collector.visit(function.type)
+                for interface in module.interfaces:
+                    collector.visit(interface)
+                    for method in interface.iterMethods():
+                        for arg in method.args:
+                            collector.visit(arg.type)
+                        collector.visit(method.type)
+            self.__types = collector.types
+        return list(self.__types)
 
     def getAllFunctions(self):
         functions = []
@@ -1015,24 +1097,36 @@ class API:
         return functions
 
     def getAllInterfaces(self):
-        types = self.getAllTypes()
-        interfaces = [type for type in types if isinstance(type, Interface)]
-        for module in self.modules:
-            for interface in module.interfaces:
-                if interface not in interfaces:
-                    interfaces.append(interface)
-        return interfaces
+        self.__validateCache()
+        if self.__interfaces is None:
+            types = self.getAllTypes()
+            interfaces = [type for type in types if isinstance(type, Interface)]
+            seen = set(interfaces)
+            for module in self.modules:
+                for interface in module.interfaces:
+                    if interface not in seen:
+                        seen.add(interface)
+                        interfaces.append(interface)
+            self.__interfaces = interfaces
+        return list(self.__interfaces)
 
     def addModule(self, module):
         self.modules.append(module)
+        self.__cacheKey = None
 
     def getFunctionByName(self, name):
         for module in self.modules:
-            for function in module.functions:
-                if function.name == name:
-                    return function
+            function = module.getFunctionByName(name)
+            if function is not None:
+                return function
         return None
 
+    def getInterfaceByName(self, name):
+        self.__validateCache()
+        if self.__interfacesByName is None:
+            self.__interfacesByName = _indexByName(self.getAllInterfaces())
+        return self.__interfacesByName.get(name)
+
 
 # C string (i.e., zero terminated)
 CString = String(Char)